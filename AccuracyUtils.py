@@ -6,28 +6,51 @@ of the models
 '''
 import random
 
+from TrajectoryCorpus import TrajectoryCorpus
+
 ################################################################################
-def sampleSequences(sequences, ratio_testing):
+def sampleSequences(sequences, ratio_testing, weights = None):
 	'''
 	Cut sequences into training and testing subsets
 
 	Parameters:
 	-----------
-	sequences: list of (list of str)
+	sequences: list of (list of str) or TrajectoryCorpus
+	weights: list of int, number of occurrences of each sequence
+			 (see TrajectoryCorpus.deduplicate()). Each occurrence is
+			 drawn independently, a sequence can then be in both subsets.
 
 	Returns:
 	--------
-	build_seqs: list of (list of str)
-	test_seqs : list of (list of str)
+	build_seqs: list of (list of str) (TrajectoryCorpus if sequences is one)
+	test_seqs : list of (list of str) (TrajectoryCorpus if sequences is one)
+	build_weights, test_weights: list of int (only if weights is given)
 	'''
 	build_seqs = []
 	test_seqs  = []
+	build_weights = []
+	test_weights  = []
 	for i in range(len(sequences)):
-		if random.random() < ratio_testing:
-			test_seqs.append(sequences[i])
-		else:
-			build_seqs.append(sequences[i])
-	return build_seqs, test_seqs
+		if weights is None:
+			if random.random() < ratio_testing:
+				test_seqs.append(i)
+			else:
+				build_seqs.append(i)
+			continue
+		nb_test = sum([1 for _ in range(weights[i]) if random.random() < ratio_testing])
+		if nb_test > 0:
+			test_seqs.append(i)
+			test_weights.append(nb_test)
+		if nb_test < weights[i]:
+			build_seqs.append(i)
+			build_weights.append(weights[i] - nb_test)
+	if isinstance(sequences, TrajectoryCorpus):
+		build, test = sequences.subset(build_seqs), sequences.subset(test_seqs)
+	else:
+		build, test = [sequences[i] for i in build_seqs], [sequences[i] for i in test_seqs]
+	if weights is None:
+		return build, test
+	return build, test, build_weights, test_weights
 
 ################################################################################
 def numberOfRulesOfOrder(rules,order=1):
@@ -67,6 +90,7 @@ def probabilityNextSymb(rules, context, symb):
 	rules:  dict tuple of str -> dict (str -> float)
 	context: list of str
 	symb: str
+	(ids of a TrajectoryCorpus can be used instead of str)
 
 	Returns:
 	--------
@@ -195,3 +219,52 @@ def fonProbSeq(order2rules, seq):
 		res += p
 	return res / (len(seq) - 2.)
 
+################################################################################
+def averageProbSeqs(prob_seq, sequences, weights = None):
+	'''
+	Average of prob_seq(seq) over the sequences of length >= 3
+	(as in Eq. (10) of the paper)
+
+	Parameters:
+	-----------
+	prob_seq: function seq -> float (e.g. lambda seq: fonProbSeq(rules, seq))
+	sequences: list of (list of str) or TrajectoryCorpus
+	weights: list of int, number of occurrences of each sequence
+			 (None: 1 each), each distinct sequence is scored once
+
+	Returns:
+	--------
+	average: float (0. if there is no sequence of length >= 3)
+	nb_tested: float, number of sequences of length >= 3 (with their weights)
+	'''
+	score = 0.
+	nb_tested = 0.
+	for index_seq, seq in enumerate(sequences):
+		if len(seq) >= 3:
+			w = 1. if weights is None else float(weights[index_seq])
+			score += w * prob_seq(seq)
+			nb_tested += w
+	if nb_tested == 0.:
+		return 0., nb_tested
+	return score / nb_tested, nb_tested
+
+################################################################################
+def nonAggRulesProbSeqs(rules, sequences, weights = None):
+	'''
+	averageProbSeqs(..) of nonAggRulesProbSeq(rules, .)
+	'''
+	return averageProbSeqs(lambda seq: nonAggRulesProbSeq(rules, seq), sequences, weights)
+
+################################################################################
+def aggRulesProbSeqs(firstOrderRules, agg2ndOrderRules, sequences, weights = None):
+	'''
+	averageProbSeqs(..) of aggRulesProbSeq(firstOrderRules, agg2ndOrderRules, .)
+	'''
+	return averageProbSeqs(lambda seq: aggRulesProbSeq(firstOrderRules, agg2ndOrderRules, seq), sequences, weights)
+
+################################################################################
+def fonProbSeqs(order2rules, sequences, weights = None):
+	'''
+	averageProbSeqs(..) of fonProbSeq(order2rules, .)
+	'''
+	return averageProbSeqs(lambda seq: fonProbSeq(order2rules, seq), sequences, weights)
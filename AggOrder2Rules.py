@@ -12,9 +12,19 @@ HeapDict https://pypi.org/project/HeapDict/
 
 import HONUtils
 import heapdict
+import multiprocessing
+import numpy as np
+import time
+
+from StateGraph import StateGraph, aggLastSymbol
 
 from collections import defaultdict
 
+## version of the groups given by aggregateRules(..), part of the key of
+## the snapshots of HONSnapshot.py: to increase when a change gives other
+## groups (or the same groups in another order) for the same rules
+AGG_VERSION = 2
+
 ##################################################################
 def lastSymbolMapping(rules):
 	'''
@@ -47,13 +57,11 @@ def getUnionCount(count1, count2):
 	count1: map str -> float
 	count2: map str -> float
 	'''
-	res = {}
-	for target in set(count1.keys()) | set(count2.keys()):
-		res[target] = 0.
-		if target in count1.keys():
-			res[target] += count1[target]
-		if target in count2.keys():
-			res[target] += count2[target]
+	res = dict.fromkeys(set(count1.keys()) | set(count2.keys()), 0.)
+	for target, c in count1.items():
+		res[target] += c
+	for target, c in count2.items():
+		res[target] += c
 	return res
 
 ##################################################################
@@ -69,23 +77,233 @@ def aggregationScore(c1, c2, dp): # Return bool, float
 	can_be_merge : bool (can the two rules be merged?)
 	score        : float (proximity between the two rules)
 	'''
-	d1 = HONUtils.getDistribution(c1)
-	d2 = HONUtils.getDistribution(c2)
+	can_be_merge, score = aggregationScores([c1], [c2], dp)
+	return can_be_merge[0], score[0]
+
+##################################################################
+def aggregationScores(counts1, counts2, dp):
+	'''
+	aggregationScore(..) of many pairs of rules with the same parent
+	(see pairScores(..))
+
+	Parameters:
+	-----------
+	counts1, counts2: list of counts (dict str -> float),
+					  the pairs are (counts1[i], counts2[i])
+	dp: distribution of the parent rule of the rules
+
+	Return:
+	-------
+	can_be_merge : list of bool
+	score        : list of float
+	'''
+	if len(counts1) == 0:
+		return [], []
+	counts = list(counts1) + list(counts2)
+	index = targetIndex(counts)
+	nb_pairs = len(counts1)
+	can_be_merge, score = pairScores(ClusterRows(counts, index), np.arange(nb_pairs), np.arange(nb_pairs, 2*nb_pairs),
+									 parentVector(dp, index))
+	return can_be_merge.tolist(), score.tolist()
+
+##################################################################
+def targetIndex(counts):
+	'''
+	Column of each target in the count matrix of the rules of a location
+	(targets in order of first occurrence in counts)
+
+	Parameters:
+	-----------
+	counts: list of counts (dict str -> float)
+
+	Returns:
+	--------
+	index: dict str -> int
+	'''
+	index = {}
+	for c in counts:
+		for t in c:
+			index.setdefault(t, len(index))
+	return index
 
-	c1u2 = getUnionCount(c1,c2)
-	s1, s2, s1u2 = sum(c1.values()), sum(c2.values()), sum(c1u2.values())
-	d1u2 = HONUtils.getDistribution(c1u2)
+##################################################################
+def parentVector(dp, index):
+	'''
+	Distribution dp over the columns of index (0 for targets not in dp)
+	'''
+	return np.array([dp.get(t, 0.) for t in index.keys()], dtype=np.float64)
 
-	kld1m, thres1m = HONUtils.KLD(d1, d1u2), HONUtils.KLDThreshold(2, s1, 1.)
-	kld2m, thres2m = HONUtils.KLD(d2, d1u2), HONUtils.KLDThreshold(2, s2, 1.)
-	kld1u2p, thres1u2p = HONUtils.KLD(d1u2, dp), HONUtils.KLDThreshold(2, s1u2, 1.)
+class ClusterRows():
+	'''
+	Counts of the clusters of rules of a location as rows of a matrix over
+	the targets of the location (see targetIndex(..)), with the
+	distribution, the support and the threshold KLDThreshold(order, support)
+	of each row: they are computed once per cluster, when the cluster is
+	added, and read by pairScores(..) for all its pairs. The columns of the
+	targets of each row are kept in the order of its counts (the order in
+	which HONUtils.KLD(..) sums the terms of the dict version)
+	'''
+	##################################################################
+	def __init__(self, counts, index, nb_rows = None, order = 2):
+		'''
+		Parameters:
+		-----------
+		counts: list of counts (dict str -> float), the first rows
+		index: dict str -> int, column of each target
+		nb_rows: int, maximum number of rows (default: len(counts))
+		order: int, order of the rules (length of their sources)
+		'''
+		nb_rows = len(counts) if nb_rows is None else nb_rows
+		self.order = order
+		self.targets = list(index.keys())
+		self.columns = [None] * nb_rows
+		self.counts = np.zeros((nb_rows, len(index)))
+		self.distributions = np.zeros((nb_rows, len(index)))
+		self.supports = np.zeros(nb_rows)
+		self.thresholds = np.zeros(nb_rows)
+		self.nbRows = 0
+		for c in counts:
+			row = np.zeros(len(index))
+			columns = [index[t] for t in c.keys()]
+			row[columns] = list(c.values())
+			self.add(row, float(sum(c.values())), columns)
+
+	##################################################################
+	def add(self, count, support, columns):
+		'''
+		Add a row and returns its id
+
+		Parameters:
+		-----------
+		count: array, counts of the row over all the columns
+		columns: list of int, columns of the targets of the row
+		'''
+		i = self.nbRows
+		self.columns[i] = np.asarray(columns, dtype=np.int64)
+		self.counts[i] = count
+		self.distributions[i] = count / support
+		self.supports[i] = support
+		self.thresholds[i] = HONUtils.KLDThreshold(self.order, support, 1.)
+		self.nbRows += 1
+		return i
+
+	##################################################################
+	def merge(self, i1, i2, support, columns):
+		'''
+		Add the union of rows i1 and i2 and returns its id
+		(columns: in the order of the union count, see getUnionCount(..))
+		'''
+		return self.add(self.counts[i1] + self.counts[i2], support, columns)
+
+	##################################################################
+	def count(self, i):
+		'''
+		Counts of row i as a dict (str -> float), in the order of its columns
+		'''
+		return {self.targets[c]: v for c, v in zip(self.columns[i].tolist(), self.counts[i, self.columns[i]].tolist())}
 
-	can_be_merge = kld1u2p > thres1u2p and kld1m < thres1m and kld2m < thres2m
-	score = kld1m + kld2m # - 2.*kld1u2p
+##################################################################
+def pairScores(rows, rows1, rows2, dp_vector, block_size = 1000000):
+	'''
+	aggregationScore(..) of the pairs of clusters (rows1[i], rows2[i])
+	of a ClusterRows: the divergences of all the pairs to their union are
+	computed at once on the dense rows (by blocks of pairs of at most
+	block_size values), the targets of each pair in order of the columns
+
+	Parameters:
+	-----------
+	rows: ClusterRows
+	rows1, rows2: arrays of int, the pairs
+	dp_vector: distribution of the parent rule (see parentVector(..))
+
+	Return:
+	-------
+	can_be_merge : array of bool
+	score        : array of float
+	'''
+	rows1 = np.asarray(rows1, dtype=np.int64)
+	rows2 = np.asarray(rows2, dtype=np.int64)
+	can_be_merge = np.zeros(len(rows1), dtype=bool)
+	score = np.zeros(len(rows1))
+	step = max(1, block_size // max(1, rows.counts.shape[1]))
+	for a in range(0, len(rows1), step):
+		r1, r2 = rows1[a:a+step], rows2[a:a+step]
+		s1u2 = rows.supports[r1] + rows.supports[r2]
+		d1u2 = (rows.counts[r1] + rows.counts[r2]) / s1u2[:, None]
+		## KLD(d1,d1u2), KLD(d2,d1u2), KLD(d1u2,dp) of each pair
+		pairs = np.arange(len(r1))
+		kld1, kld2 = np.split(rowKLD(rows, np.concatenate((r1, r2)), d1u2, np.concatenate((pairs, pairs))), 2)
+		kld1u2p = denseKLD(d1u2, np.broadcast_to(dp_vector, d1u2.shape))
+		thres1u2 = HONUtils.KLDThresholdBatch(rows.order, s1u2, 1.)
+		kld1u2p = exactNearThresholds(rows, r1, r2, dp_vector, kld1u2p, thres1u2)
+
+		can_be_merge[a:a+step] = (kld1u2p > thres1u2) & (kld1 < rows.thresholds[r1]) & (kld2 < rows.thresholds[r2])
+		score[a:a+step] = kld1 + kld2 # - 2.*kld1u2p
 	return can_be_merge, score
 
 ##################################################################
-def aggregate(rules, dp):
+def denseKLD(child, parent):
+	'''
+	KLD(child_i, parent_i) of the rows of two arrays of distributions
+	(HONUtils.KLD(..) with the terms of each row summed from left to right
+	instead of in the order of the dict: the last bits can differ, see
+	exactNearThresholds(..))
+	'''
+	valid = (child > 0) & (parent > 0)
+	ratio = np.divide(child, parent, out=np.ones_like(child), where=valid)
+	terms = np.where(valid, child * np.log2(ratio), 0.)
+	if terms.shape[1] == 0:
+		return np.zeros(len(terms))
+	return np.cumsum(terms, axis=1)[:, -1]
+
+##################################################################
+def rowKLD(rows, row_ids, parent, parent_rows):
+	'''
+	KLD(distribution of row row_ids[i], parent[parent_rows[i]]) for each i,
+	with the same value as HONUtils.KLD(..) on the dicts: the terms are
+	summed in the order of the targets of the row (ClusterRows.columns),
+	with the logarithms of math.log (HONUtils.exactLog2(..))
+
+	Parameters:
+	-----------
+	rows: ClusterRows
+	row_ids, parent_rows: arrays of int
+	parent: array of distributions
+	'''
+	columns = [rows.columns[r] for r in row_ids.tolist()]
+	lengths = np.array([len(c) for c in columns], dtype=np.int64)
+	indptr = np.concatenate(([0], np.cumsum(lengths)))
+	if indptr[-1] == 0:
+		return np.zeros(len(columns))
+	pair = np.repeat(np.arange(len(columns)), lengths)
+	columns = np.concatenate(columns)
+	child = rows.distributions[row_ids[pair], columns]
+	parent = parent[parent_rows[pair], columns]
+	valid = (child > 0) & (parent > 0)
+	terms = np.zeros(len(child))
+	terms[valid] = child[valid] * HONUtils.exactLog2(child[valid] / parent[valid])
+	return HONUtils.rowSums(terms, indptr)
+
+##################################################################
+def exactNearThresholds(rows, rows1, rows2, dp_vector, divergences, thresholds):
+	'''
+	Returns a copy of the divergences KLD(d1u2, dp) of denseKLD(..) where
+	the pairs closer than HONUtils.NEAR_TIE to their threshold are computed
+	as in the dict version: KLD(..) of the distribution of the union count
+	(getUnionCount(..), whose order is the one of a set of the targets)
+	'''
+	divergences = np.array(divergences, dtype=np.float64)
+	near = np.flatnonzero(np.abs(divergences - thresholds) <= HONUtils.NEAR_TIE * np.abs(thresholds)).tolist()
+	if len(near) == 0:
+		return divergences
+	dp = {t: p for t, p in zip(rows.targets, dp_vector.tolist()) if p > 0}
+	for x in near:
+		c1u2 = getUnionCount(rows.count(int(rows1[x])), rows.count(int(rows2[x])))
+		divergences[x] = HONUtils.KLD(HONUtils.getDistribution(c1u2), dp)
+	return divergences
+
+##################################################################
+def aggregate(rules, dp, lsh = None, order = 2):
 	'''
 	Aggregate 2nd-order rules that have the same last symbol "symb"
 	using an hierarchical clustering procedure
@@ -93,6 +311,12 @@ def aggregate(rules, dp):
 	Parameters:
 	-----------
 	rules: dict list of str -> dict (str -> float)
+	order: int, order of the rules: the divergences are compared to the
+		   thresholds KLDThreshold(order, support) (e.g. the rules of
+		   order 3 that extend the same context, see aggregateVariableOrder(..))
+	lsh: MinHashLSH (optional), only the pairs of candidate clusters
+		 (MinHashLSH.candidatePairs(..)) are scored, the candidates of a
+		 merged cluster are the candidates of the two clusters
 
 	Returns:
 	--------
@@ -109,20 +333,29 @@ def aggregate(rules, dp):
 		## No aggregation possible if only two rules
 		return clust
 
+	## one row per cluster (each merge adds the row of the new cluster)
+	keys_clust = list(clust.keys())
+	index = targetIndex(clust.values())
+	rows = ClusterRows(list(clust.values()), index, 2*len(clust) - 1, order)
+	dp_vector = parentVector(dp, index)
+	row = {r: i for i, r in enumerate(keys_clust)}
+
 	# Create a heap with the pair of clusters that can be merged
 	# using the aggregation score
-	hd = heapdict.heapdict()
-	keys_clust = list(clust.keys())
-	for i1 in range(len(clust)-1):
-		r1 = keys_clust[i1]
-		c1 = clust[r1]
-		for i2 in range(i1 + 1, len(clust)):
-			r2 = keys_clust[i2]
-			c2 = clust[r2]
-			can_merge, score = aggregationScore(c1, c2, dp)
-			if can_merge:
-				# print "Can merge !"
-				hd[r1, r2] = score
+	hd = MergeHeap()
+	neighbours = None ## cluster -> candidate clusters (None: all the clusters)
+	if lsh is not None and len(keys_clust) >= lsh.minRules:
+		rows1, rows2 = lsh.candidatePairs(rows, np.arange(len(keys_clust)))
+		neighbours = {r: set() for r in keys_clust}
+		for i1, i2 in zip(rows1.tolist(), rows2.tolist()):
+			neighbours[keys_clust[i1]].add(keys_clust[i2])
+			neighbours[keys_clust[i2]].add(keys_clust[i1])
+	else:
+		rows1, rows2 = np.triu_indices(len(keys_clust), 1)
+	can_merge, score = pairScores(rows, rows1, rows2, dp_vector)
+	for i1, i2, score_pair in zip(rows1[can_merge].tolist(), rows2[can_merge].tolist(), score[can_merge].tolist()):
+		# print "Can merge !"
+		hd.push((keys_clust[i1], keys_clust[i2]), score_pair)
 
 	while len(hd) > 0:
 		# while there are possible merges
@@ -139,31 +372,225 @@ def aggregate(rules, dp):
 
 		del clust[r1]
 		del clust[r2]
-		## update heapdict removing entries with best_pair
-		keys_hd = list(hd.keys())
-		for hpair in keys_hd:
-			if hpair[0] == r1 or hpair[1] == r1 or hpair[0] == r2 or hpair[1] == r2:
-				del hd[hpair]
-
-		## update heapdict with new pairs that can be merged
-		for r in clust.keys():
-			can_merge, score = aggregationScore(clust[r],c1u2,dp)
-			if can_merge:
-				hd[r, tuple(new_grp_rules)] = score
+		## update heap removing entries with best_pair
+		hd.removeClusters(r1, r2)
+
+		new_row = rows.merge(row.pop(r1), row.pop(r2), float(sum(c1u2.values())), [index[t] for t in c1u2])
+
+		## update heap with new pairs that can be merged
+		if neighbours is None:
+			keys_clust = list(clust.keys())
+		else:
+			neigh = (neighbours.pop(r1) | neighbours.pop(r2)) - set([r1, r2])
+			for r in neigh:
+				neighbours[r] -= set([r1, r2])
+				neighbours[r].add(tuple(new_grp_rules))
+			neighbours[tuple(new_grp_rules)] = neigh
+			keys_clust = [r for r in clust.keys() if r in neigh]
+		rows1 = np.array([row[r] for r in keys_clust], dtype=np.int64)
+		can_merge, score = pairScores(rows, rows1, np.full(len(rows1), new_row), dp_vector)
+		for r, can_merge_pair, score_pair in zip(keys_clust, can_merge.tolist(), score.tolist()):
+			if can_merge_pair:
+				hd.push((r, tuple(new_grp_rules)), score_pair)
 		clust[tuple(new_grp_rules)] = c1u2
+		row[tuple(new_grp_rules)] = new_row
 
 	return clust
 
+class MinHashLSH():
+	'''
+	Candidate pairs of clusters for aggregate(..): the distribution of
+	each cluster is sketched by a weighted MinHash and only the pairs with
+	the same sketch in at least one band (LSH bucket) are candidates.
+
+	The weighted MinHash is the MinHash of the set of tokens (target,
+	j) for j < ceil(resolution * probability of the target): the
+	probability that two clusters have the same value of a hash function
+	is close to the weighted Jaccard similarity sum(min(d1,d2)) /
+	sum(max(d1,d2)) of their distributions. With nb_bands bands of
+	band_size hash functions, a pair of similarity J is a candidate with
+	probability 1 - (1 - J^band_size)^nb_bands.
+
+	The clusters of small support (< min_support) can be merged with
+	clusters of very different distributions (the thresholds of the
+	divergences are high): they are candidates with all the clusters.
+	'''
+	PRIME = (1 << 31) - 1
+
+	##################################################################
+	def __init__(self, nb_bands = 16, band_size = 2, resolution = 20, min_support = 3, seed = 0, min_rules = 0):
+		'''
+		Parameters:
+		-----------
+		nb_bands, band_size: int, LSH bands of the signatures
+		resolution: int, number of tokens of a target of probability 1
+		min_support: float, clusters with a smaller support are
+					 candidates with all the clusters
+		seed: int, seed of the hash functions
+		min_rules: int, locations with less rules are scanned exhaustively
+		'''
+		self.nbBands = nb_bands
+		self.bandSize = band_size
+		self.resolution = resolution
+		self.minSupport = min_support
+		self.minRules = min_rules
+		self.params = (nb_bands, band_size, resolution, min_support, seed, min_rules)
+		rand = np.random.default_rng(seed)
+		self.hashA = rand.integers(1, MinHashLSH.PRIME, nb_bands * band_size, dtype=np.int64)
+		self.hashB = rand.integers(0, MinHashLSH.PRIME, nb_bands * band_size, dtype=np.int64)
+
+	##################################################################
+	def signatures(self, rows, row_ids):
+		'''
+		Returns:
+		--------
+		signatures: array (len(row_ids) x nb_bands * band_size), weighted
+					MinHash of the distributions of the rows of a ClusterRows
+		'''
+		distributions = rows.distributions[row_ids]
+		rule, col = np.nonzero(distributions)
+		nb_tokens = np.ceil(distributions[rule, col] * self.resolution).astype(np.int64)
+		starts = np.cumsum(nb_tokens) - nb_tokens
+		j = np.arange(nb_tokens.sum()) - np.repeat(starts, nb_tokens)
+		tokens = np.repeat(col, nb_tokens) * self.resolution + np.minimum(j, self.resolution - 1)
+		hashes = (tokens[:, None] * self.hashA[None, :] + self.hashB[None, :]) % MinHashLSH.PRIME
+		## tokens are sorted by rule, each rule has at least one token
+		first = np.searchsorted(np.repeat(rule, nb_tokens), np.arange(len(row_ids)))
+		return np.minimum.reduceat(hashes, first, axis=0)
+
+	##################################################################
+	def candidatePairs(self, rows, row_ids):
+		'''
+		Returns:
+		--------
+		rows1, rows2: arrays of int, candidate pairs (i < j) of positions
+					  in row_ids, same order as np.triu_indices(..)
+		'''
+		n = len(row_ids)
+		signatures = self.signatures(rows, row_ids)
+		keys = []
+		for b in range(self.nbBands):
+			band = signatures[:, b*self.bandSize:(b+1)*self.bandSize]
+			_, bucket = np.unique(band, axis=0, return_inverse=True)
+			bucket = bucket.ravel()
+			order = np.argsort(bucket, kind='stable')
+			bounds = np.flatnonzero(np.diff(bucket[order])) + 1
+			for members in np.split(order, bounds):
+				if len(members) > 1:
+					i1, i2 = np.triu_indices(len(members), 1)
+					keys.append(members[i1] * n + members[i2])
+		## pairs of the clusters of small support
+		small = np.flatnonzero(rows.supports[row_ids] < self.minSupport)
+		if len(small) > 0:
+			others = np.arange(n)
+			i1, i2 = np.repeat(small, n), np.tile(others, len(small))
+			keys.append(np.minimum(i1, i2)[i1 != i2] * n + np.maximum(i1, i2)[i1 != i2])
+		if len(keys) == 0:
+			return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+		keys = np.unique(np.concatenate(keys))
+		return keys // n, keys % n
+
 ##################################################################
-def aggregateRules(rules):
+def candidateRecall(rules, dp, lsh):
+	'''
+	Recall of the candidate pairs of lsh against the exhaustive scan
+	of the pairs of rules of a location (first step of aggregate(..))
+
+	Returns:
+	--------
+	nb_pairs: int, number of pairs of rules
+	nb_candidates: int, number of candidate pairs
+	nb_mergeable: int, number of pairs that can be merged
+	nb_found: int, number of pairs that can be merged and are candidates
+	'''
+	index = targetIndex(rules.values())
+	rows = ClusterRows(list(rules.values()), index)
+	rows1, rows2 = np.triu_indices(len(rules), 1)
+	can_merge, _ = pairScores(rows, rows1, rows2, parentVector(dp, index))
+	mergeable = rows1[can_merge] * len(rules) + rows2[can_merge]
+	cand1, cand2 = lsh.candidatePairs(rows, np.arange(len(rules)))
+	nb_found = np.isin(mergeable, cand1 * len(rules) + cand2).sum()
+	return len(rows1), len(cand1), len(mergeable), int(nb_found)
+
+class MergeHeap():
+	'''
+	heapdict of the pairs of clusters that can be merged, with the pairs
+	of each cluster: removing the pairs of a merged cluster only touches
+	these pairs (instead of scanning all the pairs of the heap).
+	Pairs are removed in the order they were added (same heap, and same
+	order of the pairs with the same score, as scanning all the pairs)
+
+	The pairs are deleted from the heap when their cluster is merged, not
+	marked and skipped when popped (lazy deletion): heapdict compares the
+	scores only, and the order of the pairs with the same score depends on
+	the layout of the heap. Leaving stale entries in the heap, or breaking
+	the ties with a counter, changes this order, so equal scores would be
+	merged in another order than the reference aggregation (1156 different
+	groups out of 7899 on the maritime rules with max_order 3)
+	'''
+	##################################################################
+	def __init__(self):
+		self.hd = heapdict.heapdict()
+		self.pairsOf = defaultdict(dict) ## cluster -> pair -> None
+		self.rank = {} ## pair -> number of pairs added before it
+		self.nbPushed = 0
+
+	def __len__(self):
+		return len(self.hd)
+
+	##################################################################
+	def push(self, pair, score):
+		self.hd[pair] = score
+		self.rank[pair] = self.nbPushed
+		self.nbPushed += 1
+		self.pairsOf[pair[0]][pair] = None
+		self.pairsOf[pair[1]][pair] = None
+
+	##################################################################
+	def popitem(self):
+		pair, score = self.hd.popitem()
+		self.forget(pair)
+		return pair, score
+
+	##################################################################
+	def forget(self, pair):
+		del self.rank[pair]
+		for r in pair:
+			pairs_r = self.pairsOf[r]
+			del pairs_r[pair]
+			if len(pairs_r) == 0:
+				del self.pairsOf[r]
+
+	##################################################################
+	def removeClusters(self, r1, r2):
+		'''
+		Remove all the pairs with r1 or r2
+		'''
+		pairs = set(self.pairsOf.get(r1, ())) | set(self.pairsOf.get(r2, ()))
+		for pair in sorted(pairs, key=self.rank.__getitem__):
+			del self.hd[pair]
+			self.forget(pair)
+
+##################################################################
+def aggregateRules(rules, workers = 1, times = None, cache = None, lsh = None):
 	'''
 	Main method
 	Aggregate detected 2nd order rules that are extension of the same
 	1st order rule.
 
+	The aggregations of the locations are independent of each other: with
+	workers > 1 they are sent to a pool of processes, locations with the
+	most rules first (the result is the same as the serial one).
+
 	Parameters:
 	-----------
 	rules: dict tuple of str -> dict (str -> float)
+	workers: int, number of processes
+	times: dict (optional), filled with location -> aggregation time (s)
+		   of the locations that are aggregated
+	cache: AggregationCache (optional), the locations with the same rules
+		   and parent counts as a previous call are not aggregated again
+	lsh: MinHashLSH (optional), candidate pairs of rules (see aggregate(..))
 
 	Returns:
 	--------
@@ -171,20 +598,181 @@ def aggregateRules(rules):
 		Node x -> clustering of duplications of x -> union count of rules
 		in the group
 	'''
-	firstOrderMap = lastSymbolMapping(rules)
+	return updateAggregation({}, (), rules, workers, times, cache, lsh)
+
+##################################################################
+def updateAggregation(old_clusts, changed_rules, rules, workers = 1, times = None, cache = None, lsh = None):
+	'''
+	Aggregation of the new rules 'rules' given the aggregation old_clusts
+	of the previous rules: only the locations of the changed rules (2nd
+	order rules or first order counts, e.g. the sets of rules returned by
+	FastHONRulesBuilder.add_trajectories(..)) are aggregated again, the
+	clusterings of the other locations are the ones of old_clusts.
+	Same result as aggregateRules(rules).
+
+	Parameters:
+	-----------
+	old_clusts: aggregation of the previous rules (see aggregateRules(..))
+	changed_rules: iterable of the added, removed or updated rules
+	rules: dict tuple of str -> dict (str -> float), the new rules
+	workers, times, cache, lsh: see aggregateRules(..)
+
+	Returns:
+	--------
+	clusts: see aggregateRules(..)
+	'''
+	changed = set([r[-1] for r in changed_rules])
+	subproblems = []
+	for firstOrderRule, subRules in lastSymbolMapping(rules).items():
+		old_clust = None
+		if firstOrderRule in old_clusts and firstOrderRule not in changed:
+			old_clust = old_clusts[firstOrderRule]
+		subproblems.append((firstOrderRule, subRules, rules[tuple([firstOrderRule])], 2, old_clust))
+	return aggregateSubproblems(subproblems, workers, times, cache, lsh)
+
+##################################################################
+def aggregateSubproblems(subproblems, workers = 1, times = None, cache = None, lsh = None):
+	'''
+	Aggregation of independent sets of rules (see aggregateRules(..))
 
+	Parameters:
+	-----------
+	subproblems: list of (key, rules, counts of their parent rule, order
+				 of the rules, clustering to reuse or None)
+	workers, times, cache, lsh: see aggregateRules(..), times are given by key
+
+	Returns:
+	--------
+	clusts: dict key -> clustering of the rules (see aggregate(..)),
+			in order of subproblems
+	'''
 	clusts = defaultdict(dict)
-	for firstOrderRule in firstOrderMap.keys():
-		subRules = firstOrderMap[firstOrderRule]
-		cFirstOrder  = rules[tuple([firstOrderRule])]
-		dp = HONUtils.getDistribution(cFirstOrder)
-		subClust = aggregate(subRules,dp)
-		clusts[firstOrderRule] = subClust
+	params = []
+	for name, subRules, parent_count, order, old_clust in subproblems:
+		if old_clust is not None:
+			clusts[name] = old_clust
+			continue
+		key = None if cache is None else cache.key(subRules, parent_count, lsh)
+		if key is not None and key in cache.clusts:
+			clusts[name] = cache.clusts[key]
+			continue
+		clusts[name] = None
+		params.append((name, subRules, HONUtils.getDistribution(parent_count), lsh, order, key))
+
+	if workers > 1:
+		## largest sets of rules first: they do not end up alone at the end
+		params.sort(key=lambda p: len(p[1]), reverse=True)
+		with multiprocessing.Pool(workers) as pool:
+			results = list(pool.imap_unordered(aggregateLocation, [p[:5] for p in params]))
+	else:
+		results = [aggregateLocation(p[:5]) for p in params]
+
+	keys = {p[0]: p[5] for p in params}
+	for name, subClust, agg_time in results:
+		clusts[name] = subClust
+		if times is not None:
+			times[name] = agg_time
+		if cache is not None:
+			cache.clusts[keys[name]] = subClust
 	return clusts
 
+##################################################################
+def contextMapping(rules):
+	'''
+	Rules of length > 1 grouped by their context rule[1:] (each rule is
+	an extension of its context)
+
+	Returns:
+	--------
+	mapping: dict tuple of str -> (dict tuple of str -> dict (str -> float))
+			 context -> its extensions, longest contexts first
+			 (in order of first occurrence for the same length)
+	'''
+	mapping = defaultdict(dict)
+	for rule in rules.keys():
+		if len(rule) > 1:
+			mapping[rule[1:]][rule] = rules[rule]
+	return dict(sorted(mapping.items(), key=lambda m: -len(m[0])))
+
+##################################################################
+def parentRule(rules, context):
+	'''
+	Longest suffix of context that is a rule (the rules are not closed
+	by suffix, the first order rule context[-1:] is always a rule)
+	'''
+	for i in range(len(context)):
+		if context[i:] in rules:
+			return context[i:]
+	return None
+
+##################################################################
+def aggregateVariableOrder(rules, workers = 1, times = None, cache = None, lsh = None):
+	'''
+	Aggregation of variable order rules (FastHONRulesBuilder with any
+	max_order): the rules are grouped by context (contextMapping(..)), and
+	the extensions of each context are aggregated by aggregate(..)
+	independently of the other contexts (the groups of a context are not
+	used for its suffixes), with the distribution of the context as parent
+	distribution (or of its longest suffix that is a rule, parentRule(..)),
+	and the thresholds of the order of the extensions (len(context) + 1).
+	The rules of max_order 2 give the same groups as aggregateRules(rules).
+
+	Parameters:
+	-----------
+	rules: dict tuple of str -> dict (str -> float)
+	workers, times, cache, lsh: see aggregateRules(..), times are given by context
+
+	Returns:
+	--------
+	clusts: dict tuple of str -> dict tuple of tuple of str -> dict (str -> float)
+		context -> clustering of the extensions of the context -> union
+		count of rules in the group (see flattenAgg2ndOrderRules(..) and
+		mergeNodes(..) for the network of the groups)
+	'''
+	subproblems = [(context, extensions, rules[parentRule(rules, context)], len(context) + 1, None)
+				   for context, extensions in contextMapping(rules).items()]
+	return aggregateSubproblems(subproblems, workers, times, cache, lsh)
+
+class AggregationCache():
+	'''
+	Clusterings of the locations already aggregated by aggregateRules(..)
+	or updateAggregation(..), with the rules of the location (in order),
+	the counts of its first order rule and the parameters of the
+	MinHashLSH (if any) as key
+	'''
+	def __init__(self):
+		self.clusts = {}
+
+	##################################################################
+	@staticmethod
+	def key(sub_rules, first_order_count, lsh = None):
+		return (tuple([(r, tuple(c.items())) for r, c in sub_rules.items()]), tuple(first_order_count.items()),
+				None if lsh is None else lsh.params)
+
+##################################################################
+def aggregateLocation(params):
+	'''
+	Parameters:
+	-----------
+	params: (key, rules with the same parent (e.g. with this last symbol),
+			 distribution of the parent rule, MinHashLSH or None, order
+			 of the rules)
+
+	Returns:
+	--------
+	key, clustering of the rules (see aggregate(..)), time (s)
+	'''
+	firstOrderRule, subRules, dp, lsh, order = params
+	start_time = time.time()
+	subClust = aggregate(subRules, dp, lsh, order)
+	return firstOrderRule, subClust, time.time() - start_time
+
 ##################################################################
 def flattenAgg2ndOrderRules(base_rules, clusts):
 	'''
+	Groups of rules of aggregateRules(..) or aggregateVariableOrder(..)
+	with the first order rules (groups of one rule)
+
 	Returns:
 	--------
 	flatten_rules: dict tuple of tuple of str ->  dict (str -> float)
@@ -199,22 +787,123 @@ def flattenAgg2ndOrderRules(base_rules, clusts):
 			flatten_rules[subclust] = distr
 	return flatten_rules
 
+##################################################################
+def updateFlattenAggRules(flatten_rules, base_rules, old_clusts, clusts, changed_rules):
+	'''
+	Update in place flatten_rules = flattenAgg2ndOrderRules(old_rules, old_clusts)
+	to the groups of clusts = updateAggregation(old_clusts, changed_rules, base_rules):
+	only the groups of the locations of changed_rules are replaced
+	(same groups as flattenAgg2ndOrderRules(base_rules, clusts),
+	the new groups are at the end)
+
+	Returns:
+	--------
+	flatten_rules: dict tuple of tuple of str ->  dict (str -> float)
+	'''
+	for symb in set([r[-1] for r in changed_rules]):
+		for subclust in old_clusts.get(symb, {}):
+			del flatten_rules[subclust]
+		if tuple([symb]) in base_rules:
+			flatten_rules[tuple([tuple([symb])])] = base_rules[tuple([symb])]
+		else:
+			flatten_rules.pop(tuple([tuple([symb])]), None)
+		for subclust, distr in clusts.get(symb, {}).items():
+			flatten_rules[subclust] = distr
+	return flatten_rules
+
+##################################################################
+def arcArrays(graph):
+	'''
+	Arcs of a StateGraph (or of a dict network) as arrays, in the order of
+	the sources and then of their targets
+
+	Returns:
+	--------
+	states: list of the states
+	src, tgt: arrays of int, state ids of the source and target of each arc
+	weights: array, weight of each arc
+	'''
+	if isinstance(graph, StateGraph):
+		src = np.repeat(np.arange(graph.nbStates(), dtype=np.int64), np.diff(graph.indptr))
+		return graph.states, src, graph.indices, graph.weights
+	index, src, tgt, weights = {}, [], [], []
+	for s, neigh_s in graph.items():
+		i = index.setdefault(s, len(index))
+		for t, w in neigh_s.items():
+			src.append(i)
+			tgt.append(index.setdefault(t, len(index)))
+			weights.append(w)
+	return list(index.keys()), np.array(src, dtype=np.int64), np.array(tgt, dtype=np.int64), np.array(weights)
+
 ##################################################################
 def mergeNodes(graph, flatten_agg_rules):
-	new_graph = {}
-	nodeToClust = {}
-	for c in flatten_agg_rules.keys():
-		new_graph[c] = {}
-		for r in c:
-			nodeToClust[r] = c
-
-	for src in graph.keys():
-		for tgt in graph[src].keys():
-			if tuple(tgt) not in nodeToClust.keys():
-				new_graph[tuple([tgt])] = {}
-				nodeToClust[tgt] = tuple([tgt])
-			if nodeToClust[tgt] not in new_graph[nodeToClust[src]].keys():
-				new_graph[nodeToClust[src]][nodeToClust[tgt]] = 0
-			new_graph[nodeToClust[src]][nodeToClust[tgt]] += graph[src][tgt]
-	return new_graph
+	'''
+	Network of the groups of rules: the arcs between rules are summed
+	into arcs between their groups, i.e. with P the (rules x groups)
+	matrix of the group of each rule and A the adjacency matrix of graph,
+	the adjacency matrix PᵀAP of the groups (computed on the arrays of
+	the arcs: the arcs with the same source and target groups are summed,
+	in the order of the arcs)
+
+	Each rule is relabelled by its group whatever its order (groups of
+	aggregateVariableOrder(..): the extensions of contexts of different
+	lengths are in different groups, all the rules of a group have the
+	same last symbol, i.e. the same physical node).
+	The states are the groups of flatten_agg_rules, then the targets that
+	are not in a group (as groups of one rule, in order of first
+	occurrence). The arcs of each group are in order of first occurrence.
+
+	Parameters:
+	-----------
+	graph: StateGraph or dict tuple of str -> dict (tuple of str -> float)
+		   (VON network, see BuildNetwork)
+	flatten_agg_rules: groups of rules (see flattenAgg2ndOrderRules(..))
 
+	Returns:
+	--------
+	agg_graph: StateGraph, the states are the groups of rules
+	'''
+	states, src, tgt, weights = arcArrays(graph)
+	groups = list(flatten_agg_rules.keys())
+	group_index = {}
+	for g, c in enumerate(groups):
+		for r in c:
+			group_index[r] = g
+	group_of = np.array([group_index.get(s, -1) for s in states], dtype=np.int64)
+
+	## rules of the arcs that are not in a group: groups of one rule
+	ends = np.stack((src, tgt), axis=1).ravel()
+	alone = ends[group_of[ends] < 0]
+	if len(alone) > 0:
+		alone, first = np.unique(alone, return_index=True)
+		alone = alone[np.argsort(first)]
+		group_of[alone] = len(groups) + np.arange(len(alone))
+		groups += [tuple([states[i]]) for i in alone.tolist()]
+	nb_groups = len(groups)
+
+	## PᵀAP: sum of the arcs with the same (source group, target group)
+	keys = group_of[src] * nb_groups + group_of[tgt]
+	keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+	sums = np.bincount(inverse.ravel(), weights=weights, minlength=len(keys))
+	if np.issubdtype(weights.dtype, np.integer):
+		sums = sums.astype(weights.dtype)
+	order = np.lexsort((first, keys // nb_groups))
+	rows, cols, sums = keys[order] // nb_groups, keys[order] % nb_groups, sums[order]
+
+	## states in order of first occurrence in (group, its targets, next group, ...)
+	## (order of StateGraph.fromDict(..) of the dict of the groups)
+	nb_arcs = np.bincount(rows, minlength=nb_groups)
+	sequence = np.empty(nb_groups + len(cols), dtype=np.int64)
+	sequence[np.cumsum(nb_arcs) - nb_arcs + np.arange(nb_groups)] = np.arange(nb_groups)
+	sequence[np.arange(len(cols)) + rows + 1] = cols
+	state_order, first = np.unique(sequence, return_index=True)
+	state_order = state_order[np.argsort(first)]
+	rank = np.empty(nb_groups, dtype=np.int64)
+	rank[state_order] = np.arange(nb_groups)
+	order = np.argsort(rank[rows], kind='stable')
+	indptr = np.concatenate(([0], np.cumsum(nb_arcs[state_order])))
+
+	groups = [groups[i] for i in state_order.tolist()]
+	node_index = {}
+	state_nodes = [node_index.setdefault(aggLastSymbol(c), len(node_index)) for c in groups]
+	return StateGraph(list(node_index.keys()), groups, state_nodes, indptr, rank[cols[order]], sums[order])
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+'''
+Running time of AggOrder2Rules.aggregate(..) on synthetic locations with
+a growing number of 2nd order rules, with the pairs of the merged clusters
+found by the index of MergeHeap or by scanning all the pairs of the heap
+(previous version). Both give the same clusters.
+
+Prints the total time and the time spent removing the pairs of the merged
+clusters from the heap (the rest is mostly the scores of the pairs).
+The rules of a location are drawn from a few distinct distributions over
+the next locations (plus noise), so that most of them can be merged.
+
+usage: python AggregationBenchmark.py [max_nb_rules]
+'''
+import random
+import sys
+import time
+
+import HONUtils
+import AggOrder2Rules
+
+max_nb_rules = int(sys.argv[1]) if len(sys.argv) > 1 else 800
+nb_targets = 30
+nb_profiles = 2
+support = 200
+MergeHeap = AggOrder2Rules.MergeHeap
+
+##################################################################
+class IndexMergeHeap(MergeHeap):
+	removeTime = 0.
+	def removeClusters(self, r1, r2):
+		start_time = time.time()
+		super().removeClusters(r1, r2)
+		IndexMergeHeap.removeTime += time.time() - start_time
+
+class ScanMergeHeap(MergeHeap):
+	'''
+	Removes the pairs of the merged clusters by scanning all the pairs
+	'''
+	removeTime = 0.
+	def removeClusters(self, r1, r2):
+		start_time = time.time()
+		for pair in list(self.hd.keys()):
+			if pair[0] == r1 or pair[1] == r1 or pair[0] == r2 or pair[1] == r2:
+				del self.hd[pair]
+				self.forget(pair)
+		ScanMergeHeap.removeTime += time.time() - start_time
+
+##################################################################
+def syntheticLocation(nb_rules, seed):
+	'''
+	Returns:
+	--------
+	rules: dict tuple of str -> dict (str -> float), rules (x, 'z')
+	dp: distribution of the first order rule ('z',)
+	'''
+	rand = random.Random(seed)
+	targets = [f't{i}' for i in range(nb_targets)]
+	profiles = [rand.sample(targets, 4) for _ in range(nb_profiles)]
+	rules = {}
+	parent = {}
+	for i in range(nb_rules):
+		profile = profiles[i % nb_profiles]
+		count = {}
+		for _ in range(support):
+			t = rand.choice(profile) if rand.random() < 0.9 else rand.choice(targets)
+			count[t] = count.get(t, 0.) + 1.
+		rules[(f'x{i}', 'z')] = count
+		for t, c in count.items():
+			parent[t] = parent.get(t, 0.) + c
+	return rules, HONUtils.getDistribution(parent)
+
+##################################################################
+def timeAggregation(rules, dp, heap_class):
+	AggOrder2Rules.MergeHeap = heap_class
+	heap_class.removeTime = 0.
+	start_time = time.time()
+	clust = AggOrder2Rules.aggregate(rules, dp)
+	return time.time() - start_time, heap_class.removeTime, clust
+
+##################################################################
+print('nb_rules,nb_clusters,time_scan,time_index,remove_time_scan,remove_time_index,same_clusters')
+nb_rules = 50
+while nb_rules <= max_nb_rules:
+	rules, dp = syntheticLocation(nb_rules, nb_rules)
+	t_scan, remove_scan, clust_scan = timeAggregation(rules, dp, ScanMergeHeap)
+	t_index, remove_index, clust_index = timeAggregation(rules, dp, IndexMergeHeap)
+	same = list(clust_scan.items()) == list(clust_index.items())
+	print(f'{nb_rules},{len(clust_index)},{round(t_scan, 3)},{round(t_index, 3)},'
+		  f'{round(remove_scan, 3)},{round(remove_index, 3)},{same}')
+	nb_rules *= 2
+AggOrder2Rules.MergeHeap = MergeHeap
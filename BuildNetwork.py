@@ -8,14 +8,29 @@
 
 ### Call BuildNetwork()
 ### Input: Higher-order dependency rules
-### Output: HON network
+### Output: HON network (StateGraph, toDict() gives the dict of the original code)
 ### See details in README
 
 ### Removing global variables
+### Rules can use str or int ids (TrajectoryCorpus) as symbols,
+### see TrajectoryCorpus.decodeNetwork(..) to decode the network
 
 from collections import defaultdict, Counter
 
+from StateGraph import StateGraph
+
 def BuildNetwork(Rules):
+    # Returns a StateGraph, with the states of BuildNetworkTrie(): the rule
+    # sources sorted by length, then the first order targets that are not
+    # rule sources (toDict() gives the dict of the original code, that
+    # UpdateNetwork() patches in place)
+    Graph = BuildNetworkDict(Rules)
+    States = dict.fromkeys(sorted(Rules, key=lambda x: len(x)))
+    for source in list(States):
+        States.update(dict.fromkeys(Graph.get(source, {})))
+    return StateGraph.fromDict(Graph, states=States)
+
+def BuildNetworkDict(Rules):
     #VPrint('Building network')
     Graph = defaultdict(dict)
     SortedSource = sorted(Rules, key=lambda x: len(x))
@@ -58,3 +73,131 @@ def RewireTails(Graph):
     for (source, target) in ToRemove:
         del(Graph[source][target])
 
+
+### Incremental update of a network built by BuildNetwork() (its toDict())
+### when some rules are added, removed or have new weights
+### (see FastHONRulesBuilder.add_trajectories())
+### Output of BuildNetwork: each rule source -> target edge goes to the longest
+### suffix of source + (target,) that is a rule (of length > 1), or to (target,)
+
+def RuleSuffixes(Rules):
+    # context -> set of rule sources ending with the context
+    Suffixes = defaultdict(set)
+    for source in Rules:
+        for i in range(len(source)):
+            Suffixes[source[i:]].add(source)
+    return Suffixes
+
+def EdgeTarget(Rules, source, target):
+    NewTarget = source + (target,)
+    while len(NewTarget) > 1:
+        if NewTarget in Rules:
+            return NewTarget
+        NewTarget = NewTarget[1:]
+    return (target,)
+
+def UpdateNetwork(Graph, Rules, Suffixes, Added, Removed, Updated):
+    # Graph: BuildNetwork(OldRules).toDict(), updated in place to
+    # BuildNetwork(Rules).toDict()
+    # Suffixes: RuleSuffixes(OldRules), updated in place
+    ToRewire = set(Added) | set(Updated)
+    for source in Removed:
+        if source in Graph:
+            del(Graph[source])
+        for i in range(len(source)):
+            Suffixes[source[i:]].discard(source)
+    for source in Added:
+        for i in range(len(source)):
+            Suffixes[source[i:]].add(source)
+    # edges whose longest suffix rule has changed
+    for rule in set(Added) | set(Removed):
+        if len(rule) > 1 and rule[:-1] in Suffixes:
+            for source in Suffixes[rule[:-1]]:
+                if rule[-1] in Rules[source]:
+                    ToRewire.add(source)
+    for source in ToRewire:
+        if source in Rules:
+            Graph[source] = {}
+            for target in Rules[source]:
+                Graph[source][EdgeTarget(Rules, source, target)] = Rules[source][target]
+    return Graph
+
+
+### Network with int node ids and CSR arcs, built with a trie of the
+### reversed rule sources: the target of the edge source -> target (the
+### longest suffix of source + (target,) that is a rule) is found in one
+### walk of the trie (target, source[-1], source[-2], ...)
+### Same network as BuildNetwork(): same states and same CSR arcs (same
+### order of the sources and of the targets)
+
+class RuleTrie():
+    # trie of the reversed rule sources, nodes are int ids (0 = root)
+    def __init__(self):
+        self.Child = {}  # (trie node, symbol) -> trie node
+        self.Rule = [-1] # trie node -> network node id of the rule (-1: none)
+
+    def Insert(self, Source, NodeId):
+        Node = 0
+        for Symbol in reversed(Source):
+            Next = self.Child.get((Node, Symbol))
+            if Next is None:
+                Next = len(self.Rule)
+                self.Child[(Node, Symbol)] = Next
+                self.Rule.append(-1)
+            Node = Next
+        self.Rule[Node] = NodeId
+
+    def LongestSuffix(self, Source, Target):
+        # network node id of the longest rule source + (Target,)[i:] of
+        # length > 1, or -1
+        Child = self.Child
+        Node = Child.get((0, Target))
+        Best = -1
+        Position = len(Source) - 1
+        while Node is not None and Position >= 0:
+            Node = Child.get((Node, Source[Position]))
+            if Node is not None and self.Rule[Node] >= 0:
+                Best = self.Rule[Node]
+            Position -= 1
+        return Best
+
+def BuildNetworkTrie(Rules):
+    # Returns a StateGraph: the rule sources
+    # are the first state ids (sorted by length as in BuildNetwork()), then
+    # the first order targets that are not rule sources
+    SortedSource = sorted(Rules, key=lambda x: len(x))
+    Nodes = list(SortedSource)
+    Rank = {Source: i for i, Source in enumerate(SortedSource)}
+    Trie = RuleTrie()
+    for Source in SortedSource:
+        if len(Source) > 1:
+            Trie.Insert(Source, Rank[Source])
+    Indptr, Indices, Weights = [0], [], []
+    for Source in SortedSource:
+        # edge order of BuildNetwork(): the targets kept as (target,), then
+        # those rewired to Source + (target,) (by rank of the rule), then
+        # those rewired to a shorter suffix by RewireTails()
+        Kept, Full, Tails = [], [], []
+        for Target, Weight in Rules[Source].items():
+            Node = Trie.LongestSuffix(Source, Target)
+            if Node < 0:
+                Single = (Target,)
+                Node = Rank.get(Single)
+                if Node is None:
+                    Node = len(Nodes)
+                    Rank[Single] = Node
+                    Nodes.append(Single)
+                Kept.append((Node, Weight))
+            elif len(Nodes[Node]) == len(Source) + 1:
+                Full.append((Node, Weight))
+            else:
+                Tails.append((Node, Weight))
+        Full.sort(key=lambda x: x[0])
+        for Node, Weight in Kept + Full + Tails:
+            Indices.append(Node)
+            Weights.append(Weight)
+        Indptr.append(len(Indices))
+    Indptr.extend([len(Indices)] * (len(Nodes) - len(SortedSource)))
+    PhysicalIndex = {}
+    StateNodes = [PhysicalIndex.setdefault(Node[-1], len(PhysicalIndex)) for Node in Nodes]
+    return StateGraph(list(PhysicalIndex.keys()), Nodes, StateNodes, Indptr, Indices, Weights)
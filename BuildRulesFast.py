@@ -3,89 +3,554 @@
 
 from collections import defaultdict, Counter
 import math
+import multiprocessing
+import random
 
+import numpy as np
+
+import CountTables
 import HONUtils
+from TrajectoryCorpus import TrajectoryCorpus
+from ContextIndex import ContextIndex
+
+# version of the rules given by the builders of this file, part of the key
+# of the snapshots of HONSnapshot.py: to increase when a change gives other
+# rules (or the same rules in another order) for the same input
+BUILDER_VERSION = 5
 
 class FastHONRulesBuilder():
   ###########################################
-  def __init__(self,trajectories,max_order,min_support, ThresholdMultiplier):
+  def __init__(self,trajectories,max_order,min_support, ThresholdMultiplier, workers=1, weights=None):
+    # trajectories: TrajectoryCorpus or list of (list of str)
+    # with a list of sequences, symbols are interned here and the rules
+    # given by ExtractRules() are decoded back to strings
+    # workers: number of processes used by GenerateAllRules()
+    # weights: number of occurrences of each trajectory (None: 1 each),
+    # see TrajectoryCorpus.deduplicate() (same rules as the corpus with the
+    # repeated trajectories: the first occurrence of a context is in the
+    # first copy of a trajectory, and the distinct trajectories are in the
+    # order of their first copies, so the ties of MaxDivergence are broken
+    # in the same order, see ExtensionCounts)
+    self.DecodeRules = not isinstance(trajectories, TrajectoryCorpus)
+    if self.DecodeRules:
+        trajectories = TrajectoryCorpus.fromSequences(trajectories)
     self.ThresholdMultiplier = ThresholdMultiplier
     self.Count = defaultdict(lambda: defaultdict(int))
     self.Rules = defaultdict(dict)
     self.Distribution = defaultdict(dict)
-    self.SourceToExtSource = defaultdict(set)
-    self.StartingPoints = defaultdict(set)
-    self.Trajectory = trajectories
+    # source -> sum of its counts (kept up to date with self.Count)
+    self.Support = {}
+    # source -> its extensions (dict used as an ordered set, see
+    # ExtendObservation)
+    self.SourceToExtSource = defaultdict(dict)
+    # sources given to ExtendObservation (their extensions are counted)
+    self.Extended = set()
+    # first order source -> rules added while extending it
+    # rule -> number of first order sources that added it
+    self.RulesOf = defaultdict(set)
+    self.RuleRefs = defaultdict(int)
+    # counts set to 0 because lower than min_support: source -> target -> count
+    self.BelowSupport = defaultdict(dict)
+    # positions of the sources: built once in BuildObservations
+    self.Index = None
+    # count tables read instead of the position index (see SetTables)
+    self.Tables = None
+    # first order source -> node (Valid, Curr) of its tree of extensions ->
+    # (step, Valid sources, rules and prefixes that are not rules found in
+    # the subtree of the node, margin of its tests against Valid and counts
+    # of Valid at this step) of the UpdateRules with Changed, and
+    # source -> last step where its counts changed (see ExtendRoots)
+    self.Walks = {}
+    self.LastChange = {}
+    self.Step = 0
+    self.Corpus = trajectories
     self.MinSupport = min_support
     self.MaxOrder   = max_order
+    self.Workers    = workers
+    self.Weights    = None if weights is None else list(weights)
 
   def ExtractRules(self):
     self.BuildObservations()
     self.BuildDistributions()
     self.GenerateAllRules()
-    return self.Rules
+    if self.DecodeRules:
+        self.Output = self.Corpus.decodeRules(self.Rules)
+    else:
+        self.Output = self.Rules
+    return self.Output
+
+  def ExtractRulesMulti(self, Multipliers):
+    # See ExtractRulesMulti(..) (the observations are built once, and the
+    # extensions counted for one multiplier are reused by the next ones)
+    return ExtractRulesMulti(self, Multipliers)
+
+  def MultiplierRules(self, ThresholdMultiplier):
+    # Rules obtained with ThresholdMultiplier (same observations)
+    if len(self.Count) == 0:
+        self.BuildObservations()
+        self.BuildDistributions()
+    self.ResetRules(ThresholdMultiplier)
+    self.GenerateAllRules()
+    return self.Corpus.decodeRules(self.Rules) if self.DecodeRules else self.Rules
+
+  def ExtractRulesSampled(self, SampleRatio, Margin = 0.5, Seed = None):
+    # Approximate rules in two phases:
+    # 1. the contexts of a random sample of the trajectories (SampleRatio of
+    #    them, each one weighted by 1 / SampleRatio so that the supports and
+    #    thresholds are those of the whole corpus) are counted in tables, as
+    #    the shards of ShardedHON.py (SetTables: no position index for the
+    #    sample), up to MaxOrder - 1: the rules of the sample with the
+    #    threshold multiplied by Margin are the candidates
+    # 2. the exact KLD tests are done on the whole corpus from the first
+    #    order sources, as in ExtendRule, but only the candidates and their
+    #    suffixes are extended (same counts and order of the targets as
+    #    ExtendObservation): the other sources are dropped
+    # The rules are a subset of the rules of ExtractRules(), with the same
+    # counts. The number of sources whose extensions are counted on the
+    # whole corpus is kept in self.ExactChecks (and the number of candidates
+    # in self.Candidates). (see SampledRulesAccuracy.py for the precision
+    # and recall)
+    # Raises ValueError if SampleRatio is not in ]0, 1]
+    if not 0 < SampleRatio <= 1:
+        raise ValueError(f'SampleRatio must be in ]0, 1], got {SampleRatio}')
+    Rng = random.Random(Seed)
+    Sample = [i for i in range(len(self.Corpus)) if Rng.random() < SampleRatio]
+    Scale = max(1, int(round(1 / SampleRatio)))
+    SampleWeights = [Scale * (1 if self.Weights is None else self.Weights[i]) for i in Sample]
+    SampleBuilder = FastHONRulesBuilder([], max(1, self.MaxOrder - 1), self.MinSupport, self.ThresholdMultiplier * Margin)
+    SampleBuilder.SetTables(CountTables.corpusTables(self.Corpus.subset(Sample), SampleBuilder.MaxOrder, SampleWeights))
+    SampleBuilder.BuildDistributions()
+    SampleBuilder.GenerateAllRules()
+    Candidates = [s for s in SampleBuilder.Rules if len(s) > 1]
+    self.Candidates = len(Candidates)
+    del SampleBuilder
+
+    if len(self.Count) == 0:
+        self.BuildObservations()
+        self.BuildDistributions()
+    self.ResetRules(self.ThresholdMultiplier)
+    Explore = set([s[x:] for s in Candidates for x in range(len(s))])
+    self.ExactChecks = len(Explore)
+    Roots = [s for s in self.Distribution if len(s) == 1]
+    for Source in Roots:
+        self.AddToRules(Source)
+    for Root, Rules in self.ExtendRoots([s for s in Roots if s in Explore], Explore=Explore).items():
+        self.SetRulesOf(Root, self.RulesOf[Root] | Rules, {})
+    if self.DecodeRules:
+        self.Output = self.Corpus.decodeRules(self.Rules)
+    else:
+        self.Output = self.Rules
+    return self.Output
+
+  def CountRules(self, ThresholdMultiplier):
+    # Number of rules obtained with ThresholdMultiplier (same observations)
+    if len(self.Count) == 0:
+        self.BuildObservations()
+        self.BuildDistributions()
+    self.ResetRules(ThresholdMultiplier)
+    self.GenerateAllRules()
+    return len(self.Rules)
+
+  def SearchThresholdMultiplier(self, TargetSize, Low = 1., High = None, Tolerance = 1e-3):
+    # See SearchThresholdMultiplier(..)
+    return SearchThresholdMultiplier(self.CountRules, TargetSize, Low, High, Tolerance)
+
+  def ResetRules(self, ThresholdMultiplier):
+    self.ThresholdMultiplier = ThresholdMultiplier
+    self.Rules = defaultdict(dict)
+    self.RulesOf = defaultdict(set)
+    self.RuleRefs = defaultdict(int)
+    self.Walks = {}
 
   def BuildObservations(self):
-    for Tindex in range(len(self.Trajectory)):
-        trajectory = self.Trajectory[Tindex]
-        for index in range(len(trajectory) - 1):
-            Source = tuple(trajectory[index:index + 1])
-            Target = trajectory[index + 1]
-            self.Count[Source][Target] += 1
-            self.StartingPoints[Source].add((Tindex, index))
+    for Tindex in range(len(self.Corpus)):
+        Trajectory = self.Corpus[Tindex]
+        Weight = 1 if self.Weights is None else self.Weights[Tindex]
+        for index in range(len(Trajectory) - 1):
+            Source = (Trajectory[index],)
+            Target = Trajectory[index + 1]
+            self.Count[Source][Target] += Weight
+    if self.Index is None:
+        self.Index = ContextIndex(self.Corpus, weights=self.Weights)
 
   def BuildDistributions(self):
     for Source in self.Count:
         for Target in self.Count[Source].keys():
             if self.Count[Source][Target] < self.MinSupport:
+                self.BelowSupport[Source][Target] = self.Count[Source][Target]
                 self.Count[Source][Target] = 0
+        self.Support[Source] = sum(self.Count[Source].values())
         for Target in self.Count[Source]:
           if self.Count[Source][Target] > 0:
-              self.Distribution[Source][Target] = 1.0 * self.Count[Source][Target] / sum(self.Count[Source].values())
+              self.Distribution[Source][Target] = 1.0 * self.Count[Source][Target] / self.Support[Source]
 
 
   def GenerateAllRules(self):
-    for Source in tuple(self.Distribution.keys()):
+    if self.Workers > 1:
+        self.GenerateAllRulesParallel()
+        return
+    # (first order sources: Distribution also has the extensions counted
+    # by a previous call, see ExtractRulesMulti)
+    for Source in [s for s in self.Distribution if len(s) == 1]:
         self.AddToRules(Source)
         self.ExtendRule(Source, Source, 1)
 
+  def GenerateAllRulesParallel(self):
+    # The extension of each first order source is independent of the others:
+    # sources are split in chunks sent to a pool of processes.
+    # Rules found for each source are merged following the order of the
+    # sources, the result is the same as the serial one (same insertion order).
+    # Note: self.Count and self.Distribution of this object are not extended.
+    Sources = tuple([s for s in self.Distribution if len(s) == 1])
+    ChunkSize = max(1, len(Sources) // (8 * self.Workers))
+    Chunks = [Sources[i:i + ChunkSize] for i in range(0, len(Sources), ChunkSize)]
+    Parameters = (self.Corpus, self.Index, self.MaxOrder, self.MinSupport, self.ThresholdMultiplier, self.Weights)
+    with multiprocessing.Pool(self.Workers, InitRulesWorker, Parameters) as pool:
+        for Chunk, ChunkRules in zip(Chunks, pool.imap(ExtendRulesChunk, Chunks)):
+            for Source, SourceRules in zip(Chunk, ChunkRules):
+                for s in SourceRules:
+                    if s not in self.Rules:
+                        self.Rules[s] = SourceRules[s]
+                    self.RulesOf[Source].add(s)
+                    self.RuleRefs[s] += 1
+
   def ExtendRule(self,Valid, Curr, order):
-    if order >= self.MaxOrder:
-        self.AddToRules(Valid)
-    else:
-        Distr = self.Distribution[Valid]
-        supp_curr = sum([x for x in self.Count[Curr].values()])
+    # Explicit stack instead of recursion (no recursion limit for high MaxOrder)
+    # The extensions of Curr are pushed in reverse order so that they are
+    # explored in the same order as the recursive version
+    # The KLD tests of all the extensions of Curr are done in one call of
+    # HONUtils.countKLDBatch, which also gives the bound
+    # KLD(MaxDivergence(ExtDistr), Distr) used when the extension is popped
+    Bound = self.DivergenceTests(Valid, [Curr], order)[2][0]
+    Stack = [(Valid, Curr, order, Bound)]
+    while len(Stack) > 0:
+        Valid, Curr, order, Bound = Stack.pop()
+        if order >= self.MaxOrder:
+            self.AddToRules(Valid)
+            continue
         # test if divergence has no chance exceeding the threshold when going for higher order
-        if HONUtils.KLD(HONUtils.MaxDivergence(self.Distribution[Curr]), Distr) < (HONUtils.KLDThreshold(order + 1, supp_curr, self.ThresholdMultiplier)):
+        if Bound < (HONUtils.KLDThreshold(order + 1, self.Support[Curr], self.ThresholdMultiplier)):
             self.AddToRules(Valid)
-        else:
-            #if order + 1 not in ObservationBuiltForOrder:
-            Extended = self.ExtendSourceFast(Curr)
-            if len(Extended) == 0:
-                self.AddToRules(Valid)
+            continue
+        #if order + 1 not in ObservationBuiltForOrder:
+        Extended = list(self.ExtendSourceFast(Curr))
+        if len(Extended) == 0:
+            self.AddToRules(Valid)
+            continue
+        Divergences, Thresholds, Bounds = self.DivergenceTests(Valid, Extended, order + 1)
+        Next = []
+        for ExtSource, divergence, threshold, bound in zip(Extended, Divergences.tolist(), Thresholds.tolist(), Bounds.tolist()):
+            if divergence > threshold:
+                # higher-order dependencies exist for order order + 1
+                # keep comparing probability distribution of higher orders with current order
+                Next.append((ExtSource, ExtSource, order + 1, self.SelfBound(ExtSource)))
             else:
-                for ExtSource in Extended:
-                    ExtDistr = self.Distribution[ExtSource]  # Pseudocode in Algorithm 1 has a typo here
-                    supp_ext = sum([x for x in self.Count[ExtSource].values()])
-                    divergence = HONUtils.KLD(ExtDistr, Distr)
-                    if divergence > (HONUtils.KLDThreshold(order + 1, supp_ext,self.ThresholdMultiplier)):
-                        # higher-order dependencies exist for order order + 1
-                        # keep comparing probability distribution of higher orders with current order
-                        self.ExtendRule(ExtSource, ExtSource, order + 1)
+                # higher-order dependencies do not exist for current order
+                # keep comparing probability distribution of higher orders with known order
+                Next.append((Valid, ExtSource, order + 1, bound))
+        Stack.extend(reversed(Next))
+
+  def ExtendRoots(self, Roots, Changed=None, Explore=None):
+    # ExtendRule(Root, Root, 1) for all the first order sources of Roots:
+    # the trees of extensions are explored together level by level, and
+    # the KLD tests of a level are done in one call of PairDivergenceTests
+    # Changed: sources whose counts changed since the last call. A node
+    # (Valid, Curr) of a previous call such that Curr did not change since
+    # has the same subtree (an extension of Curr changes only with Curr,
+    # see CountContexts), and the same tests if the distribution of Valid
+    # moved less than the margin of the tests of the subtree that use it
+    # (see CountDrift): its rules are read from self.Walks instead of
+    # exploring it again, so only the nodes on the paths of the changed
+    # sources (or close to a threshold) are tested again
+    # (None: all the nodes are explored again)
+    # Explore: if given, only the sources of Explore are extended (the
+    # others are dropped, see ExtractRulesSampled), with the extensions
+    # already counted
+    # Returns: dict first order source -> set of the rules of its tree
+    # (RulesOf is not changed, see SetRulesOf)
+    if Changed is None:
+        self.Walks = {}
+    else:
+        self.Step += 1
+        for Source in Changed:
+            self.LastChange[Source] = self.Step
+    # node (Valid, Curr) -> Valid sources added in its subtree (dict used
+    # as an ordered set), their rules, their prefixes that are not rules
+    # and the smallest distance to a threshold of the tests of the subtree
+    # against Valid (list of one value)
+    Found = {}
+    Drifts = {}
+    # nodes read from self.Walks while Valid changed -> their margin left
+    Rebased = {}
+    def AddFound(Path, Terminals, Rules, Excluded):
+        for Node in Path:
+            Found[Node][0].update(Terminals)
+            Found[Node][1].update(Rules)
+            Found[Node][2].update(Excluded)
+    def AddTerminal(Valid, Path):
+        AddFound(Path, [(Valid, None)], *self.SourceRules(Valid))
+    def AddMargin(Valid, Path, Margin):
+        for Node in Path:
+            if Node[0] == Valid and Margin < Found[Node][3][0]:
+                Found[Node][3][0] = Margin
+    def Drift(Valid, Walk):
+        # (one computation for all the nodes of the same step of Valid)
+        if self.LastChange.get(Valid, 0) <= Walk[0]:
+            return 0.
+        Key = (Valid, Walk[0])
+        if Key not in Drifts:
+            Drifts[Key] = CountDrift(Walk[5], self.Support.get(Valid, 0), self.Count.get(Valid, {}))
+        return Drifts[Key]
+    Nodes = [(Root, Root, Root, ()) for Root in Roots]
+    order = 1
+    while len(Nodes) > 0:
+        Todo = []
+        for Root, Valid, Curr, Path in Nodes:
+            Walk = self.Walks.get(Root, {}).get((Valid, Curr)) if Changed is not None else None
+            if Walk is not None and self.LastChange.get(Curr, 0) <= Walk[0]:
+                # (1e-9: rounding errors of the divergences)
+                Margin = Walk[4] - Drift(Valid, Walk) - 1e-9
+                if Margin > 0:
+                    Step, Terminals, Rules, Excluded = Walk[:4]
+                    # same rules if the prefixes of the Valid sources are still
+                    # rules, or still not rules
+                    if self.Rules.keys() >= Rules and all([s not in self.Rules and self.Support.get(s, 0) == 0 for s in Excluded]):
+                        AddFound(Path, Terminals, Rules, Excluded)
                     else:
-                        # higher-order dependencies do not exist for current order
-                        # keep comparing probability distribution of higher orders with known order
-                        self.ExtendRule(Valid, ExtSource, order + 1)
+                        for Terminal in Terminals:
+                            AddTerminal(Terminal, Path)
+                    AddMargin(Valid, Path, Margin)
+                    if self.LastChange.get(Valid, 0) > Walk[0]:
+                        Rebased[(Valid, Curr)] = (Root, Walk, Margin)
+                    continue
+            Path = Path + ((Valid, Curr),)
+            Found[(Valid, Curr)] = ({}, set(), set(), [math.inf])
+            Todo.append((Root, Valid, Curr, Path))
+        Tests = [[], [], []]
+        if len(Todo) > 0:
+            Tests = [x.tolist() for x in self.PairDivergenceTests([(Valid, Curr) for _, Valid, Curr, _ in Todo], order)]
+        Level = []
+        for (Root, Valid, Curr, Path), divergence, threshold, bound in zip(Todo, *Tests):
+            AddMargin(Valid, Path, abs(divergence - threshold))
+            if divergence > threshold:
+                Level.append((Root, Curr, Curr, self.SelfBound(Curr), Path))
+            else:
+                Level.append((Root, Valid, Curr, bound, Path))
+        Nodes = []
+        for Root, Valid, Curr, Bound, Path in Level:
+            if order >= self.MaxOrder:
+                AddTerminal(Valid, Path)
+                continue
+            Threshold = HONUtils.KLDThreshold(order + 1, self.Support[Curr], self.ThresholdMultiplier)
+            if Valid != Curr:
+                AddMargin(Valid, Path, abs(Bound - Threshold))
+            if Bound < Threshold:
+                AddTerminal(Valid, Path)
+                continue
+            if Explore is not None and Curr not in Explore:
+                continue
+            Extended = list(self.ExtendSourceFast(Curr))
+            if len(Extended) == 0:
+                # (with Explore, the extensions of Curr can be counted only
+                # in part: Curr is not in self.Extended then)
+                if Explore is None or Curr in self.Extended:
+                    AddTerminal(Valid, Path)
+                continue
+            Nodes.extend([(Root, Valid, ExtSource, Path) for ExtSource in Extended])
+        order += 1
+    if Changed is not None:
+        # counts of each Valid when its tests were done (see CountDrift)
+        # (the nodes read from self.Walks keep their margin left against the
+        # current counts: one CountDrift for all the nodes of a Valid)
+        Snapshots = {}
+        def Snapshot(Valid):
+            if Valid not in Snapshots:
+                Snapshots[Valid] = (self.Support[Valid], dict([(t, c) for t, c in self.Count[Valid].items() if c > 0]))
+            return Snapshots[Valid]
+        for Node, (Terminals, Rules, Excluded, Margin) in Found.items():
+            self.Walks.setdefault(Node[1][-1:], {})[Node] = (self.Step, Terminals, frozenset(Rules), frozenset(Excluded), Margin[0], Snapshot(Node[0]))
+        for Node, (Root, Walk, Margin) in Rebased.items():
+            self.Walks[Root][Node] = (self.Step,) + Walk[1:4] + (Margin, Snapshot(Node[0]))
+    return dict([(Root, Found[(Root, Root)][1]) for Root in Roots])
+
+  def DivergenceTests(self, Valid, Sources, order):
+    # HONUtils.countKLDBatch of the counts of Sources against those of Valid
+    # (divergences, thresholds for 'order' and MaxDivergence bounds)
+    return self.PairDivergenceTests([(Valid, Source) for Source in Sources], order)
+
+  def PairDivergenceTests(self, Pairs, order):
+    # DivergenceTests of the counts of each Source against those of its
+    # Valid (Pairs: list of (Valid, Source))
+    Child, Parent, Indptr, Supports = [], [], [0], []
+    for Valid, Source in Pairs:
+        ValidCount = self.Count[Valid]
+        for Target, c in self.Count[Source].items():
+            if c > 0:
+                Child.append(c)
+                Parent.append(ValidCount.get(Target, 0))
+        Indptr.append(len(Child))
+        Supports.append(self.Support[Valid])
+    return HONUtils.countKLDBatch(Child, Parent, Indptr, Supports, order, self.ThresholdMultiplier)
+
+  def SelfBound(self, Source):
+    # KLD(MaxDivergence(Distr), Distr) of the distribution of Source
+    MinProb = min(c for c in self.Count[Source].values() if c > 0) / self.Support[Source]
+    return math.log(1 / MinProb, 2)
 
   def AddToRules(self,Source):
+    # Source is an extension of the first order source Root
+    Root = Source[-1:]
+    for s in self.SourceRules(Source)[0]:
+        if s not in self.RulesOf[Root]:
+            self.RulesOf[Root].add(s)
+            self.RuleRefs[s] += 1
+
+  def SourceRules(self, Source):
+    # Rules of the prefixes of Source (added to self.Rules if needed), and
+    # the prefixes that are not rules (no count > 0)
+    Rules, Excluded = [], []
     for order in range(1, len(Source)+1):
         s = Source[0:order]
         #print(s, Source)
         if not s in self.Count or len(self.Count[s]) == 0:
             self.ExtendSourceFast(s[1:])
-        for t in self.Count[s]:
-            if self.Count[s][t] > 0:
-                self.Rules[s][t] = self.Count[s][t]
+        # (the counts of a rule already added are the same, or are copied
+        # again by UpdateRules when they change)
+        if s not in self.Rules:
+            for t in self.Count[s]:
+                if self.Count[s][t] > 0:
+                    self.Rules[s][t] = self.Count[s][t]
+        if s in self.Rules:
+            Rules.append(s)
+        else:
+            Excluded.append(s)
+    return Rules, Excluded
+
+  def SetRulesOf(self, Root, Rules, Before):
+    # RulesOf[Root] = Rules, with the references of the rules updated
+    # Before: rule -> number of references before its first change (updated)
+    Old = self.RulesOf[Root]
+    for s in Rules - Old:
+        Before.setdefault(s, self.RuleRefs[s])
+        self.RuleRefs[s] += 1
+    for s in Old - Rules:
+        Before.setdefault(s, self.RuleRefs[s])
+        self.RuleRefs[s] -= 1
+    self.RulesOf[Root] = Rules
+
+  ###########################################
+  # Incremental update
+  ###########################################
+
+  def add_trajectories(self, batch, weights=None):
+    # Add new trajectories (TrajectoryCorpus or list of (list of str)) to
+    # the corpus after ExtractRules(). Only the counts of the sources that
+    # occur in the batch are updated, and the KLD tests are run again only
+    # for the first order sources whose counts changed.
+    # The rules returned by ExtractRules() are updated in place: same rules,
+    # with their targets in the same order, as a new builder on the corpus.
+    # weights: number of occurrences of each trajectory of the batch
+    # Returns: Added, Removed, Updated (sets of rule sources)
+    First = len(self.Corpus)
+    self.Corpus.extend(batch)
+    if weights is not None and self.Weights is None:
+        self.Weights = [1] * First
+    if self.Weights is not None:
+        self.Weights.extend([1] * (len(self.Corpus) - First) if weights is None else weights)
+    self.Index.append(self.Corpus, self.Weights)
+
+    # counts of the sources that occur in the batch
+    Delta = defaultdict(Counter)
+    for Tindex in range(First, len(self.Corpus)):
+        Weight = 1 if self.Weights is None else self.Weights[Tindex]
+        CountContexts(Delta, self.Corpus[Tindex], self.MaxOrder, Weight)
+
+    # update Count and Distribution of the first order sources (the new
+    # targets come last, as in BuildObservations)
+    # the extended sources of the same first order sources are counted
+    # again from the index, that already contains the batch (an extension
+    # that reaches min_support with the batch takes the place of its first
+    # occurrence). The rules found by worker processes in
+    # GenerateAllRulesParallel are counted here too.
+    Roots = set([Source[-1:] for Source in Delta])
+    Recount = set([Source for Source in self.Extended if Source[-1:] in Roots])
+    Recount.update([Source[1:] for Source in Delta if len(Source) > 1 and Source in self.Rules])
+    for Source in Delta:
+        if len(Source) == 1:
+            self.AddToCount(Source, Delta[Source])
+    Contexts = set(Delta)
+    for Source in sorted(Recount, key=len):
+        Contexts.update(self.ExtendObservation(Source))
+    return self.UpdateRules(Contexts)
+
+  def UpdateRules(self, Contexts, Changed=None):
+    # extend again the first order sources whose counts changed
+    # Contexts: sources whose counts changed
+    # Changed: sources whose counts changed since the last UpdateRules, the
+    # other KLD tests are not done again (None: all of them, see ExtendRoots)
+    # (only the references of the rules that change are updated)
+    Roots = sorted(set([Source[-1:] for Source in Contexts]))
+    Extend = [Root for Root in Roots if Root in self.Distribution]
+    RootRules = dict([(Root, set(self.SourceRules(Root)[0])) for Root in Extend])
+    for Root, Rules in self.ExtendRoots(Extend, Changed).items():
+        RootRules[Root].update(Rules)
+    Before = {}
+    for Root in Roots:
+        if Root not in RootRules:
+            self.Walks.pop(Root, None)
+        self.SetRulesOf(Root, RootRules.get(Root, set()), Before)
+        if len(self.RulesOf[Root]) == 0:
+            del self.RulesOf[Root]
+
+    Added = set([s for s, refs in Before.items() if refs == 0 and self.RuleRefs[s] > 0])
+    Removed = set([s for s, refs in Before.items() if refs > 0 and self.RuleRefs[s] == 0])
+    for s in Removed:
+        del self.Rules[s]
+        del self.RuleRefs[s]
+    Updated = set()
+    for s in Contexts:
+        if s in self.Rules and s not in Added and s not in Removed:
+            self.Rules[s] = dict([(t, c) for t, c in self.Count[s].items() if c > 0])
+            Updated.add(s)
+
+    if not self.DecodeRules:
+        return Added, Removed, Updated
+    Decode = self.Corpus.decodeRule
+    for s in Removed:
+        del self.Output[Decode(s)]
+    for s in Added | Updated:
+        self.Output[Decode(s)] = dict([(self.Corpus.symbols[t], c) for t, c in self.Rules[s].items()])
+    return set(map(Decode, Added)), set(map(Decode, Removed)), set(map(Decode, Updated))
+
+  def AddToCount(self, Source, DeltaSource):
+    # DeltaSource: target -> number of new (> 0) or removed (< 0) observations
+    # (new targets come last, see SlidingWindowHON.AddToCount)
+    Count = self.Count[Source]
+    Below = self.BelowSupport[Source]
+    for t, c in DeltaSource.items():
+        c += Count[t] if Count[t] > 0 else Below.get(t, 0)
+        Below.pop(t, None)
+        if c <= 0:
+            del Count[t]
+        elif c < self.MinSupport:
+            Below[t] = c
+            Count[t] = 0
+        else:
+            Count[t] = c
+    Support = sum(Count.values())
+    self.Support[Source] = Support
+    if Support > 0:
+        self.Distribution[Source] = dict([(t, 1.0 * c / Support) for t, c in Count.items() if c > 0])
+        if len(Source) > 1:
+            self.SourceToExtSource[Source[1:]][Source] = None
+    else:
+        self.Distribution.pop(Source, None)
+        if len(Source) > 1:
+            self.SourceToExtSource[Source[1:]].pop(Source, None)
+        if len(Count) == 0:
+            del self.Count[Source]
+            del self.BelowSupport[Source]
+            del self.Support[Source]
 
   ###########################################
   # Auxiliary functions
@@ -102,30 +567,369 @@ class FastHONRulesBuilder():
             return []
 
 
+  def ExtensionCounts(self,Source):
+    # extension of Source -> target -> count, the extensions and their
+    # targets in the order of their first occurrence in the corpus
+    # (MaxDivergence breaks the ties between the probabilities of the
+    # targets with this order), read from the slice of Source in the
+    # position index (see ContextIndex.extensionCounts)
+    if self.Tables is not None:
+        return self.Tables.extensionCounts(Source)
+    return self.Index.extensionCounts(Source)
+
+  def SetTables(self,Tables):
+    # observations read from reduced count tables (CountTables.ShardTables)
+    # instead of the position index: Count gets the first order counts in
+    # the order of their first occurrence (as in BuildObservations) and the
+    # counts of the extensions are read from the tables, in the same order
+    # (ShardedHON.py, ExtractRulesSampled)
+    self.Tables = Tables
+    self.Corpus.symbols = Tables.symbols
+    self.Corpus.symbolIndex = Tables.symbolIndex
+    (j, k), counts, first = Tables.tables[0]
+    for x in np.argsort(first, kind='stable').tolist():
+        self.Count[(int(j[x]),)][int(k[x])] += int(counts[x])
+    Tables.buildRanges()
+
   def ExtendObservation(self,Source):
-    if len(Source) > 1:
-        if (not Source[1:] in self.Count) or (len(self.Count[Source]) == 0):
-            self.ExtendObservation(Source[1:])
-    order = len(Source)
-    C = defaultdict(lambda: defaultdict(int))
-
-    for Tindex, index in self.StartingPoints[Source]:
-        if index - 1 >= 0 and index + order < len(self.Trajectory[Tindex]):
-            ExtSource = tuple(self.Trajectory[Tindex][index - 1:index + order])
-            Target = self.Trajectory[Tindex][index + order]
-            C[ExtSource][Target] += 1
-            self.StartingPoints[ExtSource].add((Tindex, index - 1))
-
-    if len(C) == 0:
-        return
+    # (counts of the extensions are replaced if Source was already extended)
+    # Returns the counts of the extensions (see ExtensionCounts)
+    C = self.ExtensionCounts(Source)
+    self.Extended.add(Source)
+    self.SetExtensionCounts(C)
+    # extensions in the order of C (an extension counted again can have
+    # been below min_support before)
+    if Source in self.SourceToExtSource:
+        Ext = self.SourceToExtSource[Source]
+        self.SourceToExtSource[Source] = dict.fromkeys([s for s in C if s in Ext] + [s for s in Ext if s not in C])
+    return C
+
+  def SetExtensionCounts(self, C):
+    # Count, Support and Distribution of the extensions of C
+    # (extension -> target -> count, see ExtensionCounts)
     for s in C:
+        if s in self.Count:
+            del self.Count[s]
+            self.Distribution.pop(s, None)
+            self.BelowSupport.pop(s, None)
         for t in C[s]:
             if C[s][t] < self.MinSupport:
+                self.BelowSupport[s][t] = C[s][t]
                 C[s][t] = 0
-            self.Count[s][t] += C[s][t]
+            self.Count[s][t] = C[s][t]
         CsSupport = sum(C[s].values())
+        self.Support[s] = CsSupport
         for t in C[s]:
             if C[s][t] > 0:
                 self.Distribution[s][t] = 1.0 * C[s][t] / CsSupport
-                self.SourceToExtSource[s[1:]].add(s)
+                self.SourceToExtSource[s[1:]][s] = None
+
+
+def CountDrift(Snapshot, Support, Count):
+    # Bound of the change of KLD(Distr, D) (and of KLD(MaxDivergence(Distr), D))
+    # between D the distribution of Snapshot (support, target -> count > 0)
+    # and D the distribution of Count, for any Distr whose targets have a
+    # count > 0 in both: with D(t) = Count[t] / Support, the change is at
+    # most |log2(Support / support)| + max |log2(Count[t] / count[t])|
+    # (the targets of the extensions of a source have a count > 0 in the
+    # source, the other targets are skipped)
+    OldSupport, OldCount = Snapshot
+    if Support == 0:
+        return math.inf
+    Drift = 0.
+    for t, c in OldCount.items():
+        New = Count.get(t, 0)
+        if New > 0 and New != c:
+            Drift = max(Drift, abs(math.log(New / c, 2)))
+    return Drift + abs(math.log(Support / OldSupport, 2))
+
+def CountContexts(Delta, Trajectory, MaxOrder, Sign = 1):
+    # Add Sign to Delta[Source][Target] for each Source of length <= MaxOrder
+    # followed by Target in the trajectory
+    for index in range(len(Trajectory) - 1):
+        Target = Trajectory[index + 1]
+        for order in range(1, min(MaxOrder, index + 1) + 1):
+            Delta[tuple(Trajectory[index - order + 1:index + 1])][Target] += Sign
+
+###########################################
+# Process pool used by GenerateAllRulesParallel
+###########################################
+
+WorkerBuilder = None
+
+def InitRulesWorker(corpus, index, max_order, min_support, ThresholdMultiplier, weights=None):
+    global WorkerBuilder
+    WorkerBuilder = FastHONRulesBuilder(corpus, max_order, min_support, ThresholdMultiplier, weights=weights)
+    WorkerBuilder.Index = index
+    WorkerBuilder.BuildObservations()
+    WorkerBuilder.BuildDistributions()
+
+def ExtendRulesChunk(Sources):
+    # Returns the rules added by each source of the chunk (in insertion order)
+    ChunkRules = []
+    for Source in Sources:
+        WorkerBuilder.Rules = defaultdict(dict)
+        WorkerBuilder.AddToRules(Source)
+        WorkerBuilder.ExtendRule(Source, Source, 1)
+        ChunkRules.append(dict(WorkerBuilder.Rules))
+    return ChunkRules
+
+
+class Order2RulesBuilder():
+  ###########################################
+  # Same rules as FastHONRulesBuilder(trajectories, 2, min_support, ThresholdMultiplier)
+  # and as the original builder on the int ids (in the same order, with
+  # their targets in the same order) computed from
+  # the bigram and trigram counts of the corpus, all found in one
+  # vectorised pass, and the KLD tests of ExtendRule done in batch
+  ###########################################
+  def __init__(self,trajectories,min_support, ThresholdMultiplier, weights=None):
+    self.DecodeRules = not isinstance(trajectories, TrajectoryCorpus)
+    if self.DecodeRules:
+        trajectories = TrajectoryCorpus.fromSequences(trajectories)
+    self.ThresholdMultiplier = ThresholdMultiplier
+    self.Rules = defaultdict(dict)
+    self.Corpus = trajectories
+    self.MinSupport = min_support
+    # number of occurrences of each trajectory (None: 1 each)
+    self.Weights = None if weights is None else np.asarray(weights, dtype=np.int64)
+
+  def ExtractRules(self):
+    self.BuildObservations()
+    self.GenerateAllRules()
+    if self.DecodeRules:
+        self.Output = self.Corpus.decodeRules(self.Rules)
+    else:
+        self.Output = self.Rules
+    return self.Output
+
+  def BuildObservations(self):
+    # (j, k) and (i, j, k) arrays with the count of each bigram / trigram
+    # counts lower than MinSupport are removed (set to 0 in FastHONRulesBuilder)
+    # The bigrams are sorted by (j, k), and self.FirstOrder gives the first
+    # order rules in the order of FastHONRulesBuilder (sources and targets
+    # by first occurrence). The trigrams are sorted as the extensions of
+    # FastHONRulesBuilder: by j, then extensions (i, j) and targets k by
+    # first occurrence (see FastHONRulesBuilder.ExtensionCounts)
+    Tokens = self.Corpus.tokenArray().astype(np.int64)
+    Offsets = self.Corpus.offsetArray()
+    Lengths = np.diff(Offsets)
+    Position = np.arange(len(Tokens), dtype=np.int64)
+    Start = np.repeat(Offsets[:-1], Lengths)
+    End = np.repeat(Offsets[1:], Lengths)
+    HasNext = Position + 1 < End
+    HasPrev = Position > Start
+    self.NbSymbols = V = max(self.Corpus.nbSymbols(), 1)
+    Weight = None
+    if self.Weights is not None:
+        Weight = np.repeat(self.Weights, Lengths)
+
+    p = Position[HasNext]
+    Keys, First, Inverse = np.unique(Tokens[p] * V + Tokens[p + 1], return_index=True, return_inverse=True)
+    Counts = np.bincount(Inverse.ravel(), None if Weight is None else Weight[p], len(Keys)).astype(np.int64)
+    # first occurrence of each bigram and of its source (with any count)
+    First = p[First]
+    SourceFirst = GroupMinimum(Keys // V, First)
+    Kept = Counts >= self.MinSupport
+    self.Bigrams, self.BigramCount = [Keys[Kept] // V, Keys[Kept] % V], Counts[Kept]
+    self.FirstOrder = defaultdict(dict)
+    Order = np.lexsort((First[Kept], SourceFirst[Kept]))
+    for j, k, c in zip(self.Bigrams[0][Order].tolist(), self.Bigrams[1][Order].tolist(), self.BigramCount[Order].tolist()):
+        self.FirstOrder[(j,)][k] = c
+
+    # trigram keys: id of the pair (i, j) * V + k
+    p = Position[HasNext & HasPrev]
+    Pairs, PairId = np.unique(Tokens[p - 1] * V + Tokens[p], return_inverse=True)
+    Keys, First, Inverse = np.unique(PairId.ravel() * V + Tokens[p + 1], return_index=True, return_inverse=True)
+    Counts = np.bincount(Inverse.ravel(), None if Weight is None else Weight[p], len(Keys)).astype(np.int64)
+    # first occurrence of each extension (i, j), with any target
+    ExtFirst = GroupMinimum(Keys // V, First)
+    Kept = np.flatnonzero(Counts >= self.MinSupport)
+    Kept = Kept[np.lexsort((First[Kept], ExtFirst[Kept], Pairs[Keys[Kept] // V] % V))]
+    Keys = Keys[Kept]
+    Pairs = Pairs[Keys // V]
+    self.Trigrams, self.TrigramCount = [Pairs // V, Pairs % V, Keys % V], Counts[Kept]
+
+  def ExtractRulesMulti(self, Multipliers):
+    # See ExtractRulesMulti(..) (same counts and KLD tests for all the
+    # multipliers, see ScoreRules()). The rule sets are nested: rules of a
+    # multiplier contain those of the larger ones.
+    return ExtractRulesMulti(self, Multipliers)
+
+  def MultiplierRules(self, ThresholdMultiplier):
+    # Rules obtained with ThresholdMultiplier (same counts and KLD tests)
+    if not hasattr(self, 'Divergence'):
+        self.BuildObservations()
+        self.ScoreRules()
+    self.SelectRules(ThresholdMultiplier)
+    return self.Corpus.decodeRules(self.Rules) if self.DecodeRules else self.Rules
+
+  def CountRules(self, ThresholdMultiplier):
+    # Number of rules obtained with ThresholdMultiplier (no rule is built)
+    if not hasattr(self, 'Divergence'):
+        self.BuildObservations()
+        self.ScoreRules()
+    return len(self.FirstOrder) + int(self.ValidExtensions(ThresholdMultiplier).sum())
+
+  def SearchThresholdMultiplier(self, TargetSize, Low = 1., High = None, Tolerance = 1e-3):
+    # See SearchThresholdMultiplier(..)
+    return SearchThresholdMultiplier(self.CountRules, TargetSize, Low, High, Tolerance)
+
+  def GenerateAllRules(self):
+    self.ScoreRules()
+    self.SelectRules(self.ThresholdMultiplier)
+
+  def ScoreRules(self):
+    # KLD tests of ExtendRule for all the second order extensions.
+    # The thresholds are kept for ThresholdMultiplier = 1: the threshold
+    # of a multiplier m is m * (threshold for 1), see SelectRules()
+    j, k = self.Bigrams
+    # first order rules: Distribution of each source
+    Sources, SourceStart = np.unique(j, return_index=True)
+    Support = np.add.reduceat(self.BigramCount, SourceStart) if len(j) > 0 else np.zeros(0, dtype=np.int64)
+    MinCount = np.minimum.reduceat(self.BigramCount, SourceStart) if len(j) > 0 else np.zeros(0, dtype=np.int64)
+
+    # same test as in ExtendRule (order = 1):
+    # KLD(MaxDivergence(Distr), Distr) < KLDThreshold(2, support)
+    self.SourceBound = HONUtils.exactLog2(1 / (MinCount / Support))
+    self.SourceThreshold = HONUtils.KLDThresholdBatch(2, Support, 1.)
+
+    # second order extensions (i, j) of all the sources j
+    i, j, k = self.Trigrams
+    c = self.TrigramCount
+    self.Extensions = (i, j, k, c)
+    if len(c) == 0:
+        self.ExtStart = np.zeros(0, dtype=np.int64)
+        self.ExtSource = np.zeros(0, dtype=np.int64)
+        self.Divergence = np.zeros(0)
+        self.ExtThreshold = np.zeros(0)
+        self.KLDCounts = (c, np.zeros(0, dtype=np.int64), np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        return
+    self.ExtStart = np.flatnonzero(np.concatenate(([True], (i[1:] != i[:-1]) | (j[1:] != j[:-1]))))
+    # count of each target in the extension and in its source
+    BigramIndex = np.searchsorted(self.Bigrams[0] * self.NbSymbols + self.Bigrams[1], j * self.NbSymbols + k)
+    self.ExtSource = np.searchsorted(Sources, j[self.ExtStart])
+    # counts of the KLD tests, kept for HONUtils.exactNearThresholds
+    self.KLDCounts = (c, self.BigramCount[BigramIndex], np.append(self.ExtStart, len(c)), Support[self.ExtSource])
+    self.Divergence, self.ExtThreshold, _ = HONUtils.countKLDBatch(*self.KLDCounts, 2, 1.)
+
+  def ValidExtensions(self, ThresholdMultiplier):
+    # Extensions kept with ThresholdMultiplier: their source can be
+    # extended and their divergence is larger than the threshold
+    Extend = self.SourceBound >= ThresholdMultiplier * self.SourceThreshold
+    Threshold = ThresholdMultiplier * self.ExtThreshold
+    Divergence = self.Divergence
+    if ThresholdMultiplier != 1.:
+        Divergence = HONUtils.exactNearThresholds(Divergence, Threshold, *self.KLDCounts)
+    return Extend[self.ExtSource] & (Divergence > Threshold)
+
+  def SelectRules(self, ThresholdMultiplier):
+    # rules inserted in the order of FastHONRulesBuilder: each first order
+    # source, then its valid extensions (i, j), each one after (i,)
+    i, j, k, c = self.Extensions
+    self.ThresholdMultiplier = ThresholdMultiplier
+    self.Rules = defaultdict(dict)
+    ExtStop = np.append(self.ExtStart[1:], len(c))
+    Valid = np.flatnonzero(self.ValidExtensions(ThresholdMultiplier))
+    Sources = np.unique(self.Bigrams[0])
+    Bounds = np.searchsorted(self.ExtSource[Valid], np.arange(len(Sources) + 1)).tolist()
+    SourceIndex = dict(zip(Sources.tolist(), range(len(Sources))))
+    for s in self.FirstOrder:
+        if s not in self.Rules:
+            self.Rules[s] = dict(self.FirstOrder[s])
+        x = SourceIndex[s[0]]
+        for e in Valid[Bounds[x]:Bounds[x + 1]].tolist():
+            a, b = self.ExtStart[e], ExtStop[e]
+            ExtSource = (int(i[a]), int(j[a]))
+            if ExtSource[:1] not in self.Rules:
+                self.Rules[ExtSource[:1]] = dict(self.FirstOrder[ExtSource[:1]])
+            self.Rules[ExtSource] = dict(zip(k[a:b].tolist(), c[a:b].tolist()))
+
+###########################################
+# Auxiliary functions
+###########################################
+
+def ExtractRulesMulti(Builder, Multipliers):
+    # Rules of the rule builder Builder for each ThresholdMultiplier of
+    # Multipliers, in increasing order (see the MultiplierRules method of
+    # the rule builders). Builder.Output is set to the rules of the last one.
+    # Returns: dict multiplier -> rules (as ExtractRules())
+    Output = {}
+    for Multiplier in sorted(Multipliers):
+        Output[Multiplier] = Builder.Output = Builder.MultiplierRules(Multiplier)
+    return Output
+
+def SearchThresholdMultiplier(CountRules, TargetSize, Low = 1., High = None, Tolerance = 1e-3):
+    # Bisection on the ThresholdMultiplier (alpha) to get a network with
+    # at most TargetSize rules (e.g. alpha* such that VON2 is as sparse as Agg-VON2).
+    # CountRules(alpha) gives the number of rules, non increasing with alpha
+    # (see the CountRules method of the rule builders).
+    # Returns the smallest alpha found (up to Tolerance) with CountRules(alpha) <= TargetSize
+    # Raises ValueError if no alpha up to High (2**30 * Low if not given)
+    # gives at most TargetSize rules (e.g. less than the number of first
+    # order rules, that do not depend on alpha)
+    if CountRules(Low) <= TargetSize:
+        return Low
+    if High is None:
+        # doubling until the target size is reached
+        High = 2 * Low
+        for _ in range(30):
+            if CountRules(High) <= TargetSize:
+                break
+            Low, High = High, 2 * High
+        else:
+            raise ValueError(f'No ThresholdMultiplier up to {Low} gives at most {TargetSize} rules')
+    elif CountRules(High) > TargetSize:
+        raise ValueError(f'No ThresholdMultiplier up to {High} gives at most {TargetSize} rules')
+    while High - Low > Tolerance:
+        Middle = (Low + High) / 2
+        if CountRules(Middle) <= TargetSize:
+            High = Middle
+        else:
+            Low = Middle
+    return High
+
+def GroupMinimum(Groups, Values):
+    # Minimum of Values over the elements of the same group, for each
+    # element (Groups is sorted)
+    if len(Groups) == 0:
+        return Values
+    Start = np.flatnonzero(np.concatenate(([True], Groups[1:] != Groups[:-1])))
+    return np.repeat(np.minimum.reduceat(Values, Start), np.diff(np.append(Start, len(Groups))))
+
+def CountTuples(columns, NbSymbols, Weights=None, First=None):
+    # Count the distinct tuples (columns[0][x], columns[1][x], ...)
+    # Returns the columns of the distinct tuples (in lexicographic order),
+    # their counts and their first positions. Tuples are packed into int64
+    # keys when possible.
+    # Weights: int weight of each tuple (counts are the sums of the weights)
+    # First: position of each tuple, the smallest one is kept for each
+    # distinct tuple (None: no positions are returned)
+    if NbSymbols ** len(columns) < 2**63:
+        Keys = np.zeros(len(columns[0]), dtype=np.int64)
+        for col in columns:
+            Keys = Keys * NbSymbols + col
+        Keys, Counts, First = UniqueCounts(Keys, Weights, First=First)
+        Unpacked = []
+        for col in columns:
+            Unpacked.append(Keys % NbSymbols)
+            Keys = Keys // NbSymbols
+        return Unpacked[::-1], Counts, First
+    Tuples, Counts, First = UniqueCounts(np.stack(columns, axis=1), Weights, axis=0, First=First)
+    return [Tuples[:, x] for x in range(len(columns))], Counts, First
 
+def UniqueCounts(Keys, Weights=None, axis=None, First=None):
+    # np.unique(Keys, return_counts=True) where each key counts for its
+    # weight, and the smallest position of each key (First: position of
+    # each key, None if not given)
+    if Weights is None and First is None:
+        return np.unique(Keys, axis=axis, return_counts=True) + (None,)
+    Uniq, Inverse, Counts = np.unique(Keys, axis=axis, return_inverse=True, return_counts=True)
+    Inverse = Inverse.ravel()
+    if Weights is not None:
+        Counts = np.bincount(Inverse, weights=Weights, minlength=len(Uniq)).astype(np.int64)
+    if First is not None:
+        Positions = np.full(len(Uniq), np.iinfo(np.int64).max)
+        np.minimum.at(Positions, Inverse, First)
+        First = Positions
+    return Uniq, Counts, First
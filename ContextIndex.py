@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+'''
+Position index over all the sequences of a TrajectoryCorpus
+used by FastHONRulesBuilder to find the occurrences of a source
+
+The index is a suffix array built on the reversed sequences:
+every position e of the corpus is sorted according to the context
+tokens[e], tokens[e-1], tokens[e-2], ... read backwards up to the start
+of its sequence. Consequently:
+- the occurrences of any source (s_1,...,s_k) ending at some position
+  are one contiguous slice of the array
+- inside this slice, the occurrences are sorted by the symbol
+  preceding s_1, so the occurrences of each extension (x,s_1,...,s_k)
+  are contiguous sub-slices
+
+The index keeps the suffix array and, for each segment, the bounds
+(lo, hi) of the slices of the sources found so far (one pair per source
+instead of one entry per occurrence). The extensions of a source are
+counted from the slice of the source, and the slices of the extensions
+are kept to count their own extensions (see ContextIndex.extensionCounts(..),
+the counts of FastHONRulesBuilder).
+
+Sequences added to the corpus after the index is built are indexed
+in new segments (see ContextIndex.append(..)).
+
+Each sequence can have a weight (number of identical trajectories it
+stands for, see TrajectoryCorpus.deduplicate()): the counts are then
+the sums of the weights of the occurrences.
+'''
+import numpy as np
+
+class ContextIndex():
+	##################################################################
+	def __init__(self, corpus, max_segments = 8, weights = None):
+		'''
+		Parameters:
+		-----------
+		corpus: TrajectoryCorpus
+		max_segments: int, all the segments are merged into one
+					  when this number is reached
+		weights: list of int, weight of each sequence of corpus
+				 (None: weight 1)
+		'''
+		self.segments = []
+		self.nbSequences = 0
+		self.maxSegments = max_segments
+		self.append(corpus, weights)
+
+	##################################################################
+	def append(self, corpus, weights = None):
+		'''
+		Index the sequences added to 'corpus' since the last call
+		(weights: weights of all the sequences of corpus, or None)
+		'''
+		if len(corpus) == self.nbSequences and len(self.segments) > 0:
+			return
+		if len(self.segments) >= self.maxSegments:
+			self.segments = []
+			self.nbSequences = 0
+		self.segments.append(IndexSegment(corpus, self.nbSequences, weights))
+		self.nbSequences = len(corpus)
+
+	##################################################################
+	def extensionCounts(self, source):
+		'''
+		Count the symbols following each extension (x,) + source of
+		'source' in the corpus (all the segments).
+		The extensions, and the targets of each extension, are in order of
+		their first occurrence in the corpus.
+
+		Returns:
+		--------
+		counts: dict tuple of int -> dict (int -> int)
+				extension of source -> target -> number of occurrences
+		'''
+		found = [seg.extensionOccurrences(source) for seg in self.segments]
+		preds, targets, positions, weights = [np.concatenate(x) for x in zip(*found)]
+		counts = {}
+		if len(preds) == 0:
+			return counts
+		nb_symbols = max(seg.nbSymbols for seg in self.segments)
+		## (extension, target) pairs in order of position
+		order = np.argsort(positions, kind='stable')
+		keys = preds[order] * nb_symbols + targets[order]
+		uniq, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+		nb = np.bincount(inverse.ravel(), weights=weights[order], minlength=len(uniq)).astype(np.int64)
+		## first occurrence of the extension of each pair (uniq is sorted by extension)
+		ext = uniq // nb_symbols
+		starts = np.flatnonzero(np.concatenate(([True], ext[1:] != ext[:-1])))
+		ext_first = np.repeat(np.minimum.reduceat(first, starts), np.diff(np.append(starts, len(ext))))
+		pairs = np.lexsort((first, ext_first))
+		for key, c in zip(uniq[pairs].tolist(), nb[pairs].tolist()):
+			x, target = divmod(key, nb_symbols)
+			ext = (x,) + source
+			if ext not in counts:
+				counts[ext] = {}
+			counts[ext][target] = c
+		return counts
+
+class IndexSegment():
+	##################################################################
+	def __init__(self, corpus, first_seq = 0, weights = None):
+		'''
+		Index of the sequences first_seq, first_seq+1, ... of corpus
+
+		Parameters:
+		-----------
+		corpus: TrajectoryCorpus
+		weights: list of int, weight of each sequence of corpus (or None)
+		'''
+		## own copies: the corpus can grow after the index is built
+		offsets = corpus.offsetArray()
+		self.base    = int(offsets[first_seq])
+		self.tokens  = np.array(corpus.tokenArray()[self.base:], dtype=np.int64)
+		self.offsets = np.array(offsets[first_seq:], dtype=np.int64) - self.base
+		self.nbSymbols = max(corpus.nbSymbols(), 1)
+		self.weights = None if weights is None else np.array(weights[first_seq:len(corpus)], dtype=np.int64)
+		self.sa = buildReverseSuffixArray(self.tokens, self.offsets)
+		## symbol x -> range of sources (x,) in sa
+		self.symbStart = np.zeros(self.nbSymbols + 1, dtype=np.int64)
+		np.cumsum(np.bincount(self.tokens, minlength=self.nbSymbols), out=self.symbStart[1:])
+		self.ranges = {} ## source (len > 1) -> (lo, hi)
+
+	##################################################################
+	def find(self, source):
+		'''
+		Returns the range (lo, hi) such that sa[lo:hi] contains the
+		positions where an occurrence of 'source' ends
+		(no recursion: the range of the longest suffix already found is
+		narrowed one symbol at a time, whatever the length of source)
+		'''
+		## longest suffix source[i:] whose range is known
+		i = 0
+		while i < len(source) - 1 and source[i:] not in self.ranges:
+			i += 1
+		if i < len(source) - 1:
+			lo, hi = self.ranges[source[i:]]
+		elif source[i] >= self.nbSymbols:
+			lo, hi = 0, 0
+		else:
+			lo, hi = int(self.symbStart[source[i]]), int(self.symbStart[source[i] + 1])
+		for j in range(i - 1, -1, -1):
+			preds = self._predecessors(lo, hi, len(source) - 1 - j)
+			lo, hi = (lo + int(np.searchsorted(preds, source[j], 'left')),
+					  lo + int(np.searchsorted(preds, source[j], 'right')))
+			self.ranges[source[j:]] = (lo, hi)
+		return lo, hi
+
+	##################################################################
+	def extensionOccurrences(self, source):
+		'''
+		Occurrences of 'source' preceded by a symbol x and followed by a
+		target, i.e. occurrences of the extensions (x,) + source.
+		The ranges of the extensions are kept in the index.
+
+		Returns:
+		--------
+		preds, targets: arrays of int, symbols x and targets
+		positions: array of int, position in the corpus (not the segment)
+				   where each occurrence of source ends
+		weights: array of int, weight of the sequence of each occurrence
+		'''
+		lo, hi = self.find(source)
+		ends  = self.sa[lo:hi].astype(np.int64)
+		preds = self._predecessors(lo, hi, len(source))
+
+		## ranges of the extensions: preds is sorted
+		## (-1 first, for occurrences at the start of a sequence)
+		first = int(np.searchsorted(preds, 0, 'left'))
+		if first < len(preds):
+			bounds = np.flatnonzero(preds[first + 1:] != preds[first:-1]) + first + 1
+			starts = np.concatenate(([first], bounds)).tolist()
+			stops  = np.concatenate((bounds, [len(preds)])).tolist()
+			for a, b in zip(starts, stops):
+				self.ranges[(int(preds[a]),) + source] = (lo + a, lo + b)
+
+		seq  = np.searchsorted(self.offsets, ends, 'right') - 1
+		mask = (preds >= 0) & (ends + 1 < self.offsets[seq + 1])
+		ends, seq = ends[mask], seq[mask]
+		weights = np.ones(len(ends), dtype=np.int64) if self.weights is None else self.weights[seq]
+		return preds[mask], self.tokens[ends + 1], ends + self.base, weights
+
+	##################################################################
+	def _predecessors(self, lo, hi, order):
+		'''
+		Symbol found 'order' positions before each position of sa[lo:hi]
+		(-1 if it is before the start of the sequence)
+		'''
+		ends = self.sa[lo:hi]
+		seq  = np.searchsorted(self.offsets, ends, 'right') - 1
+		prev = ends - order
+		return np.where(prev >= self.offsets[seq], self.tokens[np.maximum(prev, 0)], -1)
+
+##################################################################
+def buildReverseSuffixArray(tokens, offsets):
+	'''
+	Sort the positions of 'tokens' according to the reversed
+	context ending at each position (prefix doubling).
+	A position whose context reaches the start of its sequence is smaller
+	than the positions that have a longer context.
+
+	Parameters:
+	-----------
+	tokens : numpy array of int (ids >= 0)
+	offsets: numpy array of int, start of each sequence (+ total length)
+
+	Returns:
+	--------
+	sa: numpy array of int (int32 if possible)
+	'''
+	n = len(tokens)
+	dtype = np.int32 if n < 2**31 else np.int64
+	if n == 0:
+		return np.zeros(0, dtype=dtype)
+	lengths = np.diff(offsets)
+	## number of symbols before each position in its sequence
+	depth = np.arange(n, dtype=np.int64) - np.repeat(offsets[:-1], lengths)
+	max_len = int(lengths.max())
+
+	## rank 0 is kept for 'before the start of the sequence'
+	_, rank = np.unique(tokens, return_inverse=True)
+	rank = rank.astype(np.int64) + 1
+	h = 1
+	while h < max_len and rank.max() < n:
+		prev = np.arange(n, dtype=np.int64) - h
+		second = np.where(depth >= h, rank[np.maximum(prev, 0)], 0)
+		_, rank = np.unique(rank * (n + 1) + second, return_inverse=True)
+		rank = rank.astype(np.int64) + 1
+		h *= 2
+	return np.argsort(rank, kind='stable').astype(dtype)
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+'''
+Count tables of the (source, target) pairs of a corpus for each order
+n <= max_order, used instead of the position index of
+FastHONRulesBuilder (see FastHONRulesBuilder.SetTables(..)):
+- ShardedHON.py: one table per sequence file (countShard(..)), merged
+  into global tables (ShardTables.merge(..))
+- FastHONRulesBuilder.ExtractRulesSampled(..): tables of the sample of
+  the trajectories (corpusTables(..))
+'''
+import numpy as np
+
+import BuildRulesFast
+import SequenceReader
+
+##################################################################
+## Map: counts of one shard
+##################################################################
+def countShard(params):
+	'''
+	Parameters:
+	-----------
+	params: (filename, is_line_id, separator, max_order, use_cache, cache_dir)
+			(see SequenceReader.readCorpus(..))
+
+	Returns:
+	--------
+	symbols: list of str, symbols of the shard (by order of first occurrence)
+	nb_tokens: int, number of locations in the shard
+	tables: list (one per order, see countCorpus(..))
+	'''
+	filename, is_line_id, separator, max_order, use_cache, cache_dir = params
+	corpus = SequenceReader.readCorpus(filename, is_line_id, separator, use_cache=use_cache, cache_dir=cache_dir)
+	return corpus.symbols, len(corpus.tokens), countCorpus(corpus, max_order)
+
+##################################################################
+def countCorpus(corpus, max_order, weights = None):
+	'''
+	Parameters:
+	-----------
+	corpus: TrajectoryCorpus
+	weights: list of int, number of occurrences of each sequence (optional)
+
+	Returns:
+	--------
+	tables: list (one per order n = 1..max_order) of (columns, counts, first)
+			columns: n+1 arrays of symbol ids (source then target) of the
+			distinct pairs (in lexicographic order), counts: their number of
+			occurrences, first: position of their first occurrence
+	'''
+	tokens = corpus.tokenArray().astype(np.int64)
+	offsets = corpus.offsetArray()
+	nb_symbols = max(corpus.nbSymbols(), 1)
+	end = np.repeat(offsets[1:], np.diff(offsets))
+	position = np.arange(len(tokens), dtype=np.int64)
+	weight = None if weights is None else np.repeat(np.asarray(weights, dtype=np.int64), np.diff(offsets))
+	tables = []
+	for order in range(1, max_order + 1):
+		## occurrences of a source of length 'order' followed by a target
+		p = position[position + order < end]
+		w = None if weight is None else weight[p]
+		columns = [tokens[p + x] for x in range(order + 1)]
+		tables.append(BuildRulesFast.CountTuples(columns, nb_symbols, w, p))
+	return tables
+
+##################################################################
+## Reduce: global count tables
+##################################################################
+## minimum number of rows of the shard tables merged by one reduce()
+REDUCE_ROWS = 1 << 20
+
+class ShardTables():
+	##################################################################
+	def __init__(self, max_order):
+		self.symbols = []
+		self.symbolIndex = {}
+		self.nbTokens = 0 ## locations of the shards already merged
+		self.tables = [None] * max_order
+		self.ranges = [None] * max_order
+		self.pending = [[] for _ in range(max_order)] ## shard tables not reduced yet
+		self.nbPending = 0 ## rows of the pending tables
+		self.nbRows = 0 ## rows of the reduced tables
+
+	##################################################################
+	def intern(self, symb):
+		i = self.symbolIndex.get(symb)
+		if i is None:
+			i = len(self.symbols)
+			self.symbolIndex[symb] = i
+			self.symbols.append(symb)
+		return i
+
+	##################################################################
+	def merge(self, shard):
+		'''
+		Add the counts of a shard (countShard(..)) to the tables.
+		Shards must be merged in the order of the files. Their tables are
+		kept until they have as many rows as the reduced tables (and at
+		least REDUCE_ROWS), then merged by reduce(): each row is reduced
+		O(log(nb rows)) times instead of once per shard.
+		'''
+		symbols, nb_tokens, tables = shard
+		mapping = np.array([self.intern(s) for s in symbols], dtype=np.int64)
+		for n, (columns, counts, first) in enumerate(tables):
+			columns = [mapping[c] for c in columns]
+			self.pending[n].append((columns, counts, first + self.nbTokens))
+			self.nbPending += len(counts)
+		self.nbTokens += nb_tokens
+		if self.nbPending >= max(self.nbRows, REDUCE_ROWS):
+			self.reduce()
+
+	##################################################################
+	def reduce(self):
+		'''
+		Merge the pending shard tables into the tables (one np.unique
+		per order)
+		'''
+		nb_symbols = max(len(self.symbols), 1)
+		self.nbRows = 0
+		for n, pending in enumerate(self.pending):
+			if self.tables[n] is not None:
+				pending = [self.tables[n]] + pending
+			if len(pending) == 0:
+				continue
+			columns = [np.concatenate(c) for c in zip(*[p[0] for p in pending])]
+			counts = np.concatenate([p[1] for p in pending])
+			## the first occurrence of each pair is kept
+			first = np.concatenate([p[2] for p in pending])
+			self.tables[n] = BuildRulesFast.CountTuples(columns, nb_symbols, counts, first)
+			self.nbRows += len(self.tables[n][1])
+		self.pending = [[] for _ in self.tables]
+		self.nbPending = 0
+
+	##################################################################
+	def buildRanges(self):
+		'''
+		Sort the tables of order n >= 2 by source[1:], then by the first
+		occurrence of the extension (source) and of the pair, and keep the
+		rows of the extensions of each source of length n-1 (in the order of
+		ContextIndex.extensionCounts(..))
+		'''
+		for n in range(1, len(self.tables)):
+			if self.tables[n] is None:
+				continue
+			columns, counts, first = self.tables[n]
+			if len(counts) == 0:
+				self.ranges[n] = {}
+				continue
+			## first occurrence of the extension (source) of each row: the rows
+			## of an extension are contiguous in lexicographic order
+			## (np.lexsort: last key first)
+			order = np.lexsort(tuple(columns[::-1]))
+			columns, counts, first = [c[order] for c in columns], counts[order], first[order]
+			ext = np.stack(columns[:-1], axis=1)
+			group = np.concatenate(([0], np.cumsum((ext[1:] != ext[:-1]).any(axis=1))))
+			ext_first = BuildRulesFast.GroupMinimum(group, first)
+			order = np.lexsort(tuple([first, ext_first] + columns[-2:0:-1]))
+			columns = [c[order] for c in columns]
+			counts, first = counts[order], first[order]
+			self.tables[n] = (columns, counts, first)
+			suffix = np.stack(columns[1:-1], axis=1)
+			change = np.flatnonzero((suffix[1:] != suffix[:-1]).any(axis=1)) + 1
+			starts = np.concatenate(([0], change)).tolist()
+			stops = np.concatenate((change, [len(counts)])).tolist()
+			sources = suffix[starts].tolist()
+			self.ranges[n] = {tuple(s): (a, b) for s, a, b in zip(sources, starts, stops)}
+
+	##################################################################
+	def extensionCounts(self, source):
+		'''
+		Returns:
+		--------
+		counts: dict tuple of int -> dict (int -> int)
+				extension of source -> target -> number of occurrences
+		'''
+		counts = {}
+		n = len(source)
+		if n >= len(self.tables) or self.ranges[n] is None or source not in self.ranges[n]:
+			return counts
+		a, b = self.ranges[n][source]
+		columns, nb, _ = self.tables[n]
+		preds, targets, nb = columns[0][a:b].tolist(), columns[-1][a:b].tolist(), nb[a:b].tolist()
+		for x, t, c in zip(preds, targets, nb):
+			ext = (x,) + source
+			if ext not in counts:
+				counts[ext] = {}
+			counts[ext][t] = c
+		return counts
+
+##################################################################
+def corpusTables(corpus, max_order, weights = None):
+	'''
+	Reduced tables of a corpus in memory, counted as one shard (the symbol
+	ids are the ones of the corpus)
+
+	Parameters:
+	-----------
+	corpus: TrajectoryCorpus
+	weights: list of int, number of occurrences of each trajectory (optional)
+
+	Returns:
+	--------
+	tables: ShardTables
+	'''
+	tables = ShardTables(max_order)
+	tables.merge((corpus.symbols, len(corpus.tokens), countCorpus(corpus, max_order, weights)))
+	tables.reduce()
+	return tables
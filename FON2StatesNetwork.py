@@ -2,11 +2,25 @@
 '''
 Functions used to generated a FON2 networks
 (Fixed order model taking all subsequence of length 2)
+
+buildFON2Network(..) gives a StateGraph (states 'i-j', physical node j).
+buildFON2NetworkFast(..) gives the same StateGraph, built on arrays of
+symbol ids (the 'i-j' strings are only made when the labels of the
+states are read, e.g. when the Pajek file is written).
+
+Both functions accept the number of occurrences of each sequence
+(weights, see TrajectoryCorpus.deduplicate()): a sequence of weight w
+is counted as w identical sequences.
 '''
+import numpy as np
 
-def order2Rules(sequences):
+from StateGraph import StateGraph
+from TrajectoryCorpus import TrajectoryCorpus
+
+def order2Rules(sequences, weights = None):
 	order2 = {}
-	for seq in sequences:
+	for index_seq, seq in enumerate(sequences):
+		w = 1. if weights is None else float(weights[index_seq])
 		if len(seq)>=3:
 			for i in range(2,len(seq)):
 				i, j, k = seq[i-2], seq[i-1], seq[i]
@@ -18,7 +32,7 @@ def order2Rules(sequences):
 				o2ij = o2i[j]
 				if k not in o2ij.keys():
 					o2ij[k] = 0.
-				o2ij[k] += 1.
+				o2ij[k] += w
 	for i, o2i in order2.items():
 		for j, o2ij in o2i.items():
 			sum_ij = sum(o2ij.values())
@@ -26,12 +40,13 @@ def order2Rules(sequences):
 				o2ij[k] = o2ij[k] / sum_ij
 	return order2
 
-def buildFON2Network(sequences):
+def buildFON2Network(sequences, weights = None):
 	nodes = []
 	states = {}
 	states_network = {}
 
-	for seq in sequences:
+	for index_seq, seq in enumerate(sequences):
+		w = 1. if weights is None else float(weights[index_seq])
 		for s in seq:
 			if s not in nodes:
 				nodes.append(s)
@@ -48,6 +63,88 @@ def buildFON2Network(sequences):
 					states_network[state_jk] = {}
 				if state_jk not in states_network[state_ij].keys():
 					states_network[state_ij][state_jk] = 0.
-				states_network[state_ij][state_jk] += 1.
-	return nodes, states, states_network
+				states_network[state_ij][state_jk] += w
+	return StateGraph.fromDict(states_network, states, nodes, states.keys())
+
+##################################################################
+def buildFON2NetworkFast(sequences, weights = None):
+	'''
+	Same network as buildFON2Network(..) (same nodes, states, arcs and
+	weights, in the same order), computed on the symbol ids:
+	- the pairs (i,j) and (j,k) of each trigram are packed into int64
+	  keys i*V+j, the states are the distinct pairs (np.unique, in order
+	  of first occurrence)
+	- each trigram is the arc (state ij, state jk), packed into an int64
+	  key, the weights of the arcs are the sums of the weights of their
+	  trigrams (np.unique + np.bincount)
+
+	Parameters:
+	-----------
+	sequences: TrajectoryCorpus or list of (list of str)
+	weights: number of occurrences of each sequence (optional)
+
+	Returns:
+	--------
+	StateGraph, the states are a PairLabels
+	'''
+	corpus = sequences if isinstance(sequences, TrajectoryCorpus) else TrajectoryCorpus.fromSequences(sequences)
+	tokens = corpus.tokenArray().astype(np.int64)
+	offsets = corpus.offsetArray()
+	nb_symbols = max(corpus.nbSymbols(), 1)
+
+	## nodes: symbols in order of first occurrence
+	symbol_ids, first = np.unique(tokens, return_index=True)
+	symbol_ids = symbol_ids[np.argsort(first)]
+	node_of = np.zeros(nb_symbols, dtype=np.int64)
+	node_of[symbol_ids] = np.arange(len(symbol_ids))
+	nodes = [corpus.symbols[x] for x in symbol_ids.tolist()]
+
+	## trigrams (i,j,k) starting at the positions p
+	lengths = np.diff(offsets)
+	end = np.repeat(offsets[1:], lengths)
+	position = np.arange(len(tokens), dtype=np.int64)
+	p = position[position + 2 < end]
+	w = np.ones(len(p)) if weights is None else np.repeat(np.asarray(weights, dtype=np.float64), np.maximum(lengths - 2, 0))
+
+	## states: pairs ij then jk of each trigram, in order of first occurrence
+	pairs = np.stack((tokens[p] * nb_symbols + tokens[p+1], tokens[p+1] * nb_symbols + tokens[p+2]), axis=1).ravel()
+	pairs, first, inverse = np.unique(pairs, return_index=True, return_inverse=True)
+	order = np.argsort(first)
+	rank = np.empty(len(pairs), dtype=np.int64)
+	rank[order] = np.arange(len(pairs))
+	pairs = pairs[order]
+	state_ids = rank[inverse.ravel()].reshape(-1, 2)
+	nb_states = len(pairs)
+
+	## arcs: distinct (state ij, state jk), rows in state order and arcs
+	## of a state in order of first occurrence
+	arcs, first, inverse = np.unique(state_ids[:, 0] * nb_states + state_ids[:, 1], return_index=True, return_inverse=True)
+	arc_weights = np.bincount(inverse.ravel(), weights=w, minlength=len(arcs))
+	order = np.lexsort((first, arcs // nb_states))
+	src = arcs[order] // nb_states
+	indptr = np.concatenate(([0], np.cumsum(np.bincount(src, minlength=nb_states))))
+
+	states = PairLabels(corpus.symbols, pairs // nb_symbols, pairs % nb_symbols)
+	return StateGraph(nodes, states, node_of[states.second], indptr, arcs[order] % nb_states, arc_weights[order])
+
+class PairLabels():
+	'''
+	Labels 'i-j' of the states of a FON2 network, made when read:
+	the states are kept as arrays of symbol ids (first[x], second[x])
+	'''
+	##################################################################
+	def __init__(self, symbols, first, second):
+		self.symbols = symbols
+		self.first = first
+		self.second = second
+
+	def __len__(self):
+		return len(self.first)
+
+	def __getitem__(self, x):
+		return str(self.symbols[self.first[x]])+'-'+str(self.symbols[self.second[x]])
 
+	def __iter__(self):
+		symbols = self.symbols
+		for i, j in zip(self.first.tolist(), self.second.tolist()):
+			yield str(symbols[i])+'-'+str(symbols[j])
@@ -8,12 +8,14 @@ from collections import defaultdict
 
 import numpy as np
 
-import HONUtils
 import AccuracyUtils
+import SequenceReader
+import HONSnapshot
 
 import BuildRulesFast
 import AggOrder2Rules
 import FON2StatesNetwork
+import random
 import time
 
 ##########################
@@ -24,6 +26,7 @@ import time
 filename = "./maritime_sequences.csv"
 sep = " " ## the string separating elements in a sequence
 threshold_multi = 2.8 # Alpha, to adjust size of VON2 to Agg-VON2
+## (None: alpha* is searched at each run, see below)
 
 ## Computing results on the Airports Dataset
 #filename = "./2011Q1_SEQ.csv"
@@ -36,8 +39,12 @@ threshold_multi = 2.8 # Alpha, to adjust size of VON2 to Agg-VON2
 # threshold_multi = 4.4 # Alpha, to adjust size of VON2 to Agg-VON2
 
 ## Read trajectories file
-sequences = HONUtils.readSequenceFile(filename,True,sep)
-sequences = HONUtils.removeRepetitions(sequences)
+## (repetitions are removed and locations are interned while reading,
+## the binary cache of the file is used by the next runs)
+## Locations are interned once, all models work on int ids
+## Identical sequences are kept once with their number of occurrences
+## (weights): each distinct sequence is counted and scored once
+sequences, weights = SequenceReader.readWeightedCorpus(filename,True,sep,use_cache=True)
 
 #########################
 ## Parameters          ##
@@ -46,6 +53,19 @@ sequences = HONUtils.removeRepetitions(sequences)
 nb_run = 50 ## Number of test for each network (eg 50)
 testing_ratio = 0.1
 
+## The testing subset of run i is drawn with the seed seed + i, and the
+## rules and aggregations of each run are kept as snapshots reused by
+## the next executions with the same input file and parameters
+## (see HONSnapshot.py)
+seed = 0
+use_snapshots = True
+
+def cachedOrCompute(cached_function, compute, params):
+	if not use_snapshots:
+		return compute()
+	params = dict(params, sep=sep, testing_ratio=testing_ratio)
+	return cached_function(filename, params, compute)
+
 ## Perform 'nb_run' tests taking 'testing_ratio' of the input sequences
 ## as testing subset
 ## The last 3 cols printed are the Acc (Eq.10 in the paper)
@@ -56,21 +76,26 @@ print('id_run,nb_seq_build,nb_seq_test,score_von2,score_sparse,score_agg,score_f
 
 for i in range(nb_run):
 	## Split into Training and Testing sets
+	random.seed(seed + i)
 	training, testing = [], []
-	training, testing = AccuracyUtils.sampleSequences(sequences, testing_ratio)
+	training, testing, training_w, testing_w = AccuracyUtils.sampleSequences(sequences, testing_ratio, weights)
+	params = {'max_order': 2, 'min_support': 1, 'alpha': 1., 'seed': seed + i}
 
 	## Build relevant order 2 extensions (Von2 network)
-	rule_builder = BuildRulesFast.FastHONRulesBuilder(training, max_order=2, min_support=1, ThresholdMultiplier=1.)
-	rules = rule_builder.ExtractRules()
+	rule_builder = BuildRulesFast.Order2RulesBuilder(training, min_support=1, ThresholdMultiplier=1., weights=training_w)
+	rules = cachedOrCompute(HONSnapshot.cachedRules, rule_builder.ExtractRules, params)
 	## Aggregate 2nd order extension (Agg Von2 network)
-	clusts = AggOrder2Rules.aggregateRules(rules)
+	clusts = cachedOrCompute(HONSnapshot.cachedAggregation, lambda: AggOrder2Rules.aggregateRules(rules), params)
 	flatten_agg_rules = AggOrder2Rules.flattenAgg2ndOrderRules(rules, clusts)
 	## Build VON2 using the given threshold multiplier choosen such that
 	## nb of representations is close to Agg-Von2
-	sparse_rule_builder = BuildRulesFast.FastHONRulesBuilder(training, max_order=2, min_support=1, ThresholdMultiplier=threshold_multi)
-	sparse_rules = sparse_rule_builder.ExtractRules()
+	## (same counts as the Von2 network)
+	alpha = threshold_multi
+	if alpha is None:
+		alpha = rule_builder.SearchThresholdMultiplier(len(flatten_agg_rules))
+	sparse_rules = cachedOrCompute(HONSnapshot.cachedRules, lambda: rule_builder.ExtractRulesMulti([alpha])[alpha], dict(params, alpha=alpha))
 	## Build Fix order 2 extensions (Fon2 network)
-	fon2rules = FON2StatesNetwork.order2Rules(training)
+	fon2rules = FON2StatesNetwork.order2Rules(training, training_w)
 
 
 	#############
@@ -92,24 +117,11 @@ for i in range(nb_run):
 					avg[r] += 1
 	## Compute the Accuracy capabilities of the three HON networks
 	## Eq. (10) in the paper
-	score_non_agg = 0.
-	score_agg     = 0.
-	score_fon2    = 0.
-	score_sparse  = 0.
-	nb_test_length3 = 0.
-	for test_index in range(len(testing)):
-		test_seq = testing[test_index]
-		if len(test_seq)>=3:
-			score_non_agg += AccuracyUtils.nonAggRulesProbSeq(rules,test_seq)
-			score_agg     += AccuracyUtils.aggRulesProbSeq(firstOrderRules,clusts,test_seq)
-			score_fon2    += AccuracyUtils.fonProbSeq(fon2rules,test_seq)
-			score_sparse  += AccuracyUtils.nonAggRulesProbSeq(sparse_rules,test_seq)
-			nb_test_length3 += 1.
-	score_non_agg = score_non_agg / nb_test_length3
-	score_agg     = score_agg / nb_test_length3
-	score_fon2    = score_fon2 / nb_test_length3
-	score_sparse  = score_sparse / nb_test_length3
+	score_non_agg, nb_test_length3 = AccuracyUtils.nonAggRulesProbSeqs(rules,testing,testing_w)
+	score_agg, _    = AccuracyUtils.aggRulesProbSeqs(firstOrderRules,clusts,testing,testing_w)
+	score_fon2, _   = AccuracyUtils.fonProbSeqs(fon2rules,testing,testing_w)
+	score_sparse, _ = AccuracyUtils.nonAggRulesProbSeqs(sparse_rules,testing,testing_w)
 
 
 	## Outputs
-	print(f'{i+1},{len(training)},{int(nb_test_length3)},{score_non_agg},{score_sparse},{score_agg},{score_fon2}')
+	print(f'{i+1},{sum(training_w)},{int(nb_test_length3)},{score_non_agg},{score_sparse},{score_agg},{score_fon2}')
@@ -4,7 +4,8 @@ Main script used to evaluate the clusterings of
 VON2, Aggregated Von2 and FON2 Networks
 '''
 
-import HONUtils
+import SequenceReader
+import HONSnapshot
 import BuildRulesFast
 import BuildNetwork
 
@@ -17,6 +18,8 @@ import OverlappingNMI
 import time
 from collections import defaultdict
 
+import numpy as np
+
 ##########################
 ## SEQUENCES FILE INPUT ##
 ##########################
@@ -43,15 +46,27 @@ save_stats_file   = "./clusters_stats.csv"
 ## Number of execution of Infomap for each network (eg 50)
 nb_loop = 50
 
+## Reuse the rules, networks and aggregations computed by a previous
+## run on the same input file (see HONSnapshot.py)
+## (the build times reported are then the load times of the snapshots:
+## set it to False to time the builds)
+use_snapshots = True
+
+## Number of processes aggregating the rules of the locations
+nb_workers = 1
+
 ########################
 ## VARIOUS FUNCTIONS  ##
 ########################
 ################################################################################
-def getNbDuplication(states):
-	nb_dupli = defaultdict(int)
-	for d, n  in states.items():
-		nb_dupli[n] = nb_dupli[n] + 1
-	return nb_dupli
+def getNbDuplication(graph):
+	'''
+	Number of states of each node of a StateGraph, counted on the node ids
+	of the states (the labels of the states are not built, e.g. the 'i-j'
+	of a FON2 network)
+	'''
+	nb_dupli = np.bincount(graph.stateNodes, minlength=graph.nbNodes()).tolist()
+	return {graph.nodes[n]: nb for n, nb in enumerate(nb_dupli) if nb > 0}
 ################################################################################
 def clusteringBySymbol(clust, isAgg = False, isDummy = False):
 	flatten_clust = defaultdict(list)
@@ -76,19 +91,30 @@ def countClusters(clust):
 			clust_count[c] = clust_count[c] + 1
 	return len(clust_set), symb_count_clust, clust_count
 ################################################################################
+def cachedOrCompute(cached_function, compute, params):
+	## snapshot of the result for this input file and parameters
+	## (see HONSnapshot.py), computed only if it does not exist yet
+	if not use_snapshots:
+		return compute()
+	params = dict(params, sep=sep)
+	return cached_function(filename, params, compute)
+################################################################################
 
 ################################################
 ## BUILDING 2nd Order NETWORK and Aggregation ##
 ################################################
 
 ## Read trajectories file
-sequences = HONUtils.readSequenceFile(filename,True,sep)
-sequences = HONUtils.removeRepetitions(sequences)
+## (repetitions are removed and locations are interned while reading,
+## the binary cache of the file is used by the next runs)
+corpus = SequenceReader.readCorpus(filename,True,sep,use_cache=True)
 
 ## Build rules
+## (from the int ids of the corpus, only the rules are decoded)
 start_time = time.time()
-rule_builder = BuildRulesFast.FastHONRulesBuilder(sequences,2,1,1.)
-rules = rule_builder.ExtractRules()
+rules = cachedOrCompute(HONSnapshot.cachedRules,
+						lambda: corpus.decodeRules(BuildRulesFast.Order2RulesBuilder(corpus,1,1.).ExtractRules()),
+						{'max_order': 2, 'min_support': 1, 'alpha': 1.})
 time_build_rules =  time.time() - start_time
 
 ################################################
@@ -108,19 +134,19 @@ print('#################################')
 print(f'Computing clustering for VON2 ({nb_loop} infomap runs)')
 ## VON2 Network clustering
 start_time = time.time()
-network = BuildNetwork.BuildNetwork(rules)
+von2_graph = cachedOrCompute(HONSnapshot.cachedNetwork, lambda: BuildNetwork.BuildNetworkTrie(rules),
+							 {'max_order': 2, 'min_support': 1, 'alpha': 1.})
 time_build_von2 = time_build_rules + (time.time() - start_time)
-von2_node_weight  = InfoMapClust.uniformNodeWeights(network)
+von2_node_weight  = InfoMapClust.uniformNodeWeights(von2_graph)
 
-nodes, states_von2 = InfoMapClust.getStates(network)
-von2_codelength, von2_gain, von2_clust, time_2o = InfoMapClust.infomapStateClustering(nodes, states_von2, network, von2_node_weight, filename, nb_loop)
+von2_codelength, von2_gain, von2_clust, time_2o = InfoMapClust.infomapStateClustering(von2_graph, von2_node_weight, filename, nb_loop)
 
 final_clusts.append(von2_clust)
 final_codelengths.append(von2_codelength)
 final_gain.append(von2_gain)
 final_clusts_name.append("Von2")
 final_clusts_times.append(time_2o)
-final_nb_dupli.append(getNbDuplication(states_von2))
+final_nb_dupli.append(getNbDuplication(von2_graph))
 final_build_times.append(time_build_von2)
 print('Done.')
 
@@ -128,21 +154,26 @@ print('Done.')
 print('#################################')
 print(f'Computing clustering for Aggregated VON2 ({nb_loop} infomap runs)')
 start_time = time.time()
-clusts = AggOrder2Rules.aggregateRules(rules)
+agg_times = {}
+clusts = cachedOrCompute(HONSnapshot.cachedAggregation, lambda: AggOrder2Rules.aggregateRules(rules, nb_workers, agg_times),
+						 {'max_order': 2, 'min_support': 1, 'alpha': 1.})
+if len(agg_times) > 0:
+	print('Slowest locations to aggregate:')
+	for symb in sorted(agg_times, key=agg_times.get, reverse=True)[:5]:
+		print(f'{symb}: {len(clusts[symb])} groups, {round(agg_times[symb], 3)} s')
 flatten_agg_rules = AggOrder2Rules.flattenAgg2ndOrderRules(rules, clusts)
-agg_network       = AggOrder2Rules.mergeNodes(network, flatten_agg_rules)
+agg_network       = AggOrder2Rules.mergeNodes(von2_graph, flatten_agg_rules)
 time_build_agg = time_build_rules + (time.time() - start_time)
 agg_node_weight   = InfoMapClust.uniformNodeWeights(agg_network)
 
-nodes, states_agg = InfoMapClust.getStates(agg_network, True)
-agg_codelength, agg_gain, agg_clust, time_agg = InfoMapClust.infomapStateClustering(nodes, states_agg, agg_network, agg_node_weight, filename, nb_loop)
+agg_codelength, agg_gain, agg_clust, time_agg = InfoMapClust.infomapStateClustering(agg_network, agg_node_weight, filename, nb_loop)
 
 final_clusts.append(agg_clust)
 final_codelengths.append(agg_codelength)
 final_gain.append(agg_gain)
 final_clusts_name.append("Agg Von2")
 final_clusts_times.append(time_agg)
-final_nb_dupli.append(getNbDuplication(states_agg))
+final_nb_dupli.append(getNbDuplication(agg_network))
 final_build_times.append(time_build_agg)
 print('Done.')
 
@@ -150,18 +181,18 @@ print('Done.')
 print('#################################')
 print(f'Computing clustering for FON2 ({nb_loop} infomap runs)')
 start_time = time.time()
-nodes, fon2_states, fon2_state_net = FON2StatesNetwork.buildFON2Network(sequences)
+fon2_graph = FON2StatesNetwork.buildFON2NetworkFast(corpus)
 time_build_fon2 = time.time() - start_time
-fon2_weight = InfoMapClust.uniformNodeWeights(fon2_state_net)
+fon2_weight = InfoMapClust.uniformNodeWeights(fon2_graph)
 
-state_codelength, fon2_gain, state_clust, time_state = InfoMapClust.infomapStateClustering(nodes, fon2_states, fon2_state_net, fon2_weight, filename, nb_loop)
+state_codelength, fon2_gain, state_clust, time_state = InfoMapClust.infomapStateClustering(fon2_graph, fon2_weight, filename, nb_loop)
 
 final_clusts.append(state_clust)
 final_codelengths.append(state_codelength)
 final_gain.append(fon2_gain)
 final_clusts_name.append("Fon2")
 final_clusts_times.append(time_state)
-final_nb_dupli.append(getNbDuplication(fon2_states))
+final_nb_dupli.append(getNbDuplication(fon2_graph))
 final_build_times.append(time_build_fon2)
 print('Done.')
 
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+'''
+Binary snapshots of the rules (FastHONRulesBuilder.ExtractRules()),
+of the aggregated rules (AggOrder2Rules.aggregateRules()) and of the
+networks (StateGraph of BuildNetwork.BuildNetwork())
+
+A snapshot is a directory of .npy files that can all be loaded with
+np.load(mmap_mode='r'):
+- symbols.npy: the symbol table (locations: int64 if they are all int,
+  str otherwise, with int_symbols.npy the indexes of the int ones)
+- a table of sequences of symbols (rule sources, network states):
+  sequence i is seq_symbols[seq_offsets[i]:seq_offsets[i+1]]
+- CSR arrays for the targets of the rules or the arcs of the network
+
+cachedRules(..), cachedAggregation(..) and cachedNetwork(..) store the
+snapshots in a directory next to the input file, keyed by a hash of the
+input file, of the parameters and of BuildRulesFast.BUILDER_VERSION
+(and AggOrder2Rules.AGG_VERSION for the aggregations): the snapshot is
+reused automatically when they all match. The hash of the input file is
+computed once for each size and modification time of the file.
+
+The loaded rules and aggregations are read-only mappings over the
+memory-mapped arrays (see ArrayMapping): the keys are decoded when the
+snapshot is loaded, each value only when it is read. The loaded networks
+are StateGraphs whose CSR arcs are the memory-mapped arrays.
+'''
+import hashlib
+import os
+import shutil
+from collections.abc import Mapping
+
+import numpy as np
+
+import BuildRulesFast
+import AggOrder2Rules
+from StateGraph import StateGraph
+
+FORMAT_VERSION = 2
+
+##################################################################
+## Symbols and sequences of symbols
+##################################################################
+class SymbolTable():
+	def __init__(self):
+		self.symbols = []
+		self.index = {}
+
+	def intern(self, symb):
+		i = self.index.get(symb)
+		if i is None:
+			i = len(self.symbols)
+			self.index[symb] = i
+			self.symbols.append(symb)
+		return i
+
+	def encodeSequences(self, sequences):
+		'''
+		Returns the arrays (seq_symbols, seq_offsets) of a list of tuples
+		'''
+		seq_symbols, seq_offsets = [], [0]
+		for seq in sequences:
+			seq_symbols.extend([self.intern(s) for s in seq])
+			seq_offsets.append(len(seq_symbols))
+		return np.array(seq_symbols, dtype=np.int32), np.array(seq_offsets, dtype=np.int64)
+
+	def toArrays(self):
+		'''
+		Returns the arrays of the symbol table: 'symbols' (int64 if all
+		the symbols are int, str otherwise) and 'int_symbols' (indexes of
+		the int symbols stored as str, only if there are some)
+		'''
+		if len(self.symbols) == 0:
+			return {'symbols': np.zeros(0, dtype='U1')}
+		is_int = [isinstance(s, (int, np.integer)) and not isinstance(s, bool) for s in self.symbols]
+		if all(is_int):
+			return {'symbols': np.array(self.symbols, dtype=np.int64)}
+		arrays = {'symbols': np.array([str(s) for s in self.symbols])}
+		if any(is_int):
+			arrays['int_symbols'] = np.flatnonzero(is_int).astype(np.int32)
+		return arrays
+
+##################################################################
+def decodeSymbols(arrays):
+	'''
+	Returns the list of the symbols (str or int) of SymbolTable.toArrays()
+	'''
+	symbols = arrays['symbols'].tolist()
+	if 'int_symbols' in arrays:
+		for i in arrays['int_symbols'].tolist():
+			symbols[i] = int(symbols[i])
+	return symbols
+
+##################################################################
+def decodeSequences(symbols, seq_symbols, seq_offsets):
+	'''
+	Returns the list of tuples of symbols of a table of sequences
+	'''
+	seq_symbols = [symbols[s] for s in seq_symbols.tolist()]
+	bounds = seq_offsets.tolist()
+	return [tuple(seq_symbols[bounds[i]:bounds[i+1]]) for i in range(len(bounds) - 1)]
+
+##################################################################
+def encodeCounts(table, counts):
+	'''
+	CSR arrays (target_ptr, targets, counts) of a list of dict str -> float
+	'''
+	target_ptr, targets, values = [0], [], []
+	for c in counts:
+		targets.extend([table.intern(t) for t in c.keys()])
+		values.extend(c.values())
+		target_ptr.append(len(targets))
+	return np.array(target_ptr, dtype=np.int64), np.array(targets, dtype=np.int32), np.array(values)
+
+##################################################################
+class ArrayMapping(Mapping):
+	'''
+	Read-only dict over the arrays of a snapshot
+	(each value is decoded once, when it is first read)
+	'''
+	def __init__(self, keys, value):
+		'''
+		Parameters:
+		-----------
+		keys: list of the keys (in the order of the snapshot)
+		value: function index of a key -> its value (decoded from the arrays)
+		'''
+		self._keys = keys
+		self._value = value
+		self._index = None
+		self._values = {}
+
+	def __getitem__(self, key):
+		if self._index is None:
+			self._index = {k: i for i, k in enumerate(self._keys)}
+		i = self._index[key]
+		if i not in self._values:
+			self._values[i] = self._value(i)
+		return self._values[i]
+
+	def __iter__(self):
+		return iter(self._keys)
+
+	def __len__(self):
+		return len(self._keys)
+
+##################################################################
+def countsView(symbols, target_ptr, targets, counts):
+	'''
+	Function i -> dict (target -> count) of the CSR arrays of encodeCounts(..)
+	'''
+	def value(i):
+		a, b = int(target_ptr[i]), int(target_ptr[i+1])
+		return dict(zip([symbols[t] for t in targets[a:b].tolist()], counts[a:b].tolist()))
+	return value
+
+##################################################################
+## Conversions dict <-> arrays
+##################################################################
+def rulesToArrays(rules):
+	'''
+	Parameters:
+	-----------
+	rules: dict tuple of str -> dict (str -> float)
+
+	Returns:
+	--------
+	arrays: dict name -> numpy array
+	'''
+	table = SymbolTable()
+	rule_symbols, rule_offsets = table.encodeSequences(rules.keys())
+	target_ptr, targets, counts = encodeCounts(table, rules.values())
+	return {**table.toArrays(), 'rule_symbols': rule_symbols, 'rule_offsets': rule_offsets,
+			'target_ptr': target_ptr, 'targets': targets, 'counts': counts}
+
+##################################################################
+def arraysToRules(arrays):
+	'''
+	Returns the rules as an ArrayMapping rule source -> dict (target -> count)
+	'''
+	symbols = decodeSymbols(arrays)
+	sources = decodeSequences(symbols, arrays['rule_symbols'], arrays['rule_offsets'])
+	return ArrayMapping(sources, countsView(symbols, arrays['target_ptr'], arrays['targets'], arrays['counts']))
+
+##################################################################
+def networkToArrays(graph):
+	'''
+	Parameters:
+	-----------
+	graph: StateGraph, VON network (the states are tuples of str)
+
+	Returns:
+	--------
+	arrays: dict name -> numpy array (nodes, states table and CSR arcs)
+	'''
+	table = SymbolTable()
+	nodes = np.array([table.intern(n) for n in graph.nodes], dtype=np.int32)
+	state_symbols, state_offsets = table.encodeSequences(graph.states)
+	return {**table.toArrays(), 'nodes': nodes, 'state_symbols': state_symbols, 'state_offsets': state_offsets,
+			'state_nodes': graph.stateNodes, 'indptr': graph.indptr, 'indices': graph.indices, 'weights': graph.weights}
+
+##################################################################
+def arraysToNetwork(arrays):
+	'''
+	Returns the network as a StateGraph over the arrays (the CSR arcs
+	are not copied)
+	'''
+	symbols = decodeSymbols(arrays)
+	states = decodeSequences(symbols, arrays['state_symbols'], arrays['state_offsets'])
+	nodes = [symbols[n] for n in arrays['nodes'].tolist()]
+	return StateGraph(nodes, states, arrays['state_nodes'], arrays['indptr'], arrays['indices'], arrays['weights'])
+
+##################################################################
+def aggregationToArrays(clusts):
+	'''
+	Parameters:
+	-----------
+	clusts: dict of str -> dict tuple of tuple of str -> dict (str -> float)
+		(as given by AggOrder2Rules.aggregateRules(..))
+
+	Returns:
+	--------
+	arrays: dict name -> numpy array
+	'''
+	table = SymbolTable()
+	locations = [table.intern(x) for x in clusts.keys()]
+	rules, group_loc, member_ptr, members, counts = {}, [], [0], [], []
+	for loc, loc_clusts in zip(locations, clusts.values()):
+		for group, count in loc_clusts.items():
+			group_loc.append(loc)
+			members.extend([rules.setdefault(r, len(rules)) for r in group])
+			member_ptr.append(len(members))
+			counts.append(count)
+	rule_symbols, rule_offsets = table.encodeSequences(rules.keys())
+	target_ptr, targets, values = encodeCounts(table, counts)
+	return {**table.toArrays(), 'locations': np.array(locations, dtype=np.int32),
+			'rule_symbols': rule_symbols, 'rule_offsets': rule_offsets,
+			'group_loc': np.array(group_loc, dtype=np.int32), 'member_ptr': np.array(member_ptr, dtype=np.int64),
+			'members': np.array(members, dtype=np.int32),
+			'target_ptr': target_ptr, 'targets': targets, 'counts': values}
+
+##################################################################
+def arraysToAggregation(arrays):
+	'''
+	Returns the groups as an ArrayMapping location -> dict (group -> counts)
+	(the groups of a location are contiguous in the arrays)
+	'''
+	symbols = decodeSymbols(arrays)
+	rules = decodeSequences(symbols, arrays['rule_symbols'], arrays['rule_offsets'])
+	counts = countsView(symbols, arrays['target_ptr'], arrays['targets'], arrays['counts'])
+	member_ptr, members = arrays['member_ptr'], arrays['members']
+	locations = arrays['locations'].tolist()
+	position = np.zeros(len(symbols), dtype=np.int64)
+	position[locations] = np.arange(len(locations))
+	loc_ptr = np.zeros(len(locations) + 1, dtype=np.int64)
+	np.cumsum(np.bincount(position[arrays['group_loc']], minlength=len(locations)), out=loc_ptr[1:])
+	def value(x):
+		groups = {}
+		for i in range(int(loc_ptr[x]), int(loc_ptr[x+1])):
+			group = tuple([rules[r] for r in members[member_ptr[i]:member_ptr[i+1]].tolist()])
+			groups[group] = counts(i)
+		return groups
+	return ArrayMapping([symbols[loc] for loc in locations], value)
+
+##################################################################
+## Files
+##################################################################
+def saveArrays(path, arrays):
+	'''
+	Write the arrays as path/name.npy. The files are written in a
+	temporary directory renamed at the end (no partial snapshot).
+	'''
+	tmp_path = f'{path}.tmp{os.getpid()}'
+	os.makedirs(tmp_path, exist_ok=True)
+	for name, array in arrays.items():
+		np.save(os.path.join(tmp_path, name + '.npy'), array)
+	if os.path.isdir(path):
+		shutil.rmtree(path)
+	os.rename(tmp_path, path)
+
+##################################################################
+def loadArrays(path, mmap_mode = 'r'):
+	'''
+	Returns:
+	--------
+	arrays: dict name -> numpy array (memory-mapped by default)
+	'''
+	arrays = {}
+	for f in os.listdir(path):
+		if f.endswith('.npy'):
+			arrays[f[:-4]] = np.load(os.path.join(path, f), mmap_mode=mmap_mode)
+	return arrays
+
+##################################################################
+def saveRules(path, rules):
+	saveArrays(path, rulesToArrays(rules))
+
+def loadRules(path):
+	return arraysToRules(loadArrays(path))
+
+def saveNetwork(path, graph):
+	saveArrays(path, networkToArrays(graph))
+
+def loadNetwork(path):
+	return arraysToNetwork(loadArrays(path))
+
+def saveAggregation(path, clusts):
+	saveArrays(path, aggregationToArrays(clusts))
+
+def loadAggregation(path):
+	return arraysToAggregation(loadArrays(path))
+
+##################################################################
+## Cache
+##################################################################
+_fileHashes = {} ## (absolute path, size, modification time) -> hash
+
+def fileHash(filename, cache_dir = None, block_size = 1 << 20):
+	'''
+	SHA1 of the content of the file, computed once for each (size,
+	modification time) of the file: kept in memory, and in
+	cache_dir/hashes/ if cache_dir is given (for the next runs)
+	'''
+	stat = os.stat(filename)
+	key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+	if key in _fileHashes:
+		return _fileHashes[key]
+	record = None
+	if cache_dir is not None:
+		record = os.path.join(cache_dir, 'hashes', hashlib.sha1(key[0].encode()).hexdigest())
+		try:
+			with open(record) as f:
+				size, mtime, digest = f.read().split()
+			if (int(size), int(mtime)) == key[1:]:
+				_fileHashes[key] = digest
+				return digest
+		except (OSError, ValueError):
+			pass
+	h = hashlib.sha1()
+	with open(filename, 'rb') as f:
+		for block in iter(lambda: f.read(block_size), b''):
+			h.update(block)
+	digest = h.hexdigest()
+	_fileHashes[key] = digest
+	if record is not None:
+		try:
+			os.makedirs(os.path.dirname(record), exist_ok=True)
+			with open(record, 'w') as f:
+				f.write(f'{key[1]} {key[2]} {digest}\n')
+		except OSError:
+			pass
+	return digest
+
+##################################################################
+def snapshotPath(filename, kind, params, cache_dir = None):
+	'''
+	Path of the snapshot of 'kind' computed from the input file
+	'filename' with the parameters 'params'
+
+	Parameters:
+	-----------
+	filename: str, input file of the sequences
+	kind: str ('rules', 'aggregation', 'network', ...)
+	params: dict str -> value (with a stable repr), every parameter
+			used to compute the snapshot from the input file
+	cache_dir: str, directory of the snapshots
+			   (default: .hon_snapshots next to the input file)
+	'''
+	if cache_dir is None:
+		cache_dir = os.path.join(os.path.dirname(os.path.abspath(filename)), '.hon_snapshots')
+	versions = (FORMAT_VERSION, BuildRulesFast.BUILDER_VERSION)
+	if kind == 'aggregation':
+		versions += (AggOrder2Rules.AGG_VERSION,)
+	h = hashlib.sha1()
+	h.update(fileHash(filename, cache_dir).encode())
+	h.update(repr((versions, kind, sorted(params.items()))).encode())
+	return os.path.join(cache_dir, f'{kind}-{h.hexdigest()}')
+
+##################################################################
+def cached(filename, kind, params, compute, save, load, cache_dir = None):
+	'''
+	Returns load(path) if the snapshot exists, otherwise the result of
+	compute(), saved with save(path, result)
+	'''
+	path = snapshotPath(filename, kind, params, cache_dir)
+	if os.path.isdir(path):
+		return load(path)
+	result = compute()
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	save(path, result)
+	return result
+
+##################################################################
+def cachedRules(filename, params, compute, cache_dir = None):
+	'''
+	Rules of the input file 'filename' (see cached(..)),
+	compute() returns the rules (dict tuple of str -> dict (str -> float))
+	'''
+	return cached(filename, 'rules', params, compute, saveRules, loadRules, cache_dir)
+
+def cachedAggregation(filename, params, compute, cache_dir = None):
+	'''
+	Aggregated rules (as AggOrder2Rules.aggregateRules(..)), see cached(..)
+	'''
+	return cached(filename, 'aggregation', params, compute, saveAggregation, loadAggregation, cache_dir)
+
+def cachedNetwork(filename, params, compute, cache_dir = None):
+	'''
+	Network (StateGraph, as BuildNetwork.BuildNetwork(..)), see cached(..)
+	'''
+	return cached(filename, 'network', params, compute, saveNetwork, loadNetwork, cache_dir)
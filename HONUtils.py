@@ -4,6 +4,8 @@ Various functions used in all scripts
 '''
 import math
 
+import numpy as np
+
 ##################################################################
 def getDistribution(count):
 	distr = {}
@@ -14,8 +16,8 @@ def getDistribution(count):
 
 ######################################################################################
 def MaxDivergence(Distr):
-	MaxValKey = sorted(Distr, key=Distr.__getitem__)
-	d = {MaxValKey[0]: 1}
+	## first key of minimum value
+	d = {min(Distr, key=Distr.__getitem__): 1}
 	return d
 
 ######################################################################################
@@ -30,6 +32,260 @@ def KLD(dA, dB):
 def KLDThreshold(order, support,ThresholdMultiplier):
 	return ThresholdMultiplier * (order / math.log(1 + support, 2))
 
+######################################################################################
+## Batch versions: many (child, parent) pairs given as aligned CSR rows:
+## row i is made of the positions indptr[i]:indptr[i+1] of the arrays,
+## child[x] and parent[x] are the values of the two distributions
+## (or counts) for the same target.
+## The divergences use np.log2, that can differ from the math.log of the
+## dict functions in the last bit, which is enough to change the ties
+## between a divergence and its threshold: the thresholds and the bounds
+## are computed with math.log (exactLog2(..), log2Table(..)) and the
+## divergences close to their threshold are computed again as in KLD(..)
+## (see exactNearThresholds(..))
+######################################################################################
+## largest int whose logarithm is kept in LOG2_TABLE
+LOG2_CAP = 1 << 20
+LOG2_TABLE = np.zeros(1)
+
+def log2Table(n):
+	'''
+	Returns an array T with T[x] = math.log(x, 2) for any int
+	x <= min(n, LOG2_CAP) (T[0] = 0). The table is cached and extended
+	when needed, up to LOG2_CAP (see log2Ints(..) for larger ints).
+	'''
+	global LOG2_TABLE
+	n = min(n, LOG2_CAP)
+	if len(LOG2_TABLE) <= n:
+		size = min(max(n + 1, 2 * len(LOG2_TABLE)), LOG2_CAP + 1)
+		LOG2_TABLE = np.concatenate((LOG2_TABLE, exactLog2(range(len(LOG2_TABLE), size))))
+	return LOG2_TABLE
+
+######################################################################################
+def log2Ints(values, exact = True):
+	'''
+	log2(v) for each int v of values (0 for v = 0), read from
+	log2Table(..) up to LOG2_CAP. Above, computed with math.log (exact:
+	same values as the dict functions) or np.log2.
+	'''
+	values = np.asarray(values, dtype=np.int64)
+	table = log2Table(int(values.max(initial=0)))
+	big = values > LOG2_CAP
+	if not big.any():
+		return table[values]
+	logs = np.zeros(len(values))
+	logs[~big] = table[values[~big]]
+	logs[big] = exactLog2(values[big]) if exact else log2Array(values[big])
+	return logs
+
+######################################################################################
+def exactLog2(x):
+	'''
+	math.log(v, 2) for each value v of x (same values as the dict
+	functions, for the values compared to a threshold)
+	'''
+	return np.array([math.log(v, 2) for v in np.asarray(x, dtype=np.float64).tolist()], dtype=np.float64)
+
+######################################################################################
+def log2Array(x):
+	'''
+	log2(v) for each value v of x
+	'''
+	return np.log2(np.asarray(x, dtype=np.float64))
+
+######################################################################################
+def rowSums(values, indptr):
+	'''
+	Sum of each CSR row (0 for empty rows). Each row is summed from left
+	to right as in the dict version (np.add.reduceat uses pairwise summation)
+	'''
+	indptr = np.asarray(indptr, dtype=np.int64)
+	values = np.asarray(values, dtype=np.float64)
+	lengths = np.diff(indptr)
+	sums = np.zeros(len(lengths))
+	if len(values) == 0:
+		return sums
+	## rows by decreasing length: the rows with more than k values are a prefix
+	by_length = np.argsort(-lengths, kind='stable')
+	starts = indptr[:-1][by_length]
+	nb_longer = np.searchsorted(-lengths[by_length], -np.arange(lengths.max()), 'left')
+	acc = np.zeros(len(lengths))
+	for k, nb in enumerate(nb_longer.tolist()):
+		acc[:nb] += values[starts[:nb] + k]
+	sums[by_length] = acc
+	return sums
+
+######################################################################################
+def distributionBatch(counts, indptr):
+	'''
+	getDistribution(..) of each row: the counts divided by the sum of
+	their row
+	'''
+	counts = np.asarray(counts, dtype=np.float64)
+	indptr = np.asarray(indptr, dtype=np.int64)
+	supports = np.repeat(rowSums(counts, indptr), np.diff(indptr))
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return counts / supports
+
+######################################################################################
+def firstMinBatch(values, indptr):
+	'''
+	Position (in values) of the first minimum of each row (-1 for
+	empty rows)
+	'''
+	values = np.asarray(values)
+	indptr = np.asarray(indptr, dtype=np.int64)
+	res = np.full(len(indptr) - 1, -1, dtype=np.int64)
+	if len(values) == 0:
+		return res
+	rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+	positions = np.lexsort((np.arange(len(values)), values, rows))
+	first_rows, first_index = np.unique(rows[positions], return_index=True)
+	res[first_rows] = positions[first_index]
+	return res
+
+######################################################################################
+def KLDBatch(child, parent, indptr):
+	'''
+	KLD(child_i, parent_i) for each row i of the distributions
+	(same as KLD(dA, dB) with the targets of dA that are in dB)
+
+	Parameters:
+	-----------
+	child, parent: arrays of float (aligned probabilities)
+	indptr: array of int (nb rows + 1)
+
+	Returns:
+	--------
+	divergences: array of float
+	'''
+	child  = np.asarray(child, dtype=np.float64)
+	parent = np.asarray(parent, dtype=np.float64)
+	terms = np.zeros(len(child))
+	valid = (child > 0) & (parent > 0)
+	terms[valid] = child[valid] * log2Array(child[valid] / parent[valid])
+	return rowSums(terms, indptr)
+
+######################################################################################
+def KLDThresholdBatch(order, supports, ThresholdMultiplier):
+	'''
+	KLDThreshold(..) for an array of supports (same values; inf for a
+	support 0)
+	'''
+	supports = np.asarray(supports, dtype=np.float64)
+	if len(supports) > 0 and supports.min() >= 0 and np.all(supports == np.floor(supports)):
+		logs = log2Ints(supports.astype(np.int64) + 1)
+	else:
+		logs = exactLog2(1 + supports)
+	with np.errstate(divide='ignore'):
+		return ThresholdMultiplier * (order / logs)
+
+######################################################################################
+def countKLD(child, parent, indptr, parent_supports):
+	'''
+	KLD(..) of the distributions of the counts child and parent of each
+	row, with the operations of the dict functions (a Python loop: used
+	for the rows close to their threshold)
+	'''
+	child, parent = np.asarray(child).tolist(), np.asarray(parent).tolist()
+	indptr, parent_supports = np.asarray(indptr).tolist(), np.asarray(parent_supports).tolist()
+	divergences = np.zeros(len(indptr) - 1)
+	for r in range(len(indptr) - 1):
+		a, b = indptr[r], indptr[r + 1]
+		support = float(sum(child[a:b]))
+		divergence = 0
+		for c, pc in zip(child[a:b], parent[a:b]):
+			if c > 0 and pc > 0:
+				p = float(c) / support
+				divergence += p * math.log(p / (pc / parent_supports[r]), 2)
+		divergences[r] = divergence
+	return divergences
+
+######################################################################################
+## countKLDBatch(..): batches with at most SMALL_BATCH values are computed
+## with np.log2 of the ratios of the probabilities. Larger ones use
+## differences of log2Ints(..) of the counts. In both cases, the rows
+## closer than NEAR_TIE (relative) to their threshold are computed again
+## with countKLD(..) (see exactNearThresholds(..))
+SMALL_BATCH = 256
+NEAR_TIE = 1e-9
+
+def countKLDBatch(child, parent, indptr, parent_supports, order, ThresholdMultiplier):
+	'''
+	Divergence tests of FastHONRulesBuilder for many (child, parent) pairs
+	given by their counts. The results of the tests (and the ties with
+	the thresholds) are the same as with the dict functions KLD(..) and
+	KLDThreshold(..).
+
+	Parameters:
+	-----------
+	child : array of int, counts of the child rules (aligned CSR rows)
+	parent: array of int, counts of the parent rules for the same targets
+	indptr: array of int (nb rows + 1)
+	parent_supports: array of int, sum of all the counts of each parent
+	order : order of the child rules
+
+	Returns:
+	--------
+	divergences: KLD(distribution of child, distribution of parent)
+	thresholds : KLDThreshold(order, support of child, ThresholdMultiplier)
+	bounds     : KLD(MaxDivergence(distribution of child), distribution of parent)
+				 (upper bound of the divergence of the extensions of child)
+	'''
+	child  = np.asarray(child, dtype=np.int64)
+	parent = np.asarray(parent, dtype=np.int64)
+	indptr = np.asarray(indptr, dtype=np.int64)
+	parent_supports = np.asarray(parent_supports, dtype=np.int64)
+	nb_rows = len(indptr) - 1
+	supports = np.concatenate(([0], np.cumsum(child)))
+	supports = supports[indptr[1:]] - supports[indptr[:-1]]
+	thresholds = KLDThresholdBatch(order, supports, ThresholdMultiplier)
+
+	lengths = np.diff(indptr)
+	if len(child) <= SMALL_BATCH:
+		with np.errstate(divide='ignore', invalid='ignore'):
+			divergences = KLDBatch(distributionBatch(child, indptr), parent / np.repeat(parent_supports, lengths), indptr)
+	else:
+		## p_child * log2(p_child / p_parent)
+		## = p_child * (log2 c - log2 S - (log2 c_parent - log2 S_parent))
+		rows = np.repeat(np.arange(nb_rows), lengths)
+		valid = np.flatnonzero((child > 0) & (parent > 0))
+		r = rows[valid]
+		logs = log2Ints(np.concatenate((child[valid], supports[r], parent[valid], parent_supports[r])), exact=False).reshape(4, -1)
+		terms = np.zeros(len(child))
+		terms[valid] = child[valid] / supports[r] * ((logs[0] - logs[1]) - (logs[2] - logs[3]))
+		divergences = rowSums(terms, indptr)
+	divergences = exactNearThresholds(divergences, thresholds, child, parent, indptr, parent_supports)
+
+	## first target of minimum (positive) count of each row
+	bounds = np.zeros(nb_rows)
+	argmin = firstMinBatch(np.where(child > 0, child, np.iinfo(np.int64).max), indptr)
+	found = np.flatnonzero(argmin >= 0)
+	found = found[(child[argmin[found]] > 0) & (parent[argmin[found]] > 0)]
+	p_parent = parent[argmin[found]] / parent_supports[found]
+	bounds[found] = exactLog2(1 / p_parent)
+	return divergences, thresholds, bounds
+
+######################################################################################
+def exactNearThresholds(divergences, thresholds, child, parent, indptr, parent_supports):
+	'''
+	Returns a copy of the divergences of countKLDBatch(..) where the rows
+	closer than NEAR_TIE to their threshold are computed as in KLD(..)
+	(thresholds can be the ones of countKLDBatch(..) times a multiplier)
+	'''
+	divergences = np.array(divergences, dtype=np.float64)
+	with np.errstate(invalid='ignore'):
+		near = np.flatnonzero(np.abs(divergences - thresholds) <= NEAR_TIE * np.abs(thresholds))
+	if len(near) == 0:
+		return divergences
+	indptr = np.asarray(indptr, dtype=np.int64)
+	lengths = indptr[near + 1] - indptr[near]
+	sub_indptr = np.concatenate(([0], np.cumsum(lengths)))
+	## positions of the near rows in child and parent
+	positions = np.repeat(indptr[near] - sub_indptr[:-1], lengths) + np.arange(sub_indptr[-1])
+	divergences[near] = countKLD(np.asarray(child)[positions], np.asarray(parent)[positions], sub_indptr, np.asarray(parent_supports)[near])
+	return divergences
+
 ######################################################################################
 def sequenceToString(seq):
 	if len(seq) == 1 :
@@ -46,23 +302,41 @@ def sequenceToString(seq):
 	else:
 		return res
 ######################################################################################
-def readSequenceFile(filename, is_line_id = True, separator=' ') :
+def readSequenceFile(filename, is_line_id = True, separator=' ', use_cache = True, cache_dir = None) :
+	'''
+	Parameters:
+	-----------
+	use_cache: bool, read the binary cache of the file if it is up to
+			   date, otherwise write it (see SequenceReader.readCorpus(..));
+			   False: the file is always parsed
+	cache_dir: str, directory of the cache (default: next to the file)
+
+	Returns:
+	--------
+	sequences: list of (list of str)
+			   (SequenceReader.readCorpus(..) gives the interned corpus,
+			   without the list of str)
+	'''
+	if use_cache:
+		import SequenceReader ## SequenceReader imports the rule builders, which import HONUtils
+		corpus = SequenceReader.readCorpus(filename, is_line_id, separator, remove_repetitions=False, use_cache=True, cache_dir=cache_dir)
+		tokens  = np.array(corpus.symbols, dtype=object)[corpus.tokenArray()].tolist()
+		offsets = corpus.offsetArray().tolist()
+		return [tokens[offsets[i]:offsets[i+1]] for i in range(len(corpus))]
 	sequences = []
-	file_seq = open(filename,'r')
-	count_line = 0
-	for line in file_seq :
-		count_line += 1
-		split_line = line.strip().split(separator)
-		if len(split_line) > 1 :
-			seq = []
-			if is_line_id :
-				id_seq = split_line[0]
-				seq = split_line[1:]
-				if len(seq) > 1:
-					sequences.append(seq)
-			else :
-				if len(split_line) > 1 :
-					sequences.append(split_line)
+	with open(filename,'r') as file_seq:
+		for line in file_seq :
+			split_line = line.strip().split(separator)
+			if len(split_line) > 1 :
+				seq = []
+				if is_line_id :
+					id_seq = split_line[0]
+					seq = split_line[1:]
+					if len(seq) > 1:
+						sequences.append(seq)
+				else :
+					if len(split_line) > 1 :
+						sequences.append(split_line)
 	return sequences
 ######################################################################################
 def removeRepetitions(sequences):
@@ -14,34 +14,41 @@ import subprocess
 import re
 from collections import defaultdict
 
+import numpy as np
+
+from StateGraph import StateGraph, lastSymbol, aggLastSymbol
+
 ################################################################################
 def getStates(dupli_net, is_agg = False):
 	'''
 	Extract the representations
 	as dict: representations -> locations
 	(used for Infomap Clustering)
+
+	Parameters:
+	-----------
+	dupli_net: StateGraph (read directly) or dict of (xxx -> dict of (xxx -> float))
+	is_agg: bool, states of a dict are groups of rules (ignored for a StateGraph)
+
+	Returns:
+	--------
+	nodes: list of locations
+	states: dict representation -> location
 	'''
-	nodes = []
-	states = {}
-	for u, neigh_u in dupli_net.items():
-		node_u =  u[-1]
-		if is_agg:
-			node_u = u[0][-1]
-		if node_u not in nodes:
-			nodes.append(node_u)
-		states[u] = node_u
-
-		for v in neigh_u.keys():
-			node_v =  v[-1]
-			if is_agg:
-				node_v = v[0][-1]
-			if node_v not in nodes:
-				nodes.append(node_v)
-			states[v] = node_v
-	return nodes, states
+	if isinstance(dupli_net, StateGraph):
+		return dupli_net.nodes, dupli_net.stateToNode()
+	graph = StateGraph.fromDict(dupli_net, aggLastSymbol if is_agg else lastSymbol)
+	return graph.nodes, graph.stateToNode()
 
 ################################################################################
 def uniformNodeWeights(network):
+	'''
+	Weight 1.0 for each state of the network
+	(array aligned with the states for a StateGraph,
+	dict state -> 1.0 for a dict)
+	'''
+	if isinstance(network, StateGraph):
+		return np.ones(network.nbStates())
 	node_weight = {}
 	## loops also on target in order to
 	## not miss some nodes
@@ -51,6 +58,18 @@ def uniformNodeWeights(network):
 			node_weight[tgt] = 1.0
 	return node_weight
 
+################################################################################
+def stateWeights(graph, weight):
+	'''
+	List of the weights of the states of graph (StateGraph)
+	weight: dict state -> float, array aligned with the states or None (1.0)
+	'''
+	if weight is None:
+		return [1.0] * graph.nbStates()
+	if isinstance(weight, dict):
+		return [weight[s] for s in graph.states]
+	return np.asarray(weight).tolist()
+
 ################################################################################
 def printGraph(graph, node_weight, filename, output_dir):
 	'''
@@ -58,40 +77,41 @@ def printGraph(graph, node_weight, filename, output_dir):
 
 	Parameters:
 	--------
-	graph: dict of (xxx -> dict of (xxx -> float))
-	node_weight: dict of (xxx -> float)
+	graph: StateGraph (each state is a vertex)
+		   or dict of (xxx -> dict of (xxx -> float))
+	node_weight: dict of (xxx -> float) or array aligned with the states
 
 	Returns:
 	--------
 	name_net_file: path of Pajek net file
-	mapRule		 :  dict of (int -> xxx)
+	mapRule		 : list, vertex id (from 1) -> xxx
 	'''
-	mapIndex = {}
-	mapRule  = {}
+	if not isinstance(graph, StateGraph):
+		graph = StateGraph.fromDict(graph, None, states=node_weight.keys())
 
 	name_net_file = output_dir + filename + '.net'
 	# print(f'Printing net in {name_net_file}')
 
-	file_net = open(name_net_file,'w')
-
-	## Add vertices
-	file_net.write(f'*Vertices {len(node_weight.keys())}\n')
-	tmp_index = 1
-	for src in node_weight.keys():
-		mapIndex[src]      = tmp_index
-		mapRule[tmp_index] = src
-		file_net.write(f'{tmp_index} "{src}" {node_weight[src]}\n')
-		tmp_index = tmp_index + 1
-
-	## Add arcs
-	file_net.write('*Arcs\n')
-	for src in graph.keys():
-		id_src = mapIndex[src]
-		neigh_src = graph[src]
-		for tgt, w in neigh_src.items():
-			id_tgt = mapIndex[tgt]
-			file_net.write(f'{id_src} {id_tgt} {w}\n')
-	return name_net_file, mapRule
+	with open(name_net_file,'w') as file_net:
+		## Add vertices (vertex i+1 is state i)
+		file_net.write(f'*Vertices {graph.nbStates()}\n')
+		for i, (src, w) in enumerate(zip(graph.states, stateWeights(graph, node_weight))):
+			file_net.write(f'{i+1} "{src}" {w}\n')
+
+		## Add arcs
+		file_net.write('*Arcs\n')
+		writeArcs(graph, file_net)
+	return name_net_file, [None] + list(graph.states)
+
+################################################################################
+def writeArcs(graph, file_net):
+	'''
+	Write the arcs of the StateGraph (vertex i+1 is state i)
+	'''
+	indptr, indices, weights = graph.indptr.tolist(), (graph.indices + 1).tolist(), graph.weights.tolist()
+	for id_src in range(graph.nbStates()):
+		a, b = indptr[id_src], indptr[id_src+1]
+		file_net.writelines([f'{id_src+1} {id_tgt} {w}\n' for id_tgt, w in zip(indices[a:b], weights[a:b])])
 
 ################################################################################
 def runInfomap(network_file, output_dir, nb_loop = 10, is_state=False):
@@ -124,7 +144,7 @@ def readClustering(mapRule, network_file, output_dir):
 	'''
 	Parameters:
 	-----------
-	mapRule: dict of (int -> xxx)
+	mapRule: dict of (int -> xxx) (or list, see printGraph(..))
 
 	Returns:
 	--------
@@ -186,19 +206,20 @@ def infomapClustering(graph, node_weight, file_path = '', nb_loop = 10):
 	return codelength, gain, clust, time / nb_loop
 
 ################################################################################
-def infomapStateClustering(nodes, states, states_network, weight, file_path = '', nb_loop = 10):
+def infomapStateClustering(graph, weight = None, file_path = '', nb_loop = 10):
 	'''
 	Main method (for Network with states)
 
 	Parameters:
 	--------
-	graph: dict of (xxx -> dict of (xxx -> float))
-	node_weight: dict of (xxx -> float)
+	graph: StateGraph
+	weight: dict of (state -> float) or array aligned with the states
+			(None: 1.0 for each state)
 
 	Returns:
 	--------
 	codelength: float
-	clust: dict (node id -> clust id)
+	clust: dict (physical node -> list of clust ids)
 	'''
 	output_dir = './output_infomap/'
 	filename = 'out_infomap'
@@ -207,52 +228,42 @@ def infomapStateClustering(nodes, states, states_network, weight, file_path = ''
 		filename = os.path.splitext(os.path.basename(file_path))[0]
 		output_dir = dir_path + "/output_infomap/"
 	os.makedirs(output_dir, exist_ok=True)
-	net_filepath, mapRule = printStateGraph(nodes, states, states_network, weight, filename, output_dir)
+	net_filepath, mapRule = printStateGraph(graph, weight, filename, output_dir)
 	run_sucess = runInfomap(net_filepath, output_dir, nb_loop, True)
 	codelength, gain, clust, time = readStateClustering(mapRule, net_filepath, output_dir)
 	# os.removedirs(output_dir)
 	return codelength, gain, clust, time / nb_loop
 
 ################################################################################
-def printStateGraph(nodes, states, states_network, weight, filename, output_dir):
-	mapIndex = {}
-	mapRule  = {}
+def printStateGraph(graph, weight, filename, output_dir):
+	'''
+	Output the StateGraph in output_dir in the Pajek .net format with
+	*States (vertex i+1 is physical node i, state i+1 is state i)
 
+	Returns:
+	--------
+	name_net_file: path of Pajek net file
+	mapRule		 : list, vertex id (from 1) -> physical node
+	'''
 	name_net_file = output_dir + filename + '.net'
 	# print(f'Printing net in {name_net_file}')
 
-	file_net = open(name_net_file,'w')
-
-	## Add vertices
-	file_net.write(f'*Vertices {len(nodes)}\n')
-	tmp_index = 1
-	for src in nodes:
-		mapIndex[src]      = tmp_index
-		mapRule[tmp_index] = src
-		file_net.write(f'{tmp_index} "{src}"\n')
-		tmp_index += 1
-
-	## Add states
-	mapIndexState = {}
-	file_net.write(f'*States\n')
-	tmp_index = 1
-	for state, phys_node in states.items():
-		phys_id = mapIndex[phys_node]
-		mapIndexState[state] = tmp_index
-		file_net.write(f'{tmp_index} {phys_id} "{state}" {weight[state]}\n')
-		tmp_index += 1
-
-	## Add arcs
-	file_net.write('*Arcs\n')
-	for src in states_network.keys():
-		id_src = mapIndexState[src]
-		neigh_src = states_network[src]
-		for tgt, w in neigh_src.items():
-			id_tgt = mapIndexState[tgt]
-			file_net.write(f'{id_src} {id_tgt} {w}\n')
-	file_net.close()
-
-	return name_net_file, mapRule
+	with open(name_net_file,'w') as file_net:
+		## Add vertices
+		file_net.write(f'*Vertices {graph.nbNodes()}\n')
+		file_net.writelines([f'{i+1} "{src}"\n' for i, src in enumerate(graph.nodes)])
+
+		## Add states
+		file_net.write(f'*States\n')
+		phys_ids = (graph.stateNodes + 1).tolist()
+		file_net.writelines([f'{i+1} {phys_id} "{state}" {w}\n'
+				for i, (state, phys_id, w) in enumerate(zip(graph.states, phys_ids, stateWeights(graph, weight)))])
+
+		## Add arcs
+		file_net.write('*Arcs\n')
+		writeArcs(graph, file_net)
+
+	return name_net_file, [None] + graph.nodes
 ################################################################################
 def readStateClustering(mapRule, network_file, output_dir):
 	name       = os.path.splitext(os.path.basename(network_file))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+'''
+Candidate pairs of AggOrder2Rules.MinHashLSH against the exhaustive scan
+of the pairs of rules of each location, for several LSH parameters:
+- fraction of the pairs of rules that are candidates
+- recall: fraction of the pairs that can be merged (aggregationScore)
+  that are candidates
+- number of groups of the aggregation and number of locations whose
+  groups are the same as with the exhaustive scan
+- running time of AggOrder2Rules.aggregateRules(..)
+(only the locations with at least min_rules 2nd order rules)
+
+usage: python LSHAggregationAccuracy.py [filename] [separator] [min_rules]
+'''
+import sys
+import time
+
+import SequenceReader
+import BuildRulesFast
+import HONUtils
+import AggOrder2Rules
+
+filename = sys.argv[1] if len(sys.argv) > 1 else "./maritime_sequences.csv"
+sep = sys.argv[2] if len(sys.argv) > 2 else " "
+min_rules = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+lsh_params = [(8, 2, 3), (16, 2, 3), (32, 2, 3), (16, 4, 3), (16, 2, 1), (16, 2, 5)] ## (nb_bands, band_size, min_support)
+
+corpus = SequenceReader.readCorpus(filename, True, sep, use_cache=True)
+rules = corpus.decodeRules(BuildRulesFast.Order2RulesBuilder(corpus, 1, 1.).ExtractRules())
+locations = {symb: sub_rules for symb, sub_rules in AggOrder2Rules.lastSymbolMapping(rules).items() if len(sub_rules) >= min_rules}
+print(f'{len(locations)} locations with at least {min_rules} rules')
+
+start_time = time.time()
+exact = AggOrder2Rules.aggregateRules({r: c for r, c in rules.items() if len(r) == 1 or r[-1] in locations})
+exact_time = time.time() - start_time
+print(f'exhaustive: {sum(len(c) for c in exact.values())} groups, {round(exact_time, 2)} s')
+
+print('nb_bands,band_size,min_support,nb_pairs,nb_candidates,nb_mergeable,recall,nb_groups,same_locations,time')
+for nb_bands, band_size, min_support in lsh_params:
+	lsh = AggOrder2Rules.MinHashLSH(nb_bands, band_size, min_support=min_support, min_rules=min_rules)
+	nb_pairs, nb_candidates, nb_mergeable, nb_found = 0, 0, 0, 0
+	for symb, sub_rules in locations.items():
+		dp = HONUtils.getDistribution(rules[(symb,)])
+		counts = AggOrder2Rules.candidateRecall(sub_rules, dp, lsh)
+		nb_pairs += counts[0]
+		nb_candidates += counts[1]
+		nb_mergeable += counts[2]
+		nb_found += counts[3]
+	start_time = time.time()
+	approx = AggOrder2Rules.aggregateRules({r: c for r, c in rules.items() if len(r) == 1 or r[-1] in locations}, lsh=lsh)
+	approx_time = time.time() - start_time
+	same = sum([set(approx[symb].keys()) == set(exact[symb].keys()) for symb in locations])
+	recall = nb_found / nb_mergeable if nb_mergeable > 0 else 1.
+	print(f'{nb_bands},{band_size},{min_support},{nb_pairs},{nb_candidates},{nb_mergeable},{round(recall, 4)},'
+		  f'{sum(len(c) for c in approx.values())},{same},{round(approx_time, 2)}')
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+'''
+Throughput (MB/s of uncompressed text) of the sequence readers:
+- HONUtils.readSequenceFile + HONUtils.removeRepetitions
+- SequenceReader.iterSequences (generator)
+- SequenceReader.readCorpus (TrajectoryCorpus)
+- SequenceReader.readCorpus from the binary cache of the file
+on the plain, gzip and zip versions of the input file
+
+usage: python ReaderBenchmark.py [filename] [separator]
+'''
+import gzip
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+import HONUtils
+import SequenceReader
+
+filename = sys.argv[1] if len(sys.argv) > 1 else "./maritime_sequences.csv"
+sep = sys.argv[2] if len(sys.argv) > 2 else " "
+nb_repeat = 3
+
+##################################################################
+def bestTime(function):
+	best = float('inf')
+	for _ in range(nb_repeat):
+		start_time = time.time()
+		res = function()
+		best = min(best, time.time() - start_time)
+	return best, res
+
+##################################################################
+size_mb = os.path.getsize(filename) / 1e6
+print(f'{filename}: {round(size_mb, 2)} MB')
+
+t, ref = bestTime(lambda: HONUtils.removeRepetitions(HONUtils.readSequenceFile(filename, True, sep, use_cache=False)))
+print(f'readSequenceFile + removeRepetitions: {round(size_mb / t, 1)} MB/s')
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+	base = os.path.basename(filename)
+	cached_file = os.path.join(tmp_dir, base)
+	with open(filename, 'rb') as f_in, open(cached_file, 'wb') as f_out:
+		f_out.write(f_in.read())
+	SequenceReader.readCorpus(cached_file, True, sep, use_cache=True)
+	t, corpus = bestTime(lambda: SequenceReader.readCorpus(cached_file, True, sep, use_cache=True))
+	same = [corpus.decodeSequence(seq) for seq in corpus] == ref
+	print(f'readCorpus (binary cache): {round(size_mb / t, 1)} MB/s, same sequences: {same}')
+
+	gz_file = os.path.join(tmp_dir, base + '.gz')
+	with open(filename, 'rb') as f_in, gzip.open(gz_file, 'wb') as f_out:
+		f_out.write(f_in.read())
+	zip_file = os.path.join(tmp_dir, base + '.zip')
+	with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_DEFLATED) as archive:
+		archive.write(filename, base)
+
+	for f in (filename, gz_file, zip_file):
+		t, seqs = bestTime(lambda: list(SequenceReader.iterSequences(f, True, sep)))
+		print(f'iterSequences ({os.path.basename(f)}): {round(size_mb / t, 1)} MB/s, same sequences: {seqs == ref}')
+		t, corpus = bestTime(lambda: SequenceReader.readCorpus(f, True, sep, use_cache=False))
+		same = [corpus.decodeSequence(seq) for seq in corpus] == ref
+		print(f'readCorpus ({os.path.basename(f)}): {round(size_mb / t, 1)} MB/s, same sequences: {same}')
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+'''
+Precision and recall of the approximate rules of
+FastHONRulesBuilder.ExtractRulesSampled(..) against the exact rules of
+FastHONRulesBuilder.ExtractRules(), for several sample ratios and margins
+(rules of order >= 2 only: the first order rules are always exact)
+
+Also prints the number of candidate sources given by the sample, the
+number of sources extended on the whole corpus, the running times and
+the speedup against ExtractRules(), then, for each sample ratio and
+margin, whether the sampled path is worth using on this corpus (faster
+than the exact rules on average).
+
+usage: python SampledRulesAccuracy.py [filename] [separator] [max_order]
+'''
+import sys
+import time
+from collections import defaultdict
+
+import SequenceReader
+import BuildRulesFast
+
+filename = sys.argv[1] if len(sys.argv) > 1 else "./maritime_sequences.csv"
+sep = sys.argv[2] if len(sys.argv) > 2 else " "
+max_order = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+min_support = 1
+threshold_multi = 1.
+sample_ratios = [0.1, 0.25, 0.5]
+margins = [0.25, 0.5, 1.]
+nb_run = 3 ## different samples for each parameter
+
+corpus = SequenceReader.readCorpus(filename, True, sep, use_cache=True)
+
+start_time = time.time()
+exact = BuildRulesFast.FastHONRulesBuilder(corpus, max_order, min_support, threshold_multi).ExtractRules()
+exact_time = time.time() - start_time
+exact_rules = set([r for r in exact if len(r) > 1])
+print(f'exact: {len(exact_rules)} rules of order >= 2, {round(exact_time, 2)} s')
+
+print('sample_ratio,margin,run,nb_candidates,nb_exact_checks,nb_rules,precision,recall,time,speedup')
+runs = defaultdict(list) ## (ratio, margin) -> list of (recall, time)
+for ratio in sample_ratios:
+	for margin in margins:
+		for run in range(nb_run):
+			start_time = time.time()
+			builder = BuildRulesFast.FastHONRulesBuilder(corpus, max_order, min_support, threshold_multi)
+			approx = builder.ExtractRulesSampled(ratio, margin, Seed=run)
+			approx_time = time.time() - start_time
+			approx_rules = set([r for r in approx if len(r) > 1])
+			found = len(approx_rules & exact_rules)
+			precision = found / len(approx_rules) if len(approx_rules) > 0 else 1.
+			recall = found / len(exact_rules) if len(exact_rules) > 0 else 1.
+			runs[(ratio, margin)].append((recall, approx_time))
+			print(f'{ratio},{margin},{run},{builder.Candidates},{builder.ExactChecks},{len(approx_rules)},'
+				  f'{round(precision, 4)},{round(recall, 4)},{round(approx_time, 2)},{round(exact_time / approx_time, 2)}')
+
+print('sample_ratio,margin,mean_recall,mean_time,speedup,worth_using')
+for (ratio, margin), values in runs.items():
+	mean_recall = sum([r for r, _ in values]) / len(values)
+	mean_time = sum([t for _, t in values]) / len(values)
+	print(f'{ratio},{margin},{round(mean_recall, 4)},{round(mean_time, 2)},{round(exact_time / mean_time, 2)},{mean_time < exact_time}')
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+'''
+Streaming reader of sequence files (same format as HONUtils.readSequenceFile)
+
+Files can be plain text (.csv, .txt, ...), gzip (.gz) or zip (.zip,
+all the files of the archive are read in order). The file is read in
+large chunks, and the removal of repetitions (HONUtils.removeRepetitions)
+is done while each line is split.
+
+- iterSequences(..): generator of sequences (list of str)
+- readCorpus(..): TrajectoryCorpus, the locations are interned in the
+  same pass (no list of str is kept)
+- readWeightedCorpus(..): (TrajectoryCorpus, weights), identical
+  sequences are kept once with their number of occurrences
+
+See ReaderBenchmark.py for the throughput of each method.
+
+Binary cache: readCorpus(.., use_cache=True) (and HONUtils.readSequenceFile(..)
+by default) keeps the corpus next to the
+input file, or in cache_dir (symbol table, int32 tokens, offsets and ids
+of the sequences as .npy files, see cachePath(..)). It is used instead of the input file
+as long as the modification time and the size of the file are the same,
+and gives the same corpus, over the memory-mapped arrays of the cache
+(use_cache=False: the file is always parsed).
+'''
+import gzip
+import hashlib
+import io
+import os
+import zipfile
+
+import numpy as np
+
+import HONSnapshot
+from TrajectoryCorpus import TrajectoryCorpus
+
+CHUNK_SIZE = 1 << 22 ## characters read at once
+
+##################################################################
+def openText(filename):
+	'''
+	Returns the list of text streams of the file
+	(one per file of the archive for .zip files)
+	'''
+	if filename.endswith('.gz'):
+		return [gzip.open(filename, 'rt')]
+	if filename.endswith('.zip'):
+		archive = zipfile.ZipFile(filename)
+		names = [info.filename for info in archive.infolist() if not info.is_dir()]
+		return [io.TextIOWrapper(archive.open(name)) for name in names]
+	return [open(filename, 'r')]
+
+##################################################################
+def iterLines(filename, chunk_size = CHUNK_SIZE):
+	'''
+	Generator of the lines of the file, read by chunks of 'chunk_size'
+	characters
+	'''
+	for stream in openText(filename):
+		with stream:
+			rest = ''
+			while True:
+				chunk = stream.read(chunk_size)
+				if not chunk:
+					break
+				lines = (rest + chunk).split('\n')
+				rest = lines.pop()
+				yield from lines
+			if rest:
+				yield rest
+
+##################################################################
+def iterRecords(filename, is_line_id = True, separator = ' ', remove_repetitions = True, chunk_size = CHUNK_SIZE):
+	'''
+	Generator of (id, sequence) of the file (the id is None if
+	is_line_id is False). Lines are kept as in HONUtils.readSequenceFile
+	'''
+	for line in iterLines(filename, chunk_size):
+		split_line = line.strip().split(separator)
+		if is_line_id:
+			if len(split_line) < 3:
+				continue
+			id_seq, seq = split_line[0], split_line[1:]
+		else:
+			if len(split_line) < 2:
+				continue
+			id_seq, seq = None, split_line
+		if remove_repetitions:
+			prev = None
+			nseq = []
+			for s in seq:
+				if s != prev:
+					nseq.append(s)
+					prev = s
+			seq = nseq
+		yield id_seq, seq
+
+##################################################################
+def iterSequences(filename, is_line_id = True, separator = ' ', remove_repetitions = True, chunk_size = CHUNK_SIZE):
+	'''
+	Generator of the sequences of the file: same sequences as
+	HONUtils.removeRepetitions(HONUtils.readSequenceFile(..))
+	(or HONUtils.readSequenceFile(..) if remove_repetitions is False)
+
+	Parameters:
+	-----------
+	filename: str (.gz and .zip files are uncompressed on the fly)
+	is_line_id: bool, the first element of each line is the id of the sequence
+	separator: str
+	remove_repetitions: bool
+	chunk_size: int, number of characters read at once
+	'''
+	for _, seq in iterRecords(filename, is_line_id, separator, remove_repetitions, chunk_size):
+		yield seq
+
+##################################################################
+def readCorpus(filename, is_line_id = True, separator = ' ', remove_repetitions = True, chunk_size = CHUNK_SIZE, ids = None, use_cache = False, cache_dir = None):
+	'''
+	Read the file into a TrajectoryCorpus: each location is interned
+	while the line is split (same sequences as iterSequences(..))
+
+	Parameters:
+	-----------
+	see iterSequences(..)
+	ids: list, if given the id of each sequence is appended to it
+	use_cache: bool, read the binary cache of the file if it is up to
+			   date, otherwise read the file and write the cache
+	cache_dir: str, directory of the cache (default: next to the file)
+
+	Returns:
+	--------
+	corpus: TrajectoryCorpus
+	'''
+	if use_cache:
+		return cachedCorpus(filename, is_line_id, separator, remove_repetitions, ids, cache_dir)
+	corpus = TrajectoryCorpus()
+	symbol_index = corpus.symbolIndex
+	symbols = corpus.symbols
+	tokens, offsets = corpus.tokens, corpus.offsets
+	for line in iterLines(filename, chunk_size):
+		split_line = line.strip().split(separator)
+		if is_line_id:
+			if len(split_line) < 3:
+				continue
+			if ids is not None:
+				ids.append(split_line[0])
+			seq = split_line[1:]
+		else:
+			if len(split_line) < 2:
+				continue
+			seq = split_line
+		prev = -1
+		for s in seq:
+			index = symbol_index.get(s)
+			if index is None:
+				index = len(symbols)
+				symbol_index[s] = index
+				symbols.append(s)
+			if index != prev or not remove_repetitions:
+				tokens.append(index)
+				prev = index
+		offsets.append(len(tokens))
+	return corpus
+
+##################################################################
+def readWeightedCorpus(filename, is_line_id = True, separator = ' ', remove_repetitions = True, use_cache = False, cache_dir = None):
+	'''
+	readCorpus(..) with the identical sequences collapsed
+	(see TrajectoryCorpus.deduplicate())
+
+	Returns:
+	--------
+	corpus: TrajectoryCorpus of the distinct sequences
+	weights: list of int, number of occurrences of each sequence
+	'''
+	return readCorpus(filename, is_line_id, separator, remove_repetitions, use_cache=use_cache, cache_dir=cache_dir).deduplicate()
+
+##################################################################
+## Binary cache
+##################################################################
+CACHE_VERSION = 1
+
+def cachePath(filename, is_line_id = True, separator = ' ', remove_repetitions = True, cache_dir = None):
+	'''
+	Directory of the cache of the file for the given reading parameters
+	(next to the file, or in cache_dir: the key then also depends on the
+	absolute path of the file)
+	'''
+	params = (CACHE_VERSION, is_line_id, separator, remove_repetitions)
+	if cache_dir is None:
+		key = hashlib.sha1(repr(params).encode()).hexdigest()[:12]
+		return f'{filename}.{key}.corpus'
+	key = hashlib.sha1(repr(params + (os.path.abspath(filename),)).encode()).hexdigest()[:12]
+	return os.path.join(cache_dir, f'{os.path.basename(filename)}.{key}.corpus')
+
+##################################################################
+def sourceStat(filename):
+	stat = os.stat(filename)
+	return np.array([CACHE_VERSION, stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+
+##################################################################
+def saveCache(path, filename, corpus, ids):
+	HONSnapshot.saveArrays(path, {
+		'source': sourceStat(filename),
+		'symbols': np.array(corpus.symbols) if corpus.nbSymbols() > 0 else np.zeros(0, dtype='U1'),
+		'tokens': corpus.tokenArray().astype(np.int32),
+		'offsets': corpus.offsetArray(),
+		'ids': np.array(ids) if len(ids) > 0 else np.zeros(0, dtype='U1')})
+
+##################################################################
+def loadCache(path, ids = None):
+	'''
+	Returns the corpus of the cache: its tokens and offsets are the
+	memory-mapped arrays (see TrajectoryCorpus.fromArrays(..))
+	'''
+	arrays = HONSnapshot.loadArrays(path)
+	corpus = TrajectoryCorpus.fromArrays(arrays['symbols'].tolist(), arrays['tokens'], arrays['offsets'])
+	if ids is not None:
+		ids.extend(arrays['ids'].tolist())
+	return corpus
+
+##################################################################
+def isCacheValid(path, filename):
+	try:
+		source = np.load(os.path.join(path, 'source.npy'))
+	except (OSError, ValueError):
+		return False
+	return np.array_equal(source, sourceStat(filename))
+
+##################################################################
+def cachedCorpus(filename, is_line_id = True, separator = ' ', remove_repetitions = True, ids = None, cache_dir = None):
+	'''
+	readCorpus(..) using the binary cache of the file (written if it is
+	missing or out of date)
+	'''
+	path = cachePath(filename, is_line_id, separator, remove_repetitions, cache_dir)
+	if isCacheValid(path, filename):
+		return loadCache(path, ids)
+	read_ids = []
+	corpus = readCorpus(filename, is_line_id, separator, remove_repetitions, ids=read_ids, use_cache=False)
+	try:
+		if cache_dir is not None:
+			os.makedirs(cache_dir, exist_ok=True)
+		saveCache(path, filename, corpus, read_ids)
+	except OSError:
+		pass ## read-only directory: no cache
+	if ids is not None:
+		ids.extend(read_ids)
+	return corpus
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+'''
+Variable-order rules of a corpus split into many sequence files
+(e.g. one file per day)
+
+The observations are counted by a map-reduce over the files:
+- map: a pool of processes reads the files (shards) one at a time and
+  counts, for each order n <= max_order, the (source of length n, target)
+  pairs of the shard (CountTables.countShard(..), with the shard's own symbol ids)
+- reduce: the partial tables are collected as they are returned, in the
+  order of the files, and merged into global tables by one np.unique per
+  order for each batch of shards (CountTables.ShardTables.merge(..))
+
+Only the count tables and the trajectories of the shards being counted
+are in memory: the peak memory is bounded by the largest shard (and by
+the number of distinct sources), not by the whole corpus.
+
+The first order counts are given to Count (in order of first occurrence,
+as in FastHONRulesBuilder.BuildObservations()) and the counts of the
+extensions are read from the tables instead of the position index of
+FastHONRulesBuilder (FastHONRulesBuilder.SetTables(..)). The tables keep
+the position of the first occurrence of each pair, so the extensions and
+their targets are in the same order as in FastHONRulesBuilder (the ties of
+MaxDivergence are broken in the same way): the rules are the same as the
+ones of FastHONRulesBuilder on the concatenation of the files, in the same
+order.
+
+New trajectories (e.g. the file of a new day) are added to the rules
+with add_trajectories(..).
+'''
+import multiprocessing
+from collections import defaultdict, Counter
+
+import BuildRulesFast
+import CountTables
+from TrajectoryCorpus import TrajectoryCorpus
+
+class ShardedHONRulesBuilder(BuildRulesFast.FastHONRulesBuilder):
+	##################################################################
+	def __init__(self, filenames, max_order, min_support, ThresholdMultiplier, workers = 1, is_line_id = True, separator = ' ', use_cache = False, cache_dir = None):
+		'''
+		Parameters:
+		-----------
+		filenames: list of str, sequence files (see SequenceReader.readCorpus(..))
+		workers: int, number of processes counting the shards
+		use_cache, cache_dir: binary cache of the files (see SequenceReader.readCorpus(..))
+		'''
+		BuildRulesFast.FastHONRulesBuilder.__init__(self, [], max_order, min_support, ThresholdMultiplier)
+		self.Filenames = list(filenames)
+		self.CountWorkers = workers
+		self.IsLineId = is_line_id
+		self.Separator = separator
+		self.UseCache = use_cache
+		self.CacheDir = cache_dir
+
+	##################################################################
+	def BuildObservations(self):
+		'''
+		Count the shards and fill Count with the first order counts
+		'''
+		tables = CountTables.ShardTables(self.MaxOrder)
+		params = [(f, self.IsLineId, self.Separator, self.MaxOrder, self.UseCache, self.CacheDir) for f in self.Filenames]
+		if self.CountWorkers > 1:
+			with multiprocessing.Pool(self.CountWorkers) as pool:
+				for shard in pool.imap(CountTables.countShard, params):
+					tables.merge(shard)
+		else:
+			for p in params:
+				tables.merge(CountTables.countShard(p))
+		tables.reduce()
+		self.SetTables(tables)
+
+	##################################################################
+	def add_trajectories(self, batch, weights = None):
+		'''
+		Add new trajectories after ExtractRules(): the batch is counted as
+		a new shard merged into the tables, then the counts and the KLD
+		tests of the first order sources of the batch are updated (see
+		FastHONRulesBuilder.add_trajectories(..))
+
+		Parameters:
+		-----------
+		batch: TrajectoryCorpus or list of (list of str)
+			   (e.g. SequenceReader.readCorpus(new_file))
+		weights: list of int, number of occurrences of each trajectory
+
+		Returns:
+		--------
+		Added, Removed, Updated: sets of rules (see FastHONRulesBuilder.UpdateRules)
+		'''
+		if not isinstance(batch, TrajectoryCorpus):
+			batch = TrajectoryCorpus.fromSequences(batch)
+		self.Tables.merge((batch.symbols, len(batch.tokens), CountTables.countCorpus(batch, self.MaxOrder, weights)))
+		self.Tables.reduce()
+		self.Tables.buildRanges()
+
+		## counts of the sources that occur in the batch
+		mapping = [self.Tables.symbolIndex[s] for s in batch.symbols]
+		delta = defaultdict(Counter)
+		for i, seq in enumerate(batch):
+			BuildRulesFast.CountContexts(delta, [mapping[t] for t in seq], self.MaxOrder, 1 if weights is None else weights[i])
+		for source in delta:
+			if len(source) == 1:
+				self.AddToCount(source, delta[source])
+		## the extensions of a source are in the batch only if the source
+		## is (the new pairs come after the ones of the previous files)
+		for source in sorted([s for s in delta if s in self.Extended], key=len):
+			self.ExtendObservation(source)
+		return self.UpdateRules(delta.keys(), delta.keys())
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+'''
+Variable-order rules and VON network of a sliding window of trajectories
+(e.g. the trajectories of the last N days)
+
+Trajectories are added with push(..) and removed with expire(..).
+The model keeps the number of observations of every source of length
+<= max_order in the window, so both operations only update the sources
+of the given trajectory. The extensions of the first order sources
+whose counts changed are explored again (all together, level by level),
+but only from the
+contexts of the pushed or expired trajectory: a subtree of extensions
+where no count changed keeps its rules, and its KLD tests as long as the
+distribution of the source it is tested against moves less than their
+distance to the thresholds (see FastHONRulesBuilder.ExtendRoots). The
+targets and the extensions of each source are kept sorted as they are
+added, so the cost of an update depends on the trajectory, not on the
+size of the window.
+
+The current rules and network are given at any time by
+getRules() and getNetwork().
+
+The targets of the extensions are in the order of their ids, so the
+ties of MaxDivergence are broken by id (FastHONRulesBuilder uses the
+order of the first occurrences): with max_order >= 3, a few rules can differ
+from the ones of FastHONRulesBuilder on the same trajectories.
+'''
+from array import array
+from bisect import bisect_left, insort
+from collections import defaultdict, Counter
+
+import BuildRulesFast
+import BuildNetwork
+from StateGraph import StateGraph
+
+##################################################################
+def removeSorted(values, x):
+	del values[bisect_left(values, x)]
+
+##################################################################
+class SlidingWindowHON(BuildRulesFast.FastHONRulesBuilder):
+	##################################################################
+	def __init__(self, max_order, min_support, ThresholdMultiplier):
+		BuildRulesFast.FastHONRulesBuilder.__init__(self, [], max_order, min_support, ThresholdMultiplier)
+		self.Output = self.Corpus.decodeRules(self.Rules)
+		self.Graph  = BuildNetwork.BuildNetwork(self.Output).toDict() ## patched by update(..)
+		self.Suffixes = BuildNetwork.RuleSuffixes(self.Output)
+		## source (length <= max_order) -> target -> nb of observations
+		self.Observations = defaultdict(Counter)
+		## source -> targets of the observations, sorted by id
+		self.Targets = defaultdict(list)
+		## source -> extensions of the source that have observations, sorted
+		self.Extensions = defaultdict(list)
+		self.Trajectories = {} ## trajectory id -> array of location ids
+		self.nextId = 0
+
+	##################################################################
+	def push(self, trajectory, trajectory_id = None):
+		'''
+		Add a trajectory (list of str) to the window
+
+		Returns:
+		--------
+		trajectory_id: id to use with expire(..)
+		Added, Removed, Updated: sets of rules (see FastHONRulesBuilder.UpdateRules)
+		'''
+		if trajectory_id is None:
+			trajectory_id = self.nextId
+			self.nextId += 1
+		if trajectory_id in self.Trajectories:
+			raise ValueError(f'Trajectory {trajectory_id} already in the window')
+		seq = array('I', [self.Corpus.intern(s) for s in trajectory])
+		self.Trajectories[trajectory_id] = seq
+		return (trajectory_id,) + self.update(seq, 1)
+
+	##################################################################
+	def expire(self, trajectory_id):
+		'''
+		Remove a trajectory from the window
+
+		Returns:
+		--------
+		Added, Removed, Updated: sets of rules (see FastHONRulesBuilder.UpdateRules)
+		'''
+		seq = self.Trajectories.pop(trajectory_id)
+		return self.update(seq, -1)
+
+	##################################################################
+	def update(self, seq, sign):
+		delta = defaultdict(Counter)
+		BuildRulesFast.CountContexts(delta, seq, self.MaxOrder, sign)
+		for source, delta_source in delta.items():
+			obs = self.Observations[source]
+			targets = self.Targets[source]
+			new_source = len(obs) == 0
+			for t, c in delta_source.items():
+				if t not in obs:
+					insort(targets, t)
+				obs[t] += c
+				if obs[t] == 0:
+					del obs[t]
+					removeSorted(targets, t)
+			if len(obs) == 0:
+				del self.Observations[source]
+				del self.Targets[source]
+				if len(source) > 1:
+					removeSorted(self.Extensions[source[1:]], source)
+					if len(self.Extensions[source[1:]]) == 0:
+						del self.Extensions[source[1:]]
+			elif new_source and len(source) > 1:
+				insort(self.Extensions[source[1:]], source)
+			## sources already used by the rule builder
+			if len(source) == 1 or source[1:] in self.Extended:
+				self.AddToCount(source, delta_source)
+		added, removed, updated = self.UpdateRules(delta.keys(), delta.keys())
+		BuildNetwork.UpdateNetwork(self.Graph, self.Output, self.Suffixes, added, removed, updated)
+		return added, removed, updated
+
+	##################################################################
+	def ExtensionCounts(self, Source):
+		'''
+		Counts of the extensions of Source from the observations of the
+		window (instead of the position index of FastHONRulesBuilder)
+		'''
+		counts = {}
+		for ext in self.Extensions.get(Source, ()):
+			obs = self.Observations[ext]
+			counts[ext] = dict([(t, obs[t]) for t in self.Targets[ext]])
+		return counts
+
+	##################################################################
+	def AddToCount(self, Source, DeltaSource):
+		'''
+		FastHONRulesBuilder.AddToCount(..), with the targets of the
+		extensions in the order of their ids (as ExtensionCounts(..))
+		'''
+		count = self.Count.get(Source, {})
+		new_target = len(Source) > 1 and any([t not in count for t in DeltaSource])
+		BuildRulesFast.FastHONRulesBuilder.AddToCount(self, Source, DeltaSource)
+		if new_target and Source in self.Count:
+			targets = self.Targets[Source]
+			count = self.Count[Source]
+			self.Count[Source] = defaultdict(int, [(t, count[t]) for t in targets])
+			if Source in self.Distribution:
+				distr = self.Distribution[Source]
+				self.Distribution[Source] = dict([(t, distr[t]) for t in targets if t in distr])
+
+	##################################################################
+	def getRules(self):
+		'''
+		Returns:
+		--------
+		rules: dict tuple of str -> dict (str -> float)
+		'''
+		return self.Output
+
+	##################################################################
+	def getNetwork(self):
+		'''
+		Returns:
+		--------
+		graph: StateGraph, VON network of the rules (as
+			   BuildNetwork.BuildNetwork(..), the states in order of first
+			   occurrence in the arcs)
+		'''
+		return StateGraph.fromDict(self.Graph)
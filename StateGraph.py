@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+'''
+Compact representation of the networks given to Infomap
+
+A StateGraph is a network of states (representations), each state being
+a representation of a physical node (location):
+- nodes: list of the physical nodes (node id -> label)
+- states: list of the states (state id -> label), e.g. the rule sources
+  of a VON network, the groups of rules of an aggregated network or
+  the 'i-j' states of a FON2 network
+- stateNodes: array state id -> node id
+- indptr, indices, weights: CSR arcs between states, the arcs of state i
+  are indices[indptr[i]:indptr[i+1]] with weights[indptr[i]:indptr[i+1]]
+
+All the network builders (BuildNetwork.BuildNetwork,
+BuildNetwork.BuildNetworkTrie, SlidingWindowHON.getNetwork,
+AggOrder2Rules.mergeNodes, FON2StatesNetwork.buildFON2Network and the
+networks of TestCasesGeneration) give a StateGraph, which is written
+directly by InfoMapClust.printGraph(..) and InfoMapClust.printStateGraph(..).
+toDict() gives the dict networks of the original code.
+'''
+import numpy as np
+
+##################################################################
+def lastSymbol(state):
+	'''
+	Physical node of a VON state (rule source): its last location
+	'''
+	return state[-1]
+
+##################################################################
+def aggLastSymbol(state):
+	'''
+	Physical node of an aggregated state (tuple of rule sources)
+	'''
+	return state[0][-1]
+
+class StateGraph():
+	##################################################################
+	def __init__(self, nodes, states, state_nodes, indptr, indices, weights):
+		'''
+		Parameters:
+		-----------
+		nodes: list, labels of the physical nodes
+		states: list, labels of the states
+		state_nodes: array of int, node id of each state
+		indptr, indices, weights: CSR arcs (nb states + 1, nb arcs, nb arcs)
+		'''
+		self.nodes = nodes
+		self.states = states
+		self.stateNodes = np.asarray(state_nodes, dtype=np.int64)
+		self.indptr = np.asarray(indptr, dtype=np.int64)
+		self.indices = np.asarray(indices, dtype=np.int64)
+		self.weights = np.asarray(weights)
+		self._stateIndex = None
+
+	##################################################################
+	def nbNodes(self):
+		return len(self.nodes)
+
+	def nbStates(self):
+		return len(self.states)
+
+	def nbArcs(self):
+		return len(self.indices)
+
+	##################################################################
+	def stateIndex(self):
+		'''
+		Returns the dict state label -> state id (built once)
+		'''
+		if self._stateIndex is None:
+			self._stateIndex = {s: i for i, s in enumerate(self.states)}
+		return self._stateIndex
+
+	##################################################################
+	def stateToNode(self):
+		'''
+		Returns the dict state label -> physical node label
+		'''
+		nodes = self.nodes
+		return {s: nodes[n] for s, n in zip(self.states, self.stateNodes.tolist())}
+
+	##################################################################
+	def toDict(self, keep_empty = False):
+		'''
+		Returns the network as a dict state -> dict (state -> weight)
+
+		The states without outgoing arcs are dropped unless keep_empty is
+		True (e.g. the first order targets that are not rule sources in a
+		VON network), as in the dict of the original BuildNetwork(..).
+		'''
+		states = self.states
+		indptr, indices, weights = self.indptr.tolist(), self.indices.tolist(), self.weights.tolist()
+		graph = {}
+		for i in range(len(states)):
+			a, b = indptr[i], indptr[i+1]
+			if b > a or keep_empty:
+				graph[states[i]] = {states[j]: w for j, w in zip(indices[a:b], weights[a:b])}
+		return graph
+
+	##################################################################
+	@staticmethod
+	def fromDict(graph, physical_node = lastSymbol, nodes = None, states = None):
+		'''
+		Build a StateGraph from a dict state -> dict (state -> weight)
+
+		Parameters:
+		-----------
+		graph: dict of (xxx -> dict of (xxx -> float))
+		physical_node: function (or dict) state -> physical node label,
+					   None if each state is its own physical node
+		nodes: list of the physical nodes (default: in order of first
+			   occurrence of their states in graph), the physical nodes
+			   of the states that are not in the list are appended
+		states: list of the states (default: in order of first
+				occurrence in graph, sources then their targets)
+
+		Returns:
+		--------
+		StateGraph
+		'''
+		if states is None:
+			index = {}
+			for src, neigh_src in graph.items():
+				index.setdefault(src, len(index))
+				for tgt in neigh_src:
+					index.setdefault(tgt, len(index))
+			states = list(index.keys())
+		else:
+			states = list(states)
+			index = {s: i for i, s in enumerate(states)}
+
+		## physical node of each state
+		if physical_node is None:
+			node_labels = states
+		elif isinstance(physical_node, dict):
+			node_labels = [physical_node[s] for s in states]
+		else:
+			node_labels = [physical_node(s) for s in states]
+		nodes = [] if nodes is None else list(nodes)
+		node_index = {n: i for i, n in enumerate(nodes)}
+		state_nodes = []
+		for n in node_labels:
+			if n not in node_index:
+				node_index[n] = len(nodes)
+				nodes.append(n)
+			state_nodes.append(node_index[n])
+
+		## CSR arcs, rows in state order
+		rows = [None] * len(states)
+		for src, neigh_src in graph.items():
+			rows[index[src]] = neigh_src
+		indptr, indices, weights = [0], [], []
+		for neigh_src in rows:
+			if neigh_src is not None:
+				indices.extend([index[tgt] for tgt in neigh_src.keys()])
+				weights.extend(neigh_src.values())
+			indptr.append(len(indices))
+		g = StateGraph(nodes, states, state_nodes, indptr, indices, weights)
+		g._stateIndex = index
+		return g
@@ -114,7 +114,7 @@ for p in params:
 		hon2_codelength_ns, hon2_gain_ns, hon2_infomap_clust, time = InfoMapClust.infomapClustering(hon2, hon2_node_weight)
 		hon2_clust_ns = clusteringBySymbol(hon2_infomap_clust)
 
-		nb_nodes_hon2_ns = len(hon2_node_weight.keys())
+		nb_nodes_hon2_ns = hon2.nbStates()
 		nb_classes_hon2_ns, nb_non_trivial_hon2_ns, sumc_hon2_ns = countClasses(hon2_clust_ns)
 		nmi_2o_ns = OverlappingNMI.NMI_max(hon2_clust_ns, clustering)
 
@@ -123,7 +123,7 @@ for p in params:
 		## VON2 using the same code word for
 		## representations of the same location in the same clusters
 		nodes, states_hon2 = InfoMapClust.getStates(hon2)
-		hon2_codelength, hon2_gain, hon2_clust, time = InfoMapClust.infomapStateClustering(nodes, states_hon2, hon2, hon2_node_weight)
+		hon2_codelength, hon2_gain, hon2_clust, time = InfoMapClust.infomapStateClustering(hon2, hon2_node_weight)
 
 		nb_nodes_hon2 = len(states_hon2.keys())
 		nb_classes_hon2, nb_non_trivial_hon2, sumc_hon2 = countClasses(hon2_clust)
@@ -135,7 +135,7 @@ for p in params:
 		ideal_hon = TestCasesGeneration.idealHON(real_net, clustering)
 		ideal_node_weight  = InfoMapClust.uniformNodeWeights(ideal_hon)
 		nodes, states_ideal = InfoMapClust.getStates(ideal_hon)
-		ideal_codelength, ideal_gain, ideal_clust, time = InfoMapClust.infomapStateClustering(nodes, states_ideal, ideal_hon, ideal_node_weight)
+		ideal_codelength, ideal_gain, ideal_clust, time = InfoMapClust.infomapStateClustering(ideal_hon, ideal_node_weight)
 
 		nb_nodes_ideal = len(states_ideal.keys())
 		nb_classes_ideal, nb_non_trivial_ideal, sumc_ideal = countClasses(ideal_clust)
@@ -144,11 +144,11 @@ for p in params:
 		line_res+=f',{nb_nodes_ideal},{ideal_codelength},{nb_classes_ideal},{round(nmi_ideal,4)}'
 
 		## FON2 Network
-		nodes, states, states_network = TestCasesGeneration.stateNetwork(real_net, clustering)
+		states_network = TestCasesGeneration.stateNetwork(real_net, clustering)
 		sta_node_weight  = InfoMapClust.uniformNodeWeights(states_network)
-		state_codelength, state_gain, state_clust, time = InfoMapClust.infomapStateClustering(nodes, states, states_network, sta_node_weight)
+		state_codelength, state_gain, state_clust, time = InfoMapClust.infomapStateClustering(states_network, sta_node_weight)
 
-		nb_states = len(states)
+		nb_states = states_network.nbStates()
 		nb_classes_state, nb_non_trivial_state, sumc_sta = countClasses(state_clust)
 		nmi_state = OverlappingNMI.NMI_max(state_clust, clustering)
 
@@ -9,6 +9,8 @@ paper.
 import subprocess
 import re
 
+from StateGraph import StateGraph
+
 def generateLFR(nb_seq=100, part_overlap = 0.01, om = 2, mu = 0.1, N=1000, k=10, kmax= 50, t1= 2, t2 = 1, minc = 10, maxc = 50):
 	'''
 	Generate a network using the LFR Benchmark with the given parameters.
@@ -53,7 +55,7 @@ def generateLFR(nb_seq=100, part_overlap = 0.01, om = 2, mu = 0.1, N=1000, k=10,
 
 def hon(network, clustering):
 	'''
-	Generate the ideal VON2 network
+	Generate the ideal VON2 network (StateGraph)
 	'''
 	hon={}
 	index_clust = 0
@@ -82,11 +84,11 @@ def hon(network, clustering):
 							if len(clusts_k)==1:
 								hon[di][tuple([k])] = 1
 
-	return hon
+	return StateGraph.fromDict(hon)
 
 def idealHON(network, clustering):
 	'''
-	Generate the Minimal VON2 network
+	Generate the Minimal VON2 network (StateGraph)
 	'''
 	hon={}
 	for i in network.keys():
@@ -115,11 +117,11 @@ def idealHON(network, clustering):
 								if tuple([k]) not in hon[di].keys():
 									hon[di][tuple([k])] = 0.
 								hon[di][tuple([k])] += 1.
-	return(hon)
+	return StateGraph.fromDict(hon)
 
 def stateNetwork(network, clustering):
 	'''
-	Generate the ideal FON2 network
+	Generate the ideal FON2 network (StateGraph)
 	'''
 	nodes = list(network.keys());
 	states = {}
@@ -153,5 +155,5 @@ def stateNetwork(network, clustering):
 							states[state_jk] = k
 							states_network[state_jk] = {}
 						states_network[state_ij][state_jk] = 1.
-	return nodes, states, states_network
+	return StateGraph.fromDict(states_network, states, nodes, states.keys())
 
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+'''
+Compact storage of a set of trajectories (sequences of locations)
+
+Every location string is interned once to an int id. All the sequences
+are stored in one flat array of ids and an offsets array:
+sequence i is tokens[offsets[i]:offsets[i+1]]
+
+The rule builder, the network builders and the accuracy functions work
+on the int ids. Strings are only decoded back at output time
+(see decodeSequence(..), decodeRules(..), decodeNetwork(..))
+'''
+from array import array
+from collections import defaultdict
+
+import numpy as np
+
+from StateGraph import StateGraph
+
+class TrajectoryCorpus():
+	##################################################################
+	def __init__(self, symbols = None):
+		self.symbols     = [] ## id -> location string
+		self.symbolIndex = {} ## location string -> id
+		self.tokens  = array('I')   ## flat array of location ids
+		self.offsets = array('q',[0]) ## start of each sequence in tokens
+		if symbols is not None:
+			for s in symbols:
+				self.intern(s)
+
+	##################################################################
+	@classmethod
+	def fromSequences(cls, sequences, symbols = None):
+		'''
+		Build a corpus from a list of (list of str)
+
+		Parameters:
+		-----------
+		sequences: list of (list of str)
+		symbols: list of str, initial symbol table (optional)
+		'''
+		corpus = cls(symbols)
+		corpus.extend(sequences)
+		return corpus
+
+	##################################################################
+	@classmethod
+	def fromArrays(cls, symbols, tokens, offsets):
+		'''
+		Corpus over existing arrays (e.g. memory-mapped .npy files, see
+		SequenceReader.loadCache(..)): they are used without copy, and
+		copied into extensible arrays only if sequences are added
+
+		Parameters:
+		-----------
+		symbols: list of str
+		tokens : numpy array of int32 or uint32, flat array of ids
+		offsets: numpy array of int64, start of each sequence (+ total length)
+		'''
+		corpus = cls(symbols)
+		corpus.tokens  = tokens
+		corpus.offsets = offsets
+		return corpus
+
+	##################################################################
+	def intern(self, symb):
+		'''
+		Returns the id of location 'symb', adding it to the symbol table
+		if needed
+		'''
+		index = self.symbolIndex.get(symb)
+		if index is None:
+			index = len(self.symbols)
+			self.symbolIndex[symb] = index
+			self.symbols.append(symb)
+		return index
+
+	##################################################################
+	def append(self, seq):
+		'''
+		Add one sequence (list of str) at the end of the corpus
+		'''
+		self.makeExtensible()
+		for s in seq:
+			self.tokens.append(self.intern(s))
+		self.offsets.append(len(self.tokens))
+
+	##################################################################
+	def extend(self, sequences):
+		'''
+		Add the sequences at the end of the corpus
+
+		Parameters:
+		-----------
+		sequences: list of (list of str) or TrajectoryCorpus
+		'''
+		self.makeExtensible()
+		if isinstance(sequences, TrajectoryCorpus):
+			if sequences.symbols is self.symbols:
+				## same symbol table: ids are copied
+				tokens = sequences.tokenArray()
+				for i in range(len(sequences)):
+					self.tokens.frombytes(tokens[sequences.offsets[i]:sequences.offsets[i+1]].tobytes())
+					self.offsets.append(len(self.tokens))
+				return
+			sequences = [sequences.decodeSequence(seq) for seq in sequences]
+		for seq in sequences:
+			self.append(seq)
+
+	##################################################################
+	def makeExtensible(self):
+		'''
+		Copy the arrays given to fromArrays(..) into arrays that can grow
+		'''
+		if not isinstance(self.tokens, array):
+			self.tokens  = array('I', np.ascontiguousarray(self.tokens, dtype=np.uint32).tobytes())
+			self.offsets = array('q', np.ascontiguousarray(self.offsets, dtype=np.int64).tobytes())
+
+	##################################################################
+	def subset(self, indexes):
+		'''
+		Returns a new corpus with the sequences of index in 'indexes'
+		sharing the same symbol table
+		'''
+		sub = TrajectoryCorpus()
+		sub.symbols     = self.symbols
+		sub.symbolIndex = self.symbolIndex
+		tokens = self.tokenArray()
+		for i in indexes:
+			sub.tokens.frombytes(tokens[self.offsets[i]:self.offsets[i+1]].tobytes())
+			sub.offsets.append(len(sub.tokens))
+		return sub
+
+	##################################################################
+	def deduplicate(self):
+		'''
+		Collapse the identical sequences
+
+		Returns:
+		--------
+		corpus: TrajectoryCorpus, distinct sequences (in order of first
+				occurrence) sharing the same symbol table
+		weights: list of int, number of occurrences of each sequence
+		'''
+		first = {} ## sequence -> index in the new corpus
+		indexes, weights = [], []
+		for i in range(len(self)):
+			key = self.tokens[self.offsets[i]:self.offsets[i+1]].tobytes()
+			j = first.get(key)
+			if j is None:
+				first[key] = len(indexes)
+				indexes.append(i)
+				weights.append(1)
+			else:
+				weights[j] += 1
+		return self.subset(indexes), weights
+
+	##################################################################
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	##################################################################
+	def __getitem__(self, i):
+		'''
+		Returns sequence i as a list of ids
+		'''
+		if i < 0:
+			i += len(self)
+		return self.tokens[self.offsets[i]:self.offsets[i+1]].tolist()
+
+	##################################################################
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self[i]
+
+	##################################################################
+	def nbSymbols(self):
+		return len(self.symbols)
+
+	##################################################################
+	def tokenArray(self):
+		'''
+		numpy view (no copy) of the flat array of ids
+		'''
+		return np.frombuffer(self.tokens, dtype=np.uint32)
+
+	##################################################################
+	def offsetArray(self):
+		'''
+		numpy view (no copy) of the offsets of the sequences
+		'''
+		return np.frombuffer(self.offsets, dtype=np.int64)
+
+	##################################################################
+	def encodeSequence(self, seq):
+		return [self.symbolIndex[s] for s in seq]
+
+	##################################################################
+	def decodeSequence(self, seq):
+		return [self.symbols[s] for s in seq]
+
+	##################################################################
+	def decodeRule(self, rule):
+		return tuple([self.symbols[s] for s in rule])
+
+	##################################################################
+	def decodeRules(self, rules):
+		'''
+		Parameters:
+		-----------
+		rules: dict tuple of int -> dict (int -> float)
+
+		Returns:
+		--------
+		dec_rules: dict tuple of str -> dict (str -> float)
+		'''
+		symbols = self.symbols
+		dec_rules = defaultdict(dict)
+		for rule, count in rules.items():
+			dec_rules[self.decodeRule(rule)] = {symbols[t]: c for t, c in count.items()}
+		return dec_rules
+
+	##################################################################
+	def decodeNetwork(self, graph):
+		'''
+		Parameters:
+		-----------
+		graph: StateGraph (as given by BuildNetwork.BuildNetwork(..)) or
+			   dict tuple of int -> dict (tuple of int -> float)
+
+		Returns:
+		--------
+		dec_graph: same type as graph, with tuples of str
+		'''
+		if isinstance(graph, StateGraph):
+			return StateGraph([self.symbols[n] for n in graph.nodes], [self.decodeRule(s) for s in graph.states],
+							  graph.stateNodes, graph.indptr, graph.indices, graph.weights)
+		dec_graph = defaultdict(dict)
+		for src, neigh_src in graph.items():
+			dec_src = self.decodeRule(src)
+			dec_graph[dec_src] = {}
+			for tgt, w in neigh_src.items():
+				dec_graph[dec_src][self.decodeRule(tgt)] = w
+		return dec_graph
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+'''
+The modules of the repository are at its top level
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
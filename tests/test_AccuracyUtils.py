@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+'''
+Scores of a weighted corpus against the scores of the corpus with its
+duplicated sequences
+'''
+import os
+
+import pytest
+
+import AccuracyUtils
+import AggOrder2Rules
+import BuildRulesFast
+import FON2StatesNetwork
+import SequenceReader
+
+MARITIME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'maritime_sequences.csv')
+
+##################################################################
+@pytest.fixture(scope='module')
+def weighted():
+	'''
+	Distinct sequences (list of ids) and their weights, and the expanded
+	corpus (each distinct sequence repeated weight times)
+	'''
+	corpus, weights = SequenceReader.readWeightedCorpus(MARITIME)
+	distinct = list(corpus)
+	expanded = [seq for seq, w in zip(distinct, weights) for _ in range(w)]
+	assert len(expanded) > len(distinct)
+	return corpus, distinct, weights, expanded
+
+##################################################################
+def test_weighted_same_scores(weighted):
+	corpus, distinct, weights, expanded = weighted
+	rules = BuildRulesFast.Order2RulesBuilder(corpus, min_support=1, ThresholdMultiplier=1., weights=weights).ExtractRules()
+	clusts = AggOrder2Rules.aggregateRules(rules)
+	firstOrderRules = {r: c for r, c in rules.items() if len(r) == 1}
+	fon2rules = FON2StatesNetwork.order2Rules(distinct, weights)
+	scorers = [lambda seqs, w: AccuracyUtils.nonAggRulesProbSeqs(rules, seqs, w),
+			   lambda seqs, w: AccuracyUtils.aggRulesProbSeqs(firstOrderRules, clusts, seqs, w),
+			   lambda seqs, w: AccuracyUtils.fonProbSeqs(fon2rules, seqs, w)]
+	for scorer in scorers:
+		score, nb_tested = scorer(distinct, weights)
+		ref, ref_nb_tested = scorer(expanded, None)
+		assert nb_tested == ref_nb_tested
+		## same sum with the terms of the duplicates grouped
+		assert score == pytest.approx(ref, rel=1e-12)
+
+##################################################################
+def test_weighted_same_order2_rules(weighted):
+	_, distinct, weights, expanded = weighted
+	rules = FON2StatesNetwork.order2Rules(distinct, weights)
+	ref = FON2StatesNetwork.order2Rules(expanded)
+	assert list(rules.keys()) == list(ref.keys())
+	for i in ref:
+		assert list(rules[i].keys()) == list(ref[i].keys())
+		for j in ref[i]:
+			assert list(rules[i][j].items()) == list(ref[i][j].items())
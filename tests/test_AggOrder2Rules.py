@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+'''
+Aggregations of AggOrder2Rules against the aggregation of the original code
+'''
+import os
+import random
+
+import heapdict
+import numpy as np
+import pytest
+
+import HONUtils
+import SequenceReader
+import BuildRulesFast
+import BuildNetwork
+import AggOrder2Rules
+import DictAggOrder2Rules
+from StateGraph import StateGraph, aggLastSymbol
+
+MARITIME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'maritime_sequences.csv')
+
+##################################################################
+@pytest.fixture(scope='module')
+def sequences():
+	return HONUtils.removeRepetitions(HONUtils.readSequenceFile(MARITIME, True, ' ', use_cache=False))
+
+##################################################################
+@pytest.fixture(scope='module')
+def rules():
+	corpus = SequenceReader.readCorpus(MARITIME, True, ' ', use_cache=False)
+	return corpus.decodeRules(BuildRulesFast.Order2RulesBuilder(corpus, 1, 1.).ExtractRules())
+
+##################################################################
+def syntheticLocation(nb_rules, seed, nb_targets = 30, nb_profiles = 2):
+	'''
+	Rules (x, 'z') drawn from a few distributions over the targets (plus
+	noise), with small and large supports: many pairs can be merged and
+	many scores are equal up to the last bits
+
+	Returns:
+	--------
+	rules: dict tuple of str -> dict (str -> float)
+	dp: distribution of the first order rule ('z',)
+	'''
+	rand = random.Random(seed)
+	targets = [f't{i}' for i in range(nb_targets)]
+	profiles = [rand.sample(targets, 4) for _ in range(nb_profiles)]
+	rules, parent = {}, {}
+	for i in range(nb_rules):
+		profile = profiles[i % nb_profiles]
+		count = {}
+		for _ in range(rand.choice([3, 5, 10, 200])):
+			t = rand.choice(profile) if rand.random() < 0.9 else rand.choice(targets)
+			count[t] = count.get(t, 0.) + 1.
+		rules[(f'x{i}', 'z')] = count
+		for t, c in count.items():
+			parent[t] = parent.get(t, 0.) + c
+	return rules, HONUtils.getDistribution(parent)
+
+##################################################################
+def sameClusters(clust, ref):
+	'''
+	Same groups in the same order (same merge order), same counts
+	'''
+	assert list(clust.keys()) == list(ref.keys())
+	for group in ref:
+		assert dict(clust[group]) == dict(ref[group])
+
+##################################################################
+def test_dense_scores_same_clusters(rules):
+	ref = DictAggOrder2Rules.aggregateRules(rules)
+	clusts = AggOrder2Rules.aggregateRules(rules)
+	assert list(clusts.keys()) == list(ref.keys())
+	for loc in ref:
+		sameClusters(clusts[loc], ref[loc])
+
+##################################################################
+## seeds where np.log2 and sums in the order of the columns gave other clusters
+@pytest.mark.parametrize('seed', [27, 29, 34, 61, 68, 81, 93])
+def test_dense_scores_same_clusters_synthetic(seed):
+	rules, dp = syntheticLocation(random.Random(seed).choice([20, 50, 100]), seed)
+	sameClusters(AggOrder2Rules.aggregate(rules, dp), DictAggOrder2Rules.aggregate(rules, dp))
+
+##################################################################
+def test_pair_scores_same_bits():
+	## the scores order the merges: they must be the same floats as the
+	## dict scores, not only close
+	rules, dp = syntheticLocation(100, 27)
+	counts = list(rules.values())
+	index = AggOrder2Rules.targetIndex(counts)
+	rows1, rows2 = np.triu_indices(len(counts), 1)
+	can_merge, score = AggOrder2Rules.pairScores(AggOrder2Rules.ClusterRows(counts, index), rows1, rows2,
+												 AggOrder2Rules.parentVector(dp, index))
+	ref = [DictAggOrder2Rules.aggregationScore(counts[i1], counts[i2], dp) for i1, i2 in zip(rows1.tolist(), rows2.tolist())]
+	assert can_merge.tolist() == [c for c, _ in ref]
+	assert score.tolist() == [s for _, s in ref]
+
+##################################################################
+@pytest.mark.parametrize('variable_order', [False, True])
+def test_pool_same_clusters_as_serial(rules, variable_order):
+	## the locations are sent to the pool largest first, the result is in
+	## the order of the serial one
+	aggregate = AggOrder2Rules.aggregateVariableOrder if variable_order else AggOrder2Rules.aggregateRules
+	ref = aggregate(rules)
+	clusts = aggregate(rules, workers=2)
+	assert list(clusts.keys()) == list(ref.keys())
+	for loc in ref:
+		sameClusters(clusts[loc], ref[loc])
+
+##################################################################
+def test_update_same_clusters_as_full_aggregation(sequences):
+	builder = BuildRulesFast.FastHONRulesBuilder(sequences[:len(sequences) // 2], 2, 1, 1.)
+	old_rules = builder.ExtractRules()
+	old_clusts = AggOrder2Rules.aggregateRules(old_rules)
+	added, removed, updated = builder.add_trajectories(sequences[len(sequences) // 2:])
+	new_rules = builder.Output
+	times = {}
+	clusts = AggOrder2Rules.updateAggregation(old_clusts, added | removed | updated, new_rules, times=times)
+	ref = AggOrder2Rules.aggregateRules(new_rules)
+	## only the locations of the changed rules are aggregated again
+	assert 0 < len(times) < len(ref)
+	assert list(clusts.keys()) == list(ref.keys())
+	for loc in ref:
+		sameClusters(clusts[loc], ref[loc])
+
+##################################################################
+@pytest.mark.parametrize('max_order', [2, 3])
+def test_contraction_same_network_as_dict_merge(sequences, max_order):
+	rules = BuildRulesFast.FastHONRulesBuilder(sequences, max_order, 1, 1.).ExtractRules()
+	clusts = AggOrder2Rules.aggregateVariableOrder(rules)
+	flatten_agg_rules = AggOrder2Rules.flattenAgg2ndOrderRules(rules, clusts)
+	graph = BuildNetwork.BuildNetwork(rules)
+	## the states in the order of StateGraph.fromDict(..) of the dict of the groups
+	ref = StateGraph.fromDict(DictAggOrder2Rules.mergeNodes(graph.toDict(), flatten_agg_rules), aggLastSymbol)
+	for network in [graph, graph.toDict()]:
+		agg_graph = AggOrder2Rules.mergeNodes(network, flatten_agg_rules)
+		assert agg_graph.nodes == ref.nodes and agg_graph.states == ref.states
+		assert agg_graph.stateNodes.tolist() == ref.stateNodes.tolist()
+		assert agg_graph.indptr.tolist() == ref.indptr.tolist()
+		assert agg_graph.indices.tolist() == ref.indices.tolist()
+		assert agg_graph.weights.tolist() == ref.weights.tolist()
+
+##################################################################
+class ScanMergeHeap(AggOrder2Rules.MergeHeap):
+	'''
+	Removes the pairs of the merged clusters by scanning all the pairs of
+	the heap, as the original code
+	'''
+	def removeClusters(self, r1, r2):
+		for pair in list(self.hd.keys()):
+			if pair[0] == r1 or pair[1] == r1 or pair[0] == r2 or pair[1] == r2:
+				del self.hd[pair]
+				self.forget(pair)
+
+##################################################################
+def test_merge_heap_same_pops_as_scan():
+	## scores with many ties: the pairs with the same score are popped
+	## in the order of the heap, which depends on the order of the removals
+	rand = random.Random(0)
+	heap, ref = AggOrder2Rules.MergeHeap(), heapdict.heapdict()
+	clusters = list(range(40))
+	for i1 in range(len(clusters)):
+		for i2 in range(i1 + 1, len(clusters)):
+			if rand.random() < 0.5:
+				score = rand.choice([0., 0.5, 1.])
+				heap.push((i1, i2), score)
+				ref[i1, i2] = score
+	new = len(clusters)
+	while len(ref) > 0:
+		(r1, r2), score = heap.popitem()
+		assert ref.popitem() == ((r1, r2), score)
+		heap.removeClusters(r1, r2)
+		for pair in list(ref.keys()):
+			if r1 in pair or r2 in pair:
+				del ref[pair]
+		clusters = [r for r in clusters if r not in (r1, r2)]
+		for r in clusters:
+			if rand.random() < 0.3:
+				score = rand.choice([0., 0.5, 1.])
+				heap.push((r, new), score)
+				ref[r, new] = score
+		clusters.append(new)
+		new += 1
+		assert list(heap.hd.keys()) == list(ref.keys())
+	assert len(heap) == 0
+
+##################################################################
+@pytest.mark.parametrize('seed', [27, 29, 34])
+def test_merge_heap_same_clusters_as_scan(monkeypatch, seed):
+	rules, dp = syntheticLocation(100, seed)
+	ref = AggOrder2Rules.aggregate(rules, dp)
+	monkeypatch.setattr(AggOrder2Rules, 'MergeHeap', ScanMergeHeap)
+	sameClusters(AggOrder2Rules.aggregate(rules, dp), ref)
+
+##################################################################
+@pytest.mark.parametrize('seed', [27, 29, 34, 61])
+def test_lsh_full_recall_same_clusters(seed):
+	## bands of one hash: all the pairs that can be merged are candidates
+	rules, dp = syntheticLocation(100, seed)
+	lsh = AggOrder2Rules.MinHashLSH(32, 1)
+	nb_pairs, nb_candidates, nb_mergeable, nb_found = AggOrder2Rules.candidateRecall(rules, dp, lsh)
+	assert nb_found == nb_mergeable and nb_candidates < nb_pairs
+	sameClusters(AggOrder2Rules.aggregate(rules, dp, lsh), AggOrder2Rules.aggregate(rules, dp))
+
+##################################################################
+def test_lsh_all_candidates_same_clusters(rules):
+	## clusters of small support are candidates with all the clusters
+	lsh = AggOrder2Rules.MinHashLSH(min_support=float('inf'))
+	ref = AggOrder2Rules.aggregateRules(rules)
+	clusts = AggOrder2Rules.aggregateRules(rules, lsh=lsh)
+	assert list(clusts.keys()) == list(ref.keys())
+	for loc in ref:
+		sameClusters(clusts[loc], ref[loc])
+
+##################################################################
+def test_variable_order_aggregation_thresholds(sequences):
+	## order 2: same groups as aggregateRules(..), the extensions of
+	## longer contexts are compared to the thresholds of their order
+	rules = BuildRulesFast.FastHONRulesBuilder(sequences, 2, 1, 1.).ExtractRules()
+	ref = AggOrder2Rules.aggregateRules(rules)
+	clusts = AggOrder2Rules.aggregateVariableOrder(rules)
+	assert [c[0] for c in clusts.keys()] == list(ref.keys())
+	assert all([list(clusts[(symb,)].items()) == list(ref[symb].items()) for symb in ref])
+	counts = [{'a': 3., 'b': 1.}, {'b': 5.}]
+	for order in [2, 3]:
+		rows = AggOrder2Rules.ClusterRows(counts, AggOrder2Rules.targetIndex(counts), order=order)
+		assert rows.thresholds.tolist() == [HONUtils.KLDThreshold(order, 4., 1.), HONUtils.KLDThreshold(order, 5., 1.)]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+'''
+Networks of BuildNetworkTrie against the networks of BuildNetwork
+'''
+import os
+
+import pytest
+
+import HONUtils
+import BuildRulesFast
+import BuildNetwork
+
+MARITIME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'maritime_sequences.csv')
+
+##################################################################
+@pytest.fixture(scope='module')
+def sequences():
+	return HONUtils.removeRepetitions(HONUtils.readSequenceFile(MARITIME, True, ' ', use_cache=False))
+
+##################################################################
+def sameNetwork(graph, ref):
+	'''
+	Same states and nodes in the same order, same CSR arcs (same order of
+	the targets of each state)
+	'''
+	assert graph.nodes == ref.nodes and graph.states == ref.states
+	assert graph.stateNodes.tolist() == ref.stateNodes.tolist()
+	assert graph.indptr.tolist() == ref.indptr.tolist()
+	assert graph.indices.tolist() == ref.indices.tolist()
+	assert graph.weights.tolist() == ref.weights.tolist()
+
+##################################################################
+def sameDict(graph, ref):
+	'''
+	Same dict networks, same order of the sources and of their targets
+	'''
+	assert list(graph.keys()) == list(ref.keys())
+	for source in ref:
+		assert list(graph[source].items()) == list(ref[source].items())
+
+##################################################################
+@pytest.mark.parametrize('max_order', [2, 3, 4, 5])
+def test_trie_same_network(sequences, max_order):
+	rules = BuildRulesFast.FastHONRulesBuilder(sequences, max_order, 1, 1.).ExtractRules()
+	ref = BuildNetwork.BuildNetwork(rules)
+	sameNetwork(BuildNetwork.BuildNetworkTrie(rules), ref)
+	sameDict(ref.toDict(), BuildNetwork.BuildNetworkDict(rules))
+
+##################################################################
+def test_trie_same_edge_order():
+	## ('b',) -> 'c' kept, ('a', 'b') -> 'c' rewired to the rule ('a', 'b', 'c')
+	## and ('c', 'a', 'b') -> 'c' to its suffix ('a', 'b', 'c') by RewireTails
+	rules = {('a',): {'b': 2}, ('b',): {'c': 1, 'a': 1}, ('c',): {'a': 2},
+			 ('a', 'b'): {'c': 3, 'a': 1}, ('c', 'a'): {'b': 2},
+			 ('a', 'b', 'c'): {'a': 1}, ('c', 'a', 'b'): {'a': 1, 'c': 1}}
+	ref = BuildNetwork.BuildNetwork(rules)
+	sameNetwork(BuildNetwork.BuildNetworkTrie(rules), ref)
+	sameDict(ref.toDict(), BuildNetwork.BuildNetworkDict(rules))
+
+##################################################################
+def test_to_dict_drops_empty_states():
+	## ('d',) is only a target: a state without arcs
+	graph = BuildNetwork.BuildNetwork({('a',): {'b': 1, 'd': 1}, ('b',): {'a': 2}})
+	assert graph.states == [('a',), ('b',), ('d',)]
+	assert list(graph.toDict().keys()) == [('a',), ('b',)]
+	assert graph.toDict(keep_empty=True)[('d',)] == {}
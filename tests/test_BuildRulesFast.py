@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+'''
+Rules of BuildRulesFast against the rule builder of the original code
+'''
+import os
+import random
+import sys
+from collections import defaultdict
+
+import pytest
+
+import HONUtils
+import BuildRulesFast
+import AggOrder2Rules
+import BuildNetwork
+from TrajectoryCorpus import TrajectoryCorpus
+from ContextIndex import ContextIndex
+from DictHONRulesBuilder import FastHONRulesBuilder as OriginalHONRulesBuilder
+
+MARITIME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'maritime_sequences.csv')
+
+##################################################################
+@pytest.fixture(scope='module')
+def sequences():
+	return HONUtils.removeRepetitions(HONUtils.readSequenceFile(MARITIME, True, ' ', use_cache=False))
+
+##################################################################
+@pytest.fixture(scope='module')
+def id_sequences(sequences):
+	return list(TrajectoryCorpus.fromSequences(sequences))
+
+##################################################################
+class OrderedSet(dict):
+	def add(self, x):
+		self[x] = None
+
+##################################################################
+class DictHONRulesBuilder(OriginalHONRulesBuilder):
+	'''
+	Rule builder of the original code with its sets of starting points and
+	extensions iterated in the order of insertion, i.e. in the order of
+	the corpus: the ties of MaxDivergence are broken by first occurrence
+	(as BuildRulesFast) instead of the iteration order of a set
+	'''
+	def __init__(self, *args):
+		OriginalHONRulesBuilder.__init__(self, *args)
+		self.SourceToExtSource = defaultdict(OrderedSet)
+		self.StartingPoints = defaultdict(OrderedSet)
+
+##################################################################
+def sameRules(rules, ref):
+	'''
+	Same rules, same counts and same order of the targets of each rule
+	'''
+	return set(rules) == set(ref) and all([list(rules[s].items()) == list(ref[s].items()) for s in ref])
+
+##################################################################
+def sameOrderedRules(rules, ref):
+	'''
+	Same rules in the same order, with their targets in the same order
+	'''
+	return list(rules) == list(ref) and all([list(rules[s].items()) == list(ref[s].items()) for s in ref])
+
+##################################################################
+@pytest.mark.parametrize('max_order', [3, 4])
+def test_same_rules_as_dict_builder(sequences, max_order):
+	ref = DictHONRulesBuilder(sequences, max_order, 1, 1.).ExtractRules()
+	rules = BuildRulesFast.FastHONRulesBuilder(sequences, max_order, 1, 1.).ExtractRules()
+	assert sameOrderedRules(rules, ref)
+
+##################################################################
+@pytest.mark.parametrize('max_order', [2, 3, 4])
+def test_same_ordered_rules_as_dict_builder(id_sequences, max_order):
+	ref = DictHONRulesBuilder(id_sequences, max_order, 1, 1.).ExtractRules()
+	rules = BuildRulesFast.FastHONRulesBuilder(TrajectoryCorpus.fromSequences(id_sequences), max_order, 1, 1.).ExtractRules()
+	assert sameOrderedRules(rules, ref)
+
+##################################################################
+def test_rules_and_aggregation_of_maritime(sequences):
+	## numbers on maritime_sequences.csv with the ties of MaxDivergence
+	## broken by first occurrence (the original code, that iterates over
+	## sets, gives 14624 and 17268 rules, and 4398 states and 24315 arcs)
+	for max_order, nb_rules in [(3, 14621), (4, 17255)]:
+		assert len(BuildRulesFast.FastHONRulesBuilder(sequences, max_order, 1, 1.).ExtractRules()) == nb_rules
+	for builder in [BuildRulesFast.FastHONRulesBuilder(sequences, 2, 1, 1.), BuildRulesFast.Order2RulesBuilder(sequences, 1, 1.)]:
+		rules = builder.ExtractRules()
+		clusts = AggOrder2Rules.aggregateRules(rules)
+		agg_network = AggOrder2Rules.mergeNodes(BuildNetwork.BuildNetwork(rules), AggOrder2Rules.flattenAgg2ndOrderRules(rules, clusts))
+		assert (agg_network.nbStates(), agg_network.nbArcs()) == (4397, 24313)
+
+##################################################################
+@pytest.mark.parametrize('max_order', [2, 4])
+def test_parallel_same_rules_as_serial(sequences, max_order):
+	## the rules of the chunks are merged in the order of the first order sources
+	ref = BuildRulesFast.FastHONRulesBuilder(sequences, max_order, 1, 1.).ExtractRules()
+	rules = BuildRulesFast.FastHONRulesBuilder(sequences, max_order, 1, 1., workers=2).ExtractRules()
+	assert sameOrderedRules(rules, ref)
+
+##################################################################
+@pytest.mark.parametrize('min_support', [1, 5])
+def test_order2_builder_same_as_dict_builder(id_sequences, min_support):
+	ref = DictHONRulesBuilder(id_sequences, 2, min_support, 1.).ExtractRules()
+	rules = BuildRulesFast.Order2RulesBuilder(TrajectoryCorpus.fromSequences(id_sequences), min_support, 1.).ExtractRules()
+	assert sameOrderedRules(rules, ref)
+
+##################################################################
+@pytest.mark.parametrize('corpus, min_support', [('short', 1), ('maritime', 1000)])
+def test_order2_builder_without_trigram(sequences, corpus, min_support):
+	## no second order extension is counted
+	if corpus == 'short':
+		sequences = [['a', 'b'], ['b', 'c'], ['d']]
+	ref = BuildRulesFast.FastHONRulesBuilder(sequences, 2, min_support, 1.).ExtractRules()
+	builder = BuildRulesFast.Order2RulesBuilder(sequences, min_support, 1.)
+	assert sameOrderedRules(builder.ExtractRules(), ref)
+	assert sameOrderedRules(builder.ExtractRulesMulti([1., 2.])[2.], ref)
+
+##################################################################
+def test_extract_rules_multi_same_as_new_builders(sequences):
+	## the extensions counted for a multiplier are reused by the next ones
+	builder = BuildRulesFast.FastHONRulesBuilder(sequences, 3, 1, 1.)
+	assert builder.ExtractRulesMulti([]) == {}
+	multi = builder.ExtractRulesMulti([4., 1., 2.])
+	assert list(multi.keys()) == [1., 2., 4.]
+	for alpha, rules in multi.items():
+		assert sameOrderedRules(rules, BuildRulesFast.FastHONRulesBuilder(sequences, 3, 1, alpha).ExtractRules())
+	assert builder.Output is multi[4.]
+
+##################################################################
+@pytest.mark.parametrize('max_order', [2, 3])
+def test_search_threshold_multiplier(sequences, max_order):
+	if max_order == 2:
+		builder = BuildRulesFast.Order2RulesBuilder(sequences, 1, 1.)
+	else:
+		builder = BuildRulesFast.FastHONRulesBuilder(sequences, max_order, 1, 1.)
+	nb_first_order = len([s for s in builder.ExtractRulesMulti([1.])[1.] if len(s) == 1])
+	target = (nb_first_order + builder.CountRules(1.)) // 2
+	alpha = builder.SearchThresholdMultiplier(target, Tolerance=1e-2)
+	assert builder.CountRules(alpha) <= target < builder.CountRules(alpha - 1e-2)
+	assert builder.SearchThresholdMultiplier(builder.CountRules(1.)) == 1.
+	## the first order rules do not depend on the multiplier
+	with pytest.raises(ValueError):
+		builder.SearchThresholdMultiplier(nb_first_order - 1)
+	with pytest.raises(ValueError):
+		builder.SearchThresholdMultiplier(target, High=1.5)
+
+##################################################################
+def test_order2_builder_same_aggregation(sequences):
+	ref = AggOrder2Rules.aggregateRules(BuildRulesFast.FastHONRulesBuilder(sequences, 2, 1, 1.).ExtractRules())
+	clusts = AggOrder2Rules.aggregateRules(BuildRulesFast.Order2RulesBuilder(sequences, 1, 1.).ExtractRules())
+	assert list(clusts.keys()) == list(ref.keys())
+	assert all([list(clusts[symb].items()) == list(ref[symb].items()) for symb in ref])
+
+##################################################################
+## recall floors below the recall of seeds 0..4 on maritime_sequences.csv
+## (0.76-0.80, 0.92 and 0.85)
+@pytest.mark.parametrize('max_order, sample_ratio, min_recall', [(3, 0.1, 0.7), (3, 0.25, 0.85), (4, 0.25, 0.8)])
+def test_sampled_rules_subset_of_exact_rules(sequences, max_order, sample_ratio, min_recall):
+	## exact counts (and order of the targets) for the rules found
+	ref = BuildRulesFast.FastHONRulesBuilder(sequences, max_order, 1, 1.).ExtractRules()
+	builder = BuildRulesFast.FastHONRulesBuilder(sequences, max_order, 1, 1.)
+	rules = builder.ExtractRulesSampled(sample_ratio, Seed=0)
+	assert builder.ExactChecks > 0
+	assert any([len(s) == max_order for s in rules])
+	assert set(rules) <= set(ref)
+	assert all([list(rules[s].items()) == list(ref[s].items()) for s in rules])
+	## rules of order >= 2 found by the sample
+	found = set([s for s in rules if len(s) > 1])
+	exact = set([s for s in ref if len(s) > 1])
+	assert len(found) >= min_recall * len(exact)
+
+##################################################################
+@pytest.mark.parametrize('sample_ratio', [0, -0.5, 1.5])
+def test_sampled_rules_invalid_ratio(sample_ratio):
+	builder = BuildRulesFast.FastHONRulesBuilder([['a', 'b', 'c']], 3, 1, 1.)
+	with pytest.raises(ValueError):
+		builder.ExtractRulesSampled(sample_ratio)
+
+##################################################################
+def test_index_segments_same_extension_counts(sequences):
+	## extensions and targets in the order of the corpus, whatever the
+	## segments of the index
+	corpus = TrajectoryCorpus.fromSequences(sequences)
+	ref = ContextIndex(corpus)
+	split = TrajectoryCorpus.fromSequences(sequences[:len(sequences) // 2])
+	index = ContextIndex(split)
+	split.extend(sequences[len(sequences) // 2:])
+	index.append(split)
+	assert len(index.segments) == 2
+	sources = [s for s in BuildRulesFast.FastHONRulesBuilder(corpus, 3, 1, 1.).ExtractRules() if len(s) < 3]
+	for source in sources:
+		counts = index.extensionCounts(source)
+		assert [(e, list(c.items())) for e, c in counts.items()] == [(e, list(c.items())) for e, c in ref.extensionCounts(source).items()]
+
+##################################################################
+def test_index_deep_sources():
+	## sources longer than the recursion limit
+	rand = random.Random(0)
+	seq = [rand.choice('abc') for _ in range(5000)]
+	sequences = [seq, seq[1000:], seq[:3500]]
+	corpus = TrajectoryCorpus.fromSequences(sequences)
+	for start, stop in [(0, 3000), (1200, 4200), (500, 4999)]:
+		source = tuple(corpus.encodeSequence(seq[start:stop]))
+		assert len(source) > sys.getrecursionlimit()
+		## brute force: positions where source ends
+		ends = [corpus.offsetArray()[i] + e for i, s in enumerate(sequences)
+				for e in range(len(source) - 1, len(s)) if s[e - len(source) + 1:e + 1] == seq[start:stop]]
+		seg = ContextIndex(corpus).segments[0]
+		assert sorted(seg.sa[slice(*seg.find(source))].tolist()) == ends
+		## from the range of a suffix already found
+		seg = ContextIndex(corpus).segments[0]
+		seg.find(source[len(source) // 2:])
+		assert sorted(seg.sa[slice(*seg.find(source))].tolist()) == ends
+
+##################################################################
+@pytest.mark.parametrize('max_order', [2, 3, 4, 5])
+def test_weighted_corpus_same_rules(sequences, max_order):
+	## same rules in the same order, with the same counts
+	corpus = TrajectoryCorpus.fromSequences(sequences)
+	ref = BuildRulesFast.FastHONRulesBuilder(corpus, max_order, 1, 1.).ExtractRules()
+	distinct, weights = corpus.deduplicate()
+	assert len(distinct) < len(corpus)
+	rules = BuildRulesFast.FastHONRulesBuilder(distinct, max_order, 1, 1., weights=weights).ExtractRules()
+	assert sameOrderedRules(rules, ref)
+
+##################################################################
+@pytest.mark.parametrize('max_order', [2, 3, 4])
+def test_add_trajectories_same_as_rebuild(sequences, max_order):
+	## same rules, with their targets in the same order
+	ref = BuildRulesFast.FastHONRulesBuilder(sequences, max_order, 1, 1.).ExtractRules()
+	half = len(sequences) // 2
+	builder = BuildRulesFast.FastHONRulesBuilder(sequences[:half], max_order, 1, 1.)
+	builder.ExtractRules()
+	builder.add_trajectories(sequences[half:half + 100])
+	builder.add_trajectories(sequences[half + 100:])
+	assert sameRules(builder.Output, ref)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+'''
+FON2 networks of buildFON2NetworkFast against buildFON2Network
+'''
+import os
+
+import pytest
+
+import HONUtils
+import FON2StatesNetwork
+from TrajectoryCorpus import TrajectoryCorpus
+
+MARITIME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'maritime_sequences.csv')
+
+##################################################################
+@pytest.fixture(scope='module')
+def sequences():
+	return HONUtils.removeRepetitions(HONUtils.readSequenceFile(MARITIME, True, ' ', use_cache=False))
+
+##################################################################
+def sameNetwork(graph, ref):
+	'''
+	Same nodes and states in the same order, same CSR arcs and weights
+	'''
+	assert list(graph.nodes) == list(ref.nodes) and list(graph.states) == list(ref.states)
+	assert graph.stateNodes.tolist() == ref.stateNodes.tolist()
+	assert graph.indptr.tolist() == ref.indptr.tolist()
+	assert graph.indices.tolist() == ref.indices.tolist()
+	assert graph.weights.tolist() == ref.weights.tolist()
+
+##################################################################
+def test_fast_same_network(sequences):
+	ref = FON2StatesNetwork.buildFON2Network(sequences)
+	assert ref.nbArcs() > 0
+	sameNetwork(FON2StatesNetwork.buildFON2NetworkFast(sequences), ref)
+	sameNetwork(FON2StatesNetwork.buildFON2NetworkFast(TrajectoryCorpus.fromSequences(sequences)), ref)
+
+##################################################################
+def test_fast_same_weighted_network(sequences):
+	corpus, weights = TrajectoryCorpus.fromSequences(sequences).deduplicate()
+	distinct = [corpus.decodeSequence(seq) for seq in corpus]
+	ref = FON2StatesNetwork.buildFON2Network(distinct, weights)
+	sameNetwork(FON2StatesNetwork.buildFON2NetworkFast(corpus, weights), ref)
+	## a sequence of weight w counts as w identical sequences
+	sameNetwork(ref, FON2StatesNetwork.buildFON2Network(sequences))
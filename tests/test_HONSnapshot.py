@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+'''
+Snapshots of HONSnapshot saved and loaded again
+'''
+import pytest
+
+import HONSnapshot
+import BuildNetwork
+
+##################################################################
+@pytest.mark.parametrize('symbols', [['a', 'b', 'c'], [3, 1, 2], ['a', 1, '2']])
+def test_rules_and_network_round_trip(tmp_path, symbols):
+	x, y, z = symbols
+	rules = {(x,): {y: 2, z: 1}, (y,): {z: 3.}, (x, y): {z: 1}, (z,): {x: 1}}
+	## int and str symbols compare as different: the types are kept
+	HONSnapshot.saveRules(str(tmp_path / 'rules'), rules)
+	assert list(HONSnapshot.loadRules(str(tmp_path / 'rules')).items()) == list(rules.items())
+	graph = BuildNetwork.BuildNetwork(rules)
+	HONSnapshot.saveNetwork(str(tmp_path / 'network'), graph)
+	loaded = HONSnapshot.loadNetwork(str(tmp_path / 'network'))
+	assert loaded.nodes == graph.nodes and loaded.states == graph.states
+	assert [loaded.stateNodes.tolist(), loaded.indptr.tolist(), loaded.indices.tolist(), loaded.weights.tolist()] == \
+		   [graph.stateNodes.tolist(), graph.indptr.tolist(), graph.indices.tolist(), graph.weights.tolist()]
+
+##################################################################
+def test_snapshot_key_has_builder_version(tmp_path, monkeypatch):
+	filename = tmp_path / 'sequences.csv'
+	filename.write_text('1 a b c\n')
+	path = HONSnapshot.snapshotPath(str(filename), 'rules', {'max_order': 2})
+	monkeypatch.setattr(HONSnapshot.BuildRulesFast, 'BUILDER_VERSION', HONSnapshot.BuildRulesFast.BUILDER_VERSION + 1)
+	assert HONSnapshot.snapshotPath(str(filename), 'rules', {'max_order': 2}) != path
+
+##################################################################
+def test_aggregation_round_trip_and_key(tmp_path, monkeypatch):
+	clusts = {'c': {(('a', 'c'), ('b', 'c')): {'d': 2, 'e': 1}, (('c',),): {'d': 1}}, 'd': {}, 'e': {(('c', 'e'),): {'a': 3}}}
+	HONSnapshot.saveAggregation(str(tmp_path / 'aggregation'), clusts)
+	loaded = HONSnapshot.loadAggregation(str(tmp_path / 'aggregation'))
+	assert list(loaded.keys()) == list(clusts.keys())
+	assert [list(loaded[loc].items()) for loc in clusts] == [list(c.items()) for c in clusts.values()]
+	filename = tmp_path / 'sequences.csv'
+	filename.write_text('1 a b c\n')
+	rules_path = HONSnapshot.snapshotPath(str(filename), 'rules', {'max_order': 2})
+	path = HONSnapshot.snapshotPath(str(filename), 'aggregation', {'max_order': 2})
+	monkeypatch.setattr(HONSnapshot.AggOrder2Rules, 'AGG_VERSION', HONSnapshot.AggOrder2Rules.AGG_VERSION + 1)
+	assert HONSnapshot.snapshotPath(str(filename), 'aggregation', {'max_order': 2}) != path
+	assert HONSnapshot.snapshotPath(str(filename), 'rules', {'max_order': 2}) == rules_path
+
+##################################################################
+def test_file_hash_computed_once(tmp_path, monkeypatch):
+	filename = tmp_path / 'sequences.csv'
+	filename.write_text('1 a b c\n')
+	cache_dir = str(tmp_path / 'snapshots')
+	digest = HONSnapshot.fileHash(str(filename), cache_dir)
+	## next run (empty memory): read from the record of cache_dir,
+	## not computed again
+	(record,) = (tmp_path / 'snapshots' / 'hashes').iterdir()
+	size, mtime, _ = record.read_text().split()
+	record.write_text(f'{size} {mtime} recorded\n')
+	monkeypatch.setattr(HONSnapshot, '_fileHashes', {})
+	assert HONSnapshot.fileHash(str(filename), cache_dir) == 'recorded'
+	## new size: hashed again
+	filename.write_text('1 a b c d\n')
+	assert HONSnapshot.fileHash(str(filename), cache_dir) != digest
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+'''
+Batch divergence tests of HONUtils against the dict functions
+'''
+import math
+
+import numpy as np
+import pytest
+
+import HONUtils
+
+##################################################################
+def dictTests(child, parent, indptr, parent_supports, order, ThresholdMultiplier):
+	'''
+	Divergences, thresholds and bounds with KLD(..), MaxDivergence(..)
+	and KLDThreshold(..) (as in the original rule builder)
+	'''
+	divergences, thresholds, bounds = [], [], []
+	for r in range(len(indptr) - 1):
+		count  = {t: c for t, c in enumerate(child[indptr[r]:indptr[r+1]]) if c > 0}
+		dparent = {t: c / parent_supports[r] for t, c in enumerate(parent[indptr[r]:indptr[r+1]]) if c > 0}
+		distr = HONUtils.getDistribution(count)
+		divergences.append(HONUtils.KLD(distr, dparent))
+		thresholds.append(HONUtils.KLDThreshold(order, sum(count.values()), ThresholdMultiplier))
+		bounds.append(HONUtils.KLD(HONUtils.MaxDivergence(distr), dparent))
+	return divergences, thresholds, bounds
+
+##################################################################
+@pytest.mark.parametrize('small_batch, log2_cap', [(HONUtils.SMALL_BATCH, HONUtils.LOG2_CAP), (-1, HONUtils.LOG2_CAP), (-1, 16)])
+def test_same_tests_as_dict_functions(monkeypatch, small_batch, log2_cap):
+	## (log2_cap: counts and supports larger than the log2 table)
+	monkeypatch.setattr(HONUtils, 'SMALL_BATCH', small_batch)
+	monkeypatch.setattr(HONUtils, 'LOG2_CAP', log2_cap)
+	monkeypatch.setattr(HONUtils, 'LOG2_TABLE', np.zeros(1))
+	rng = np.random.default_rng(0)
+	for _ in range(100):
+		indptr = np.concatenate(([0], np.cumsum(rng.integers(1, 8, rng.integers(1, 40)))))
+		child  = rng.integers(0, 20, indptr[-1])
+		child[indptr[:-1]] += 1
+		parent = rng.integers(0, 30, indptr[-1])
+		parent_supports = np.add.reduceat(parent, indptr[:-1]) + rng.integers(1, 50, len(indptr) - 1)
+		multiplier = float(rng.choice([0.5, 1., 2.]))
+		divergences, thresholds, bounds = HONUtils.countKLDBatch(child, parent, indptr, parent_supports, 2, multiplier)
+		ref = dictTests(child.tolist(), parent.tolist(), indptr.tolist(), parent_supports.tolist(), 2, multiplier)
+		assert np.allclose(divergences, ref[0], rtol=1e-12, atol=1e-13)
+		assert thresholds.tolist() == ref[1]
+		assert bounds.tolist() == ref[2]
+		assert (divergences > thresholds).tolist() == [d > t for d, t in zip(ref[0], ref[1])]
+
+##################################################################
+@pytest.mark.parametrize('small_batch', [HONUtils.SMALL_BATCH, -1])
+def test_tie_with_threshold(monkeypatch, small_batch):
+	## KLD = log2(6 / 3) = 1 = KLDThreshold(2, 3, 1.)
+	monkeypatch.setattr(HONUtils, 'SMALL_BATCH', small_batch)
+	divergences, thresholds, bounds = HONUtils.countKLDBatch([3], [3], [0, 1], [6], 2, 1.)
+	assert divergences.tolist() == [1.] and thresholds.tolist() == [1.] and bounds.tolist() == [1.]
+
+##################################################################
+def test_dict_functions():
+	distr = HONUtils.getDistribution({'b': 1, 'a': 2, 'c': 1})
+	assert list(distr.items()) == [('b', 0.25), ('a', 0.5), ('c', 0.25)]
+	assert HONUtils.MaxDivergence(distr) == {'b': 1}
+	assert HONUtils.KLD({'a': 0.5, 'b': 0.5, 'c': 0.}, {'a': 0.25, 'b': 0.75, 'd': 1.}) == 0.5 * math.log(2., 2) + 0.5 * math.log(0.5 / 0.75, 2)
+	assert HONUtils.KLDThreshold(2, 3, 1.) == 1.
+	with pytest.raises(ZeroDivisionError):
+		HONUtils.KLDThreshold(2, 0, 1.)
+
+##################################################################
+def test_log2_table_capped(monkeypatch):
+	monkeypatch.setattr(HONUtils, 'LOG2_CAP', 100)
+	monkeypatch.setattr(HONUtils, 'LOG2_TABLE', np.zeros(1))
+	assert len(HONUtils.log2Table(10**6)) == 101
+	values = [0, 1, 3, 100, 101, 10**6]
+	assert HONUtils.log2Ints(values).tolist() == [0.] + [math.log(v, 2) for v in values[1:]]
+	assert len(HONUtils.LOG2_TABLE) == 101
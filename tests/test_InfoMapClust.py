@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+'''
+Pajek files written by InfoMapClust for the StateGraphs of the networks
+'''
+import InfoMapClust
+import FON2StatesNetwork
+from TrajectoryCorpus import TrajectoryCorpus
+
+##################################################################
+def test_print_fon2_graph(tmp_path):
+	## the states of a FON2 network are a PairLabels, not a list
+	corpus = TrajectoryCorpus.fromSequences([['a', 'b', 'c'], ['b', 'c', 'a', 'b']])
+	graph = FON2StatesNetwork.buildFON2NetworkFast(corpus)
+	filename, map_rule = InfoMapClust.printGraph(graph, InfoMapClust.uniformNodeWeights(graph), 'fon2', str(tmp_path) + '/')
+	assert map_rule == [None] + list(graph.states)
+	with open(filename) as file_net:
+		lines = file_net.read().splitlines()
+	assert lines[0] == f'*Vertices {graph.nbStates()}'
+	assert lines[1:1+graph.nbStates()] == [f'{i+1} "{s}" 1.0' for i, s in enumerate(graph.states)]
+	assert len(lines) == 2 + graph.nbStates() + graph.nbArcs()
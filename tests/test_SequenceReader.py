@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+'''
+Sequences read from the binary cache against the parsed file
+'''
+import gzip
+import os
+import subprocess
+import sys
+import zipfile
+
+import numpy as np
+import pytest
+
+import HONUtils
+import SequenceReader
+
+##################################################################
+def test_cache_same_sequences(tmp_path):
+	filename = str(tmp_path / 'sequences.csv')
+	with open(filename, 'w') as f:
+		f.write('1 a b b c\n2 c\n3 b a\n4 a b b c\n')
+	ref = HONUtils.readSequenceFile(filename, True, ' ', use_cache=False)
+	cache_dir = str(tmp_path / 'cache')
+	## written by the first call, read by the second one
+	for _ in range(2):
+		assert HONUtils.readSequenceFile(filename, True, ' ', use_cache=True, cache_dir=cache_dir) == ref
+	assert len(os.listdir(cache_dir)) == 1
+	ids = []
+	corpus = SequenceReader.readCorpus(filename, True, ' ', ids=ids, use_cache=True, cache_dir=cache_dir)
+	assert [corpus.decodeSequence(seq) for seq in corpus] == HONUtils.removeRepetitions(ref)
+	assert ids == ['1', '3', '4']
+	## new size: the cache is written again
+	with open(filename, 'a') as f:
+		f.write('5 c a\n')
+	assert HONUtils.readSequenceFile(filename, True, ' ', use_cache=True, cache_dir=cache_dir) == ref + [['c', 'a']]
+
+##################################################################
+@pytest.mark.parametrize('chunk_size', [SequenceReader.CHUNK_SIZE, 5])
+def test_compressed_same_sequences(tmp_path, chunk_size):
+	lines = ['1 a b b c\n', '2 c\n', '3 b a\n', '4 a b b c\n', '5 c a a b\n']
+	filename = str(tmp_path / 'sequences.csv')
+	with open(filename, 'w') as f:
+		f.writelines(lines)
+	with gzip.open(str(tmp_path / 'sequences.csv.gz'), 'wt') as f:
+		f.writelines(lines)
+	## two files in the archive
+	with zipfile.ZipFile(str(tmp_path / 'sequences.zip'), 'w') as archive:
+		archive.writestr('part0.csv', ''.join(lines[:2]))
+		archive.writestr('part1.csv', ''.join(lines[2:]))
+	ref = list(SequenceReader.iterSequences(filename, True, ' ', chunk_size=chunk_size))
+	assert ref == [['a', 'b', 'c'], ['b', 'a'], ['a', 'b', 'c'], ['c', 'a', 'b']]
+	for name in ['sequences.csv.gz', 'sequences.zip']:
+		assert list(SequenceReader.iterSequences(str(tmp_path / name), True, ' ', chunk_size=chunk_size)) == ref
+		corpus = SequenceReader.readCorpus(str(tmp_path / name), True, ' ', chunk_size=chunk_size)
+		assert [corpus.decodeSequence(seq) for seq in corpus] == ref
+
+##################################################################
+def test_cache_memory_mapped(tmp_path):
+	filename = str(tmp_path / 'sequences.csv')
+	with open(filename, 'w') as f:
+		f.write('1 a b b c\n2 c\n3 b a\n4 a b b c\n')
+	ref = SequenceReader.readCorpus(filename, True, ' ')
+	for _ in range(2):
+		corpus = SequenceReader.readCorpus(filename, True, ' ', use_cache=True)
+	## tokens and offsets of the cache are not copied
+	assert isinstance(corpus.tokens, np.memmap) and isinstance(corpus.offsets, np.memmap)
+	assert list(corpus) == list(ref) and corpus.symbols == ref.symbols
+	assert [list(c) for c in corpus.deduplicate()[0]] == [list(c) for c in ref.deduplicate()[0]]
+	## copied when the corpus grows
+	corpus.append(['c', 'd'])
+	assert list(corpus) == list(ref) + [[2, 3]]
+	## readSequenceFile uses the cache by default (its own key: the repetitions are kept)
+	assert HONUtils.readSequenceFile(filename, True, ' ') == HONUtils.readSequenceFile(filename, True, ' ', use_cache=False)
+	assert len([name for name in os.listdir(str(tmp_path)) if name.endswith('.corpus')]) == 2
+
+##################################################################
+def test_no_import_cycle():
+	## HONUtils is imported by the rule builders: it imports SequenceReader only when it is used
+	code = 'import sys, HONUtils; assert "SequenceReader" not in sys.modules and "BuildRulesFast" not in sys.modules'
+	subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.abspath(HONUtils.__file__)))
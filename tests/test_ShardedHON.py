@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+'''
+Rules of ShardedHON against the rules of the whole corpus
+'''
+import os
+
+import pytest
+
+import BuildRulesFast
+import CountTables
+import SequenceReader
+import ShardedHON
+
+MARITIME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'maritime_sequences.csv')
+
+##################################################################
+@pytest.fixture(scope='module')
+def shards(tmp_path_factory):
+	'''
+	maritime_sequences.csv split into 5 files
+	'''
+	with open(MARITIME) as f:
+		lines = f.readlines()
+	path = tmp_path_factory.mktemp('shards')
+	filenames = []
+	for i in range(5):
+		filenames.append(str(path / f'day{i}.csv'))
+		with open(filenames[-1], 'w') as f:
+			f.writelines(lines[i * len(lines) // 5:(i + 1) * len(lines) // 5])
+	return filenames
+
+##################################################################
+def sameRules(rules, ref):
+	return set(rules) == set(ref) and all([list(rules[s].items()) == list(ref[s].items()) for s in ref])
+
+##################################################################
+@pytest.mark.parametrize('max_order, workers', [(2, 1), (2, 2), (3, 1), (4, 2)])
+def test_same_rules_as_fast_builder(shards, monkeypatch, max_order, workers):
+	## small REDUCE_ROWS: the shard tables are reduced several times
+	monkeypatch.setattr(CountTables, 'REDUCE_ROWS', 1000)
+	corpus = SequenceReader.readCorpus(MARITIME)
+	ref = corpus.decodeRules(BuildRulesFast.FastHONRulesBuilder(corpus, max_order, 1, 1.).ExtractRules())
+	rules = ShardedHON.ShardedHONRulesBuilder(shards, max_order, 1, 1., workers=workers).ExtractRules()
+	## same ties of MaxDivergence: same rules in the same order
+	assert list(rules) == list(ref) and sameRules(rules, ref)
+
+##################################################################
+@pytest.mark.parametrize('max_order, min_support', [(3, 1), (4, 2)])
+def test_add_trajectories_same_as_all_files(shards, max_order, min_support):
+	ref = ShardedHON.ShardedHONRulesBuilder(shards, max_order, min_support, 1.).ExtractRules()
+	builder = ShardedHON.ShardedHONRulesBuilder(shards[:3], max_order, min_support, 1.)
+	rules = builder.ExtractRules()
+	builder.add_trajectories(SequenceReader.readCorpus(shards[3]))
+	builder.add_trajectories(*SequenceReader.readCorpus(shards[4]).deduplicate())
+	assert sameRules(rules, ref)
+
+##################################################################
+def test_shard_cache(shards, tmp_path):
+	ref = ShardedHON.ShardedHONRulesBuilder(shards, 2, 1, 1.).ExtractRules()
+	cache_dir = str(tmp_path / 'cache')
+	## written by the first builder, read by the second one
+	for _ in range(2):
+		rules = ShardedHON.ShardedHONRulesBuilder(shards, 2, 1, 1., use_cache=True, cache_dir=cache_dir).ExtractRules()
+		assert sameRules(rules, ref)
+	assert len(os.listdir(cache_dir)) == len(shards)
+	assert not any([f.endswith('.corpus') for f in os.listdir(os.path.dirname(shards[0]))])
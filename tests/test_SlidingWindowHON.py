@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+'''
+Rules of SlidingWindowHON against the rules built again from its counts
+'''
+import copy
+import os
+
+import pytest
+
+import HONUtils
+import BuildNetwork
+import BuildRulesFast
+from SlidingWindowHON import SlidingWindowHON
+
+MARITIME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'maritime_sequences.csv')
+
+##################################################################
+@pytest.fixture(scope='module')
+def sequences():
+	return HONUtils.removeRepetitions(HONUtils.readSequenceFile(MARITIME, True, ' ', use_cache=False))[:600]
+
+##################################################################
+def decoded(rules):
+	return {s: dict(count) for s, count in rules.items()}
+
+##################################################################
+@pytest.mark.parametrize('max_order, min_support', [(2, 1), (3, 1), (4, 2)])
+def test_window_same_as_rebuild(sequences, max_order, min_support):
+	window = SlidingWindowHON(max_order, min_support, 1.)
+	ids = []
+	for seq in sequences:
+		ids.append(window.push(seq)[0])
+		if len(ids) > 300:
+			window.expire(ids.pop(0))
+	ref = copy.deepcopy(window)
+	ref.ResetRules(1.)
+	ref.GenerateAllRules()
+	rules = ref.Corpus.decodeRules(ref.Rules)
+	assert decoded(window.getRules()) == decoded(rules)
+	assert decoded(window.getNetwork().toDict()) == decoded(BuildNetwork.BuildNetwork(rules).toDict())
+
+##################################################################
+@pytest.mark.parametrize('max_order, min_support', [(3, 1), (4, 2)])
+def test_push_then_expire_same_as_rebuild(sequences, max_order, min_support):
+	## the subtrees of extensions kept from the previous updates give
+	## the rules of a window that never had the expired trajectories
+	window = SlidingWindowHON(max_order, min_support, 1.)
+	for seq in sequences[:300]:
+		window.push(seq)
+	before = decoded(window.getRules())
+	ids = [window.push(seq)[0] for seq in sequences[300:]]
+	for trajectory_id in ids:
+		window.expire(trajectory_id)
+	assert decoded(window.getRules()) == before
+	ref = SlidingWindowHON(max_order, min_support, 1.)
+	for seq in sequences[:300]:
+		ref.push(seq)
+	ref.ResetRules(1.)
+	ref.GenerateAllRules()
+	rules = ref.Corpus.decodeRules(ref.Rules)
+	assert decoded(window.getRules()) == decoded(rules)
+	assert decoded(window.getNetwork().toDict()) == decoded(BuildNetwork.BuildNetwork(rules).toDict())
+
+##################################################################
+def test_push_cost_does_not_grow_with_window(sequences, monkeypatch):
+	## number of contexts tested again by the same pushes and expirations
+	## in a window of 100 and of 500 trajectories
+	tested = [0]
+	pair_tests = BuildRulesFast.FastHONRulesBuilder.PairDivergenceTests
+	def countTests(self, pairs, order):
+		tested[0] += len(pairs)
+		return pair_tests(self, pairs, order)
+	monkeypatch.setattr(BuildRulesFast.FastHONRulesBuilder, 'PairDivergenceTests', countTests)
+	counts = []
+	for size in [100, 500]:
+		window = SlidingWindowHON(3, 1, 1.)
+		ids = [window.push(seq)[0] for seq in sequences[500 - size:500]]
+		tested[0] = 0
+		for seq in sequences[500:]:
+			ids.append(window.push(seq)[0])
+			window.expire(ids.pop(0))
+		counts.append(tested[0])
+	assert counts[1] < 1.3 * counts[0]
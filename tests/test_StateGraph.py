@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+'''
+StateGraph built from the dict networks
+'''
+from StateGraph import StateGraph
+
+##################################################################
+def test_from_dict_appends_missing_nodes():
+	graph = {('a', 'b'): {('b', 'c'): 2., ('b', 'd'): 1.}, ('b', 'c'): {('c', 'd'): 1.}}
+	g = StateGraph.fromDict(graph, nodes=['d', 'b'])
+	assert g.nodes == ['d', 'b', 'c']
+	assert g.states == [('a', 'b'), ('b', 'c'), ('b', 'd'), ('c', 'd')]
+	assert g.stateNodes.tolist() == [1, 2, 0, 0]
+	assert g.stateToNode() == {('a', 'b'): 'b', ('b', 'c'): 'c', ('b', 'd'): 'd', ('c', 'd'): 'd'}
+	assert g.toDict() == graph